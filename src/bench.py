@@ -0,0 +1,292 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+from devices import bose, metrics
+from devices.framing import FrameDecoder, FrameEncoder
+from devices.helpers import MacAddress, _applyBitmask, _bytesToMacAddress
+from devices.simulator import BoseSimulator, SimulatedBoseDevice
+from scanners import batch
+from scanners.bose import BoseParser, BoseMFSParserLegacy, BoseMFSParser104
+from types import SimpleNamespace
+
+BoseDevice = bose.BoseDevice
+
+_BENCHMARKS = {}
+
+def benchmark(name, batched=True):
+  """
+  Registers a benchmark; the decorated function does the setup and returns (operation, cleanup or None). Operations
+  that are too fast to be timed on their own are run in batches, slow ones (batched=False) are timed one by one.
+  """
+  def register(setup):
+    _BENCHMARKS[name] = (setup, batched)
+    return setup
+  return register
+
+
+############
+#  CODECS  #
+############
+
+@benchmark("frame.encode")
+def _frameEncode():
+  encoder = FrameEncoder()
+  return lambda: encoder.encode(0x01, 0x06, 0x02, (0x01,)), None
+
+@benchmark("frame.decode")
+def _frameDecode():
+  encoder = FrameEncoder()
+  data = encoder.encodeAll([(0x01, function, 0x03, bytes(range(function))) for function in range(1, 17)])
+  decoder = FrameDecoder()
+  def decode():
+    decoder.feed(data)
+    for frame in decoder.frames():
+      pass
+  return decode, None
+
+@benchmark("codec.decodeAll")
+def _decodeAll():
+  device = SimulatedBoseDevice()
+  block = BoseDevice.FunctionBlock.SETTINGS.value
+  values = [(function, payload) for (b, function), payload in device.state.items() if b == block]
+  return lambda: BoseDevice._decodeAll(BoseDevice.FunctionBlock.SETTINGS, values), None
+
+
+##############
+#  SCANNERS  #
+##############
+
+@benchmark("scanner.parseLegacy")
+def _parseLegacy():
+  data = bytes([0x10, 0x02, 0x40, 0x20, 0x01, 0b00110011]) + bytes(range(1, 7)) + bytes(range(7, 13))
+  return lambda: BoseMFSParserLegacy.decode(data), None
+
+@benchmark("scanner.parse104")
+def _parse104():
+  data = bytes([0x01, 0x2a, 0b10110001, 0b00000110, 0, 0, 0, 0, 0]) + bytes([1, 2, 3, 4, 5, 6])
+  return lambda: BoseMFSParser104.decode(data), None
+
+@benchmark("scanner.parseRepeated")
+def _parseRepeated():
+  device = SimpleNamespace(address="60:AB:D2:B0:BD:47", name="LE-Bose QC35 II")
+  advertisement = SimpleNamespace(manufacturer_data={0x0210: bytes([0x40, 0x20, 0x01, 0b00100001, 1, 2, 3, 4, 5, 6])}, local_name=None, platform_data=())
+  return lambda: BoseParser.parse(device, advertisement), None
+
+if batch.numpy is not None:
+  @benchmark("scanner.batchDecode")
+  def _batchDecode():
+    records = [bytes([0x10, 0x02, 0x40, 0x20, 0x01, 0b00110011]) + bytes(range(1, 13)), bytes([0x01, 0x2a, 0b10110001, 0b00000110, 0, 0, 0, 0, 0]) + bytes(range(1, 7))] * 500
+    buffer, offsets = batch.pack(records)
+    return lambda: batch.decode(buffer, offsets), None # 1000 records per operation
+
+
+#############
+#  HELPERS  #
+#############
+
+@benchmark("helpers.applyBitmask")
+def _applyBitmaskBenchmark():
+  return lambda: _applyBitmask(BoseDevice.FunctionBlock, b"\x20\x06\x97"), None
+
+@benchmark("helpers.bytesToMacAddress")
+def _bytesToMacAddressBenchmark():
+  data = bytes([0x4c, 0x87, 0x5d, 0x09, 0x61, 0x16])
+  return lambda: _bytesToMacAddress(data), None
+
+@benchmark("helpers.macAddressFromBuffer")
+def _macAddressFromBufferBenchmark():
+  data = bytes([0x01, 0x4c, 0x87, 0x5d, 0x09, 0x61, 0x16])
+  return lambda: MacAddress.fromBuffer(data, 1), None
+
+@benchmark("helpers.macAddressToBytes")
+def _macAddressToBytesBenchmark():
+  return lambda: bytes(MacAddress("4c:87:5d:09:61:16")), None
+
+
+#################
+#  ROUND TRIPS  #
+#################
+
+# timed one by one, so p99 shows the slow round trips instead of averaging them into a batch
+
+def _simulatedDevice():
+  simulator = BoseSimulator().start()
+  device = BoseDevice("00:00:00:00:00:00", sock=simulator.connect())
+  def cleanup():
+    device.close()
+    simulator.close()
+  return device, cleanup
+
+@benchmark("roundtrip.getAnr", batched=False)
+def _getAnr():
+  device, cleanup = _simulatedDevice()
+  return device.getAnr, cleanup
+
+@benchmark("roundtrip.setCnc", batched=False)
+def _setCnc():
+  device, cleanup = _simulatedDevice()
+  return lambda: device.setCnc(11, 5), cleanup
+
+@benchmark("roundtrip.getAllSettings", batched=False)
+def _getAllSettings():
+  device, cleanup = _simulatedDevice()
+  return device.getAllSettings, cleanup
+
+@benchmark("roundtrip.getAnrInstrumented", batched=False)
+def _getAnrInstrumented():
+  device, cleanup = _simulatedDevice()
+  previous = metrics.active
+  metrics.enable()
+  def restore():
+    metrics.active = previous
+    cleanup()
+  return device.getAnr, restore
+
+
+#############
+#  IMPORTS  #
+#############
+
+# module -> (budget for its cumulative import time in milliseconds, modules it must not import on the way),
+# also checked by tests/test_imports.py
+IMPORT_CHECKS = {
+  "devices.bose": (75, ("bleak", "asyncio")),
+  "scanners.scan": (100, ("bleak", "asyncio")),
+  "cli": (100, ("bleak", "asyncio", "scanners.scan", "daemon")),
+}
+
+def importTimes(module, runs=5):
+  """Cumulative import times in microseconds of module and everything it imports, the best of runs fresh interpreters"""
+  best = {}
+  for _ in range(runs):
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"], capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+    if result.returncode != 0:
+      raise Exception(f"Importing {module} failed: {result.stderr.splitlines()[-1:]}")
+    for line in result.stderr.splitlines():
+      if not line.startswith("import time:"):
+        continue
+      _, cumulative, name = line[len("import time:"):].split("|")
+      if not cumulative.strip().isdigit(): # header
+        continue
+      name = name.strip()
+      best[name] = min(int(cumulative), best.get(name, int(cumulative)))
+  return best
+
+def checkImports(checks=IMPORT_CHECKS):
+  """Returns the violated import budgets and forbidden imports"""
+  failures = []
+  for module, (budget, forbidden) in checks.items():
+    times = importTimes(module)
+    milliseconds = times[module] / 1000
+    print(f"import {module:26} {milliseconds:>8.1f} ms   budget {budget:>6.1f} ms")
+    if milliseconds > budget:
+      failures.append(f"{module} takes {milliseconds:.1f} ms to import, budget is {budget} ms")
+    failures += [f"{module} imports {name}" for name in forbidden if name in times]
+  return failures
+
+
+def _percentile(values, percentile):
+  values = sorted(values)
+  return values[min(len(values) - 1, int(len(values) * percentile))]
+
+def run(name, duration=0.5, batch=None):
+  """
+  Runs a benchmark for about duration seconds. p50/p99 are percentiles of the time per operation, for batched
+  benchmarks (batch > 1 in the result) of the mean time per operation of each batch.
+  """
+  setup, batched = _BENCHMARKS[name]
+  operation, cleanup = setup()
+  try:
+    operation() # warm up, e.g. the codec tables and layouts are only built on first use
+    if batch is None and not batched:
+      batch = 1
+    if batch is None: # calibrate, so one batch takes about a millisecond
+      batch = 1
+      while True:
+        start = time.perf_counter()
+        for _ in range(batch):
+          operation()
+        if time.perf_counter() - start > 0.001 or batch >= 1 << 20:
+          break
+        batch *= 2
+
+    samples = []
+    total = 0
+    end = time.perf_counter() + duration
+    while time.perf_counter() < end or len(samples) < 10:
+      start = time.perf_counter()
+      for _ in range(batch):
+        operation()
+      samples.append((time.perf_counter() - start) / batch)
+      total += batch
+  finally:
+    if cleanup is not None:
+      cleanup()
+
+  elapsed = sum(samples) * batch
+  return {
+    "opsPerSecond": total / elapsed,
+    "p50": _percentile(samples, 0.50),
+    "p99": _percentile(samples, 0.99),
+    "operations": total,
+    "batch": batch,
+  }
+
+def compare(results, baseline, tolerance):
+  """Returns the benchmarks that got slower than the baseline by more than tolerance (a fraction)"""
+  regressions = {}
+  for name, result in results.items():
+    if name not in baseline:
+      continue
+    previous = baseline[name]["opsPerSecond"]
+    change = result["opsPerSecond"] / previous - 1
+    if change < -tolerance:
+      regressions[name] = change
+  return regressions
+
+def main(argv=None):
+  parser = argparse.ArgumentParser(description="Benchmarks for the BMAP codecs, scanner parsers and command round trips")
+  parser.add_argument("filter", nargs="*", help="only run benchmarks whose name starts with one of these")
+  parser.add_argument("--duration", type=float, default=0.5, help="seconds per benchmark")
+  parser.add_argument("--json", help="write the results to this file (- for stdout)")
+  parser.add_argument("--baseline", help="compare against results previously written with --json")
+  parser.add_argument("--tolerance", type=float, default=0.10, help="allowed slowdown against the baseline (default 0.10 = 10%%)")
+  parser.add_argument("--imports", action="store_true", help="check the import time budgets (IMPORT_CHECKS) instead of running the benchmarks")
+  args = parser.parse_args(argv)
+
+  if args.imports:
+    failures = checkImports()
+    for failure in failures:
+      print(f"IMPORT {failure}", file=sys.stderr)
+    return 1 if failures else 0
+
+  names = [name for name in _BENCHMARKS if not args.filter or any(name.startswith(f) for f in args.filter)]
+  results = {}
+  for name in names:
+    results[name] = result = run(name, args.duration)
+    if args.json != "-":
+      batchMeans = f"   (means of {result['batch']} op batches)" if result["batch"] > 1 else ""
+      print(f"{name:32} {result['opsPerSecond']:>14,.0f} ops/s   p50 {result['p50']*1e6:>10.2f} us   p99 {result['p99']*1e6:>10.2f} us{batchMeans}")
+
+  if args.json == "-":
+    json.dump(results, sys.stdout, indent=2)
+    print()
+  elif args.json:
+    with open(args.json, "w") as f:
+      json.dump(results, f, indent=2)
+
+  if args.baseline:
+    with open(args.baseline) as f:
+      regressions = compare(results, json.load(f), args.tolerance)
+    for name, change in regressions.items():
+      print(f"REGRESSION {name}: {change:+.1%}", file=sys.stderr)
+    if regressions:
+      return 1
+  return 0
+
+if __name__ == "__main__":
+  sys.exit(main())
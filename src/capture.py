@@ -0,0 +1,311 @@
+import mmap
+import os
+import socket
+import struct
+import threading
+import time
+
+from enum import Enum
+from types import SimpleNamespace
+
+from scanners import scan
+from scanners.bose import BoseParser
+
+
+MAGIC = b"OBOECAP1"
+
+# type, stream, timestamp, payload length
+_RECORD_HEADER = struct.Struct("<BHdI")
+_MANUFACTURER_DATA_HEADER = struct.Struct("<HB")
+_NONE = 0xff
+
+
+class RecordType(Enum):
+  ADVERTISEMENT = 1
+  SENT = 2     # host -> device
+  RECEIVED = 3 # device -> host
+
+_RECORD_TYPES = {recordType.value: recordType for recordType in RecordType}
+
+
+def _packString(value):
+  if value is None:
+    return bytes([_NONE])
+  data = value.encode()
+  if len(data) >= _NONE: # cut on a character boundary, so it still decodes
+    data = data[:_NONE - 1].decode(errors="ignore").encode()
+  return bytes([len(data)]) + data
+
+def _unpackString(data, pos):
+  length = data[pos]
+  if length == _NONE:
+    return None, pos + 1
+  return bytes(data[pos+1:pos+1+length]).decode(), pos + 1 + length
+
+def _packAdvertisement(device, advertisement_data):
+  manufacturerData = advertisement_data.manufacturer_data or {}
+  parts = [_packString(device.address), _packString(device.name), _packString(advertisement_data.local_name), bytes([len(manufacturerData)])]
+  for key, value in manufacturerData.items():
+    parts.append(_MANUFACTURER_DATA_HEADER.pack(key, len(value)))
+    parts.append(bytes(value))
+  return b"".join(parts)
+
+def _unpackAdvertisement(data):
+  address, pos = _unpackString(data, 0)
+  name, pos = _unpackString(data, pos)
+  localName, pos = _unpackString(data, pos)
+  manufacturerData = {}
+  count = data[pos]
+  pos += 1
+  for _ in range(count):
+    key, length = _MANUFACTURER_DATA_HEADER.unpack_from(data, pos)
+    pos += _MANUFACTURER_DATA_HEADER.size
+    manufacturerData[key] = bytes(data[pos:pos+length])
+    pos += length
+  device = SimpleNamespace(address=address, name=name)
+  advertisement_data = SimpleNamespace(local_name=localName, manufacturer_data=manufacturerData, platform_data=())
+  return device, advertisement_data
+
+
+class CaptureWriter:
+  """
+  Appends advertisements and RFCOMM traffic to a binary capture file.
+
+  Every record is a fixed header (type, stream, timestamp, length) followed by its payload; streams tell the
+  traffic of different devices apart. Writing is thread safe, so one writer can be shared by a scan callback and
+  the reader threads of several devices.
+  """
+
+  def __init__(self, path, *, clock=time.time):
+    self._file = open(path, "ab")
+    self._lock = threading.Lock()
+    self._clock = clock
+    if self._file.tell() == 0:
+      self._file.write(MAGIC)
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc):
+    self.close()
+
+  def close(self):
+    with self._lock:
+      self._file.close()
+
+  def flush(self):
+    with self._lock:
+      self._file.flush()
+
+  def write(self, recordType, payload, stream=0, timestamp=None):
+    if timestamp is None:
+      timestamp = self._clock()
+    header = _RECORD_HEADER.pack(recordType.value, stream, timestamp, len(payload))
+    with self._lock:
+      self._file.write(header)
+      self._file.write(payload)
+
+  def writeAdvertisement(self, device, advertisement_data, timestamp=None):
+    self.write(RecordType.ADVERTISEMENT, _packAdvertisement(device, advertisement_data), timestamp=timestamp)
+
+  def recordingScanner(self, scanner=None):
+    """Returns a scanner factory for scan_stream/scan(scanner=...) that records every advertisement it passes on"""
+    def factory(callback, **kwargs):
+      def record(device, advertisement_data):
+        self.writeAdvertisement(device, advertisement_data)
+        callback(device, advertisement_data)
+      return (scanner or scan.default_scanner)(record, **kwargs)
+    return factory
+
+  def recordingSocket(self, sock, stream=0):
+    return RecordingSocket(sock, self, stream)
+
+
+class RecordingSocket:
+  """Wraps a connected socket (e.g. for BoseDevice(sock=...)) and records everything sent and received"""
+
+  def __init__(self, sock, writer, stream=0):
+    self._sock = sock
+    self._writer = writer
+    self._stream = stream
+
+  def __getattr__(self, name):
+    return getattr(self._sock, name)
+
+  def sendall(self, data, *args):
+    self._writer.write(RecordType.SENT, data, self._stream)
+    return self._sock.sendall(data, *args)
+
+  def send(self, data, *args):
+    sent = self._sock.send(data, *args)
+    self._writer.write(RecordType.SENT, memoryview(data)[:sent], self._stream)
+    return sent
+
+  def recv(self, size, *args):
+    data = self._sock.recv(size, *args)
+    if data:
+      self._writer.write(RecordType.RECEIVED, data, self._stream)
+    return data
+
+  def recv_into(self, buffer, size=0, *args):
+    received = self._sock.recv_into(buffer, size, *args)
+    if received:
+      self._writer.write(RecordType.RECEIVED, memoryview(buffer)[:received], self._stream)
+    return received
+
+
+class CaptureReader:
+  """
+  Memory maps a capture file and replays it.
+
+  Records are read straight from the mapping, their payloads are memoryviews into it. Payloads that are still
+  referenced when the reader is closed keep the mapping alive until they are gone; copy them with bytes(payload) to
+  keep them around without the whole file. A record cut off at the end of the file (e.g. by a crash while
+  recording) ends the capture.
+  """
+
+  def __init__(self, path):
+    with open(path, "rb") as f:
+      size = os.fstat(f.fileno()).st_size
+      self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if size else None
+    self._view = memoryview(self._mmap if self._mmap is not None else b"")
+    if self._view[:len(MAGIC)] != MAGIC:
+      self.close()
+      raise Exception(f"Not a capture file: {path}")
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc):
+    self.close()
+
+  def close(self):
+    self._view.release()
+    if self._mmap is not None:
+      try:
+        self._mmap.close()
+      except BufferError: # payloads are still referenced, the mapping is unmapped once the last one is gone
+        pass
+      self._mmap = None
+
+  def records(self, recordTypes=None, stream=None):
+    """Yields (recordType, stream, timestamp, payload) for all (matching) records, records of unknown types are skipped"""
+    view = self._view
+    pos = len(MAGIC)
+    end = len(view)
+    while pos + _RECORD_HEADER.size <= end:
+      recordType, recordStream, timestamp, length = _RECORD_HEADER.unpack_from(view, pos)
+      pos += _RECORD_HEADER.size
+      if pos + length > end:
+        return
+      payload = view[pos:pos+length]
+      pos += length
+      recordType = _RECORD_TYPES.get(recordType)
+      if recordType is None: # corrupt or written by a newer version, the length still tells where the next one starts
+        continue
+      if recordTypes is not None and recordType not in recordTypes:
+        continue
+      if stream is not None and recordStream != stream:
+        continue
+      yield recordType, recordStream, timestamp, payload
+
+  def advertisements(self):
+    """Yields (timestamp, device, advertisement_data) with the attributes BoseParser.parse uses"""
+    for _, _, timestamp, payload in self.records((RecordType.ADVERTISEMENT,)):
+      yield (timestamp, *_unpackAdvertisement(payload))
+
+  def parse(self, parser=BoseParser):
+    """Yields (timestamp, parsed device) for all advertisements the parser accepts"""
+    for timestamp, device, advertisement_data in self.advertisements():
+      parsed = parser.parse(device, advertisement_data)
+      if parsed:
+        yield timestamp, parsed
+
+  def scanner(self, speed=None):
+    """
+    Returns a scanner factory for scan_stream/scan(scanner=...) that replays the recorded advertisements, as fast
+    as possible or speed times as fast as they were recorded
+    """
+    return lambda callback, **kwargs: _ReplayScanner(self, callback, speed)
+
+  def serve(self, stream=0, speed=None):
+    """
+    Serves the recorded traffic of a stream as a fake peer and returns the client socket (e.g. for
+    BoseDevice(sock=...)).
+
+    The peer waits for the host to send as many bytes as were recorded before replaying the next received data,
+    so the replay keeps the order of the session even if the host is slower or faster than the original one.
+    """
+    client, server = socket.socketpair()
+    thread = threading.Thread(target=self._servePeer, args=(server, stream, speed), name="CapturePeer", daemon=True)
+    thread.start()
+    return client
+
+  def _servePeer(self, sock, stream, speed):
+    pacer = _Pacer(speed)
+    try:
+      for recordType, _, timestamp, payload in self.records((RecordType.SENT, RecordType.RECEIVED), stream):
+        if recordType == RecordType.SENT:
+          remaining = len(payload)
+          while remaining:
+            data = sock.recv(remaining)
+            if not data:
+              return
+            remaining -= len(data)
+        else:
+          pacer.wait(timestamp)
+          sock.sendall(payload)
+      while sock.recv(4096): # the capture ended, keep the connection until the host closes it
+        pass
+    except OSError:
+      pass
+    finally:
+      sock.close()
+
+
+class _Pacer:
+  def __init__(self, speed):
+    self.speed = speed
+    self.first = None
+    self.start = None
+
+  def delay(self, timestamp):
+    if self.speed is None:
+      return 0
+    if self.first is None:
+      self.first = timestamp
+      self.start = time.monotonic()
+    return self.start + (timestamp - self.first) / self.speed - time.monotonic()
+
+  def wait(self, timestamp):
+    delay = self.delay(timestamp)
+    if delay > 0:
+      time.sleep(delay)
+
+
+class _ReplayScanner:
+  def __init__(self, reader, callback, speed):
+    self._reader = reader
+    self._callback = callback
+    self._speed = speed
+    self._task = None
+
+  async def __aenter__(self):
+    import asyncio # only replays need it, see scan
+    self._task = asyncio.get_running_loop().create_task(self._replay())
+    return self
+
+  async def __aexit__(self, *exc):
+    import asyncio
+    self._task.cancel()
+    try:
+      await self._task
+    except asyncio.CancelledError:
+      pass
+
+  async def _replay(self):
+    import asyncio
+    pacer = _Pacer(self._speed)
+    for timestamp, device, advertisement_data in self._reader.advertisements():
+      await asyncio.sleep(max(0, pacer.delay(timestamp))) # also lets the consumer run between advertisements
+      self._callback(device, advertisement_data)
@@ -0,0 +1,239 @@
+import argparse
+import json
+import sys
+import threading
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from devices import commands
+from devices.bose import BoseDevice
+
+# the daemon client and the scanner (asyncio, bleak) are only imported by the subcommands that use them, so running
+# jobs starts quickly
+
+
+def _write(output, lock, value):
+  with lock:
+    output.write(json.dumps(value) + "\n")
+    output.flush()
+
+
+#########
+#  RUN  #
+#########
+
+class JobRunner:
+  """
+  Runs {"device", "command", "args", "id"} jobs (see devices.commands) and writes a JSON line per job as soon as it
+  is done: {"id", "device", "command", "ok", "result" or "error"}.
+
+  Jobs are grouped by device: every device is opened once and its jobs run one after the other over that
+  connection, while up to parallel devices are worked on at the same time. Jobs can be submitted while earlier
+  ones are still running, so the input is streamed.
+  """
+
+  def __init__(self, output, *, parallel=8, openDevice=None):
+    self.output = output
+    self.failed = 0
+    self._openDevice = openDevice or (lambda macAddress: BoseDevice(macAddress, lazy=True))
+    self._executor = ThreadPoolExecutor(parallel, thread_name_prefix="JobRunner")
+    self._lock = threading.Lock()
+    self._outputLock = threading.Lock()
+    self._queues = {} # device -> deque of jobs that are not started yet
+    self._active = set() # devices with a drain task
+    self._devices = {}
+
+  def submit(self, job):
+    device = job.get("device")
+    if not isinstance(device, str):
+      self._result(job, error=Exception("Job without device"))
+      return
+    key = device.lower()
+    with self._lock:
+      self._queues.setdefault(key, deque()).append(job)
+      if key in self._active:
+        return
+      self._active.add(key)
+    self._executor.submit(self._drain, key)
+
+  def close(self):
+    """Waits for all submitted jobs and closes the devices"""
+    self._executor.shutdown()
+    for device in self._devices.values():
+      if hasattr(device, "close"):
+        device.close()
+
+  def _drain(self, key):
+    while True:
+      with self._lock:
+        queue = self._queues[key]
+        if not queue:
+          self._active.discard(key)
+          return
+        job = queue.popleft()
+      try:
+        device = self._devices.get(key)
+        if device is None:
+          device = self._devices[key] = self._openDevice(job["device"])
+        result = self._call(device, job)
+      except Exception as e:
+        self._result(job, error=e)
+      else:
+        self._result(job, result=result)
+
+  def _call(self, device, job):
+    call = getattr(device, "call", None) # DaemonClient devices run the command in the daemon
+    if call is not None:
+      return call(job["command"], *(job.get("args") or ()))
+    return commands.toJson(commands.call(device, job["command"], job.get("args") or ()))
+
+  def _result(self, job, result=None, error=None):
+    response = {"id": job.get("id"), "device": job.get("device"), "command": job.get("command")}
+    if error is None:
+      response.update(ok=True, result=result)
+    else:
+      response.update(ok=False, error=commands.toJson(error))
+    with self._outputLock:
+      self.failed += error is not None
+      self.output.write(json.dumps(response) + "\n")
+      self.output.flush()
+
+
+class _DaemonDevice:
+  def __init__(self, client, macAddress):
+    self._client = client
+    self._macAddress = macAddress
+
+  def call(self, command, *args):
+    return self._client.call(self._macAddress, command, *args)
+
+
+def _readJobs(lines, runner):
+  for number, line in enumerate(lines, 1):
+    if not line.strip():
+      continue
+    try:
+      job = json.loads(line)
+      if not isinstance(job, dict):
+        raise ValueError("Job is not an object")
+    except ValueError as e:
+      runner._result({"id": number}, error=e)
+      continue
+    job.setdefault("id", number)
+    runner.submit(job)
+
+def run(args, *, openDevice=None):
+  client = None
+  if args.daemon or args.daemon_socket is not None:
+    from daemon import DEFAULT_PATH, DaemonClient
+    client = DaemonClient(args.daemon_socket or DEFAULT_PATH)
+    openDevice = lambda macAddress: _DaemonDevice(client, macAddress)
+  elif openDevice is None:
+    openDevice = lambda macAddress: BoseDevice(macAddress, lazy=True, timeout=args.timeout)
+
+  runner = JobRunner(sys.stdout, parallel=args.parallel, openDevice=openDevice)
+  try:
+    if args.input in (None, "-"):
+      _readJobs(sys.stdin, runner)
+    else:
+      with open(args.input) as lines:
+        _readJobs(lines, runner)
+  finally:
+    runner.close()
+    if client is not None:
+      client.close()
+  return 1 if runner.failed else 0
+
+
+##########
+#  SCAN  #
+##########
+
+SCANNED_FIELDS = ("name", "macAddress", "bmapVersion", "isInPairingMode", "isDevice1Connected", "device1Mac", "isDevice2Connected", "device2Mac", "productType", "productId", "productVariant", "supportsMusicShare", "isInMusicShare")
+
+def scannedToJson(device):
+  return {field: commands.toJson(getattr(device, field)) for field in SCANNED_FIELDS}
+
+async def _scan(args, scanner):
+  from scanners import scan
+  lock = threading.Lock()
+  async for device in scan.scan_stream(args.time, max_results=args.max_results, reemit_on_change=args.changes, scanner=scanner):
+    _write(sys.stdout, lock, scannedToJson(device))
+
+def scanCommand(args, *, scanner=None):
+  import asyncio
+  asyncio.run(_scan(args, scanner))
+  return 0
+
+
+###############
+#  INVENTORY  #
+###############
+
+INVENTORY_READS = [
+  (BoseDevice.FunctionBlock.PRODUCT_INFO, BoseDevice.Function.FIRMWARE_VERSION),
+  (BoseDevice.FunctionBlock.PRODUCT_INFO, BoseDevice.Function.SERIAL_NUMBER),
+  (BoseDevice.FunctionBlock.PRODUCT_INFO, BoseDevice.Function.MAC_ADDRESS),
+  (BoseDevice.FunctionBlock.PRODUCT_INFO, BoseDevice.Function.PRODUCT_ID_VARIANT),
+  (BoseDevice.FunctionBlock.SETTINGS, BoseDevice.Function.DEVICE_NAME),
+]
+
+def _inventory(scanned, openDevice):
+  entry = scannedToJson(scanned)
+  device = None
+  try:
+    device = openDevice(str(scanned.macAddress))
+    entry["device"] = commands.toJson(device.getSnapshot(INVENTORY_READS))
+  except Exception as e:
+    entry["error"] = commands.toJson(e)
+  finally:
+    if device is not None:
+      device.close()
+  return entry
+
+def inventory(args, *, scanner=None, openDevice=None):
+  """Scans and reads the product info of every device found, a JSON line per device in completion order"""
+  import asyncio
+  from scanners import scan
+  openDevice = openDevice or (lambda macAddress: BoseDevice(macAddress, timeout=args.timeout))
+  lock = threading.Lock()
+  failed = 0
+  async def scanAll():
+    return [device async for device in scan.scan_stream(args.time, max_results=args.max_results, scanner=scanner)]
+  with ThreadPoolExecutor(args.parallel, thread_name_prefix="Inventory") as executor:
+    futures = [executor.submit(_inventory, scanned, openDevice) for scanned in asyncio.run(scanAll())]
+    for future in futures:
+      future.add_done_callback(lambda future: _write(sys.stdout, lock, future.result()))
+  for future in futures:
+    if "error" in future.result():
+      failed += 1
+  return 1 if failed else 0
+
+
+def main(argv=None):
+  parser = argparse.ArgumentParser(description="Drives Bose devices from the command line, reading and writing JSON lines")
+  subparsers = parser.add_subparsers(dest="subcommand", required=True)
+
+  runParser = subparsers.add_parser("run", help="run {\"device\", \"command\", \"args\"} jobs, one JSON object per line")
+  runParser.add_argument("input", nargs="?", help="file with the jobs (default: stdin)")
+  runParser.add_argument("--parallel", type=int, default=8, help="devices worked on at the same time")
+  runParser.add_argument("--timeout", type=float, default=10.0, help="seconds per command")
+  runParser.add_argument("--daemon", action="store_true", help="run the commands in a running daemon")
+  runParser.add_argument("--daemon-socket", metavar="PATH", help="socket path of the daemon (implies --daemon, default: its default path)")
+  runParser.set_defaults(handler=run)
+
+  for name, handler, description in (("scan", scanCommand, "print the advertising Bose devices"), ("inventory", inventory, "scan and read the product info of every device found")):
+    subparser = subparsers.add_parser(name, help=description)
+    subparser.add_argument("--time", type=float, default=10.0, help="seconds to scan")
+    subparser.add_argument("--max-results", type=int, help="stop after this many devices")
+    subparser.set_defaults(handler=handler)
+  subparsers.choices["scan"].add_argument("--changes", action="store_true", help="print a device again whenever its advertised state changes")
+  subparsers.choices["inventory"].add_argument("--parallel", type=int, default=4, help="devices read at the same time")
+  subparsers.choices["inventory"].add_argument("--timeout", type=float, default=10.0, help="seconds per command")
+
+  args = parser.parse_args(argv)
+  return args.handler(args)
+
+if __name__ == "__main__":
+  sys.exit(main())
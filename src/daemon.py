@@ -0,0 +1,390 @@
+import argparse
+import json
+import os
+import socket
+import sys
+import tempfile
+import threading
+
+from collections import deque
+from concurrent import futures
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from devices import commands
+from devices.bose import BoseDevice
+from devices.helpers import MacAddress
+
+
+DEFAULT_PATH = os.path.join(os.environ.get("XDG_RUNTIME_DIR") or tempfile.gettempdir(), "oboe.sock")
+
+
+class DaemonError(Exception):
+  """A command failed in the daemon; type is the name of the exception it raised there"""
+
+  def __init__(self, type, message):
+    super().__init__(f"{type}: {message}")
+    self.type = type
+    self.message = message
+
+
+class _DeviceEntry:
+  def __init__(self, device):
+    self.device = device
+    self.jobs = deque() # job(error) to run on the device one after the other, error is set once the daemon closed
+    self.draining = False # a pool task is working through jobs
+    self.lock = threading.Lock()
+
+
+class BoseDaemon:
+  """
+  Keeps persistent connections to devices and serves their commands to local clients over a Unix socket, so
+  scripts neither pay for the RFCOMM connect nor compete for the same device.
+
+  The protocol is JSON lines. A request is {"id": ..., "device": mac, "command": name, "args": [...]} with a command
+  of devices.commands.COMMANDS, the response {"id": ..., "ok": true, "result": ...} or {"id": ..., "ok": false,
+  "error": {"type": ..., "message": ...}}. Requests without device are handled by the daemon itself: "ping" and
+  "devices" (the known devices and whether they are connected).
+
+  The requests of a client are processed concurrently and answered in completion order. Commands to the same
+  device are queued and run one after the other by a single pool task, so a device that hangs only holds up its
+  own commands. Devices are connected on first use (or at start with connect=True) and are
+  reconnected with backoff if the connection is lost.
+  """
+
+  def __init__(self, path=DEFAULT_PATH, macAddresses=(), *, allowUnknown=False, timeout=10.0, workers=16, deviceFactory=None):
+    self.path = path
+    self.allowUnknown = allowUnknown # also serve devices that were not configured
+    self.timeout = timeout
+    self._deviceFactory = deviceFactory or (lambda macAddress: BoseDevice(str(macAddress), lazy=True, reconnect=BoseDevice.Backoff(), timeout=timeout))
+    self._devices = {MacAddress(macAddress): None for macAddress in macAddresses} # mac -> _DeviceEntry once created
+    self._devicesLock = threading.Lock()
+    self._executor = ThreadPoolExecutor(workers, thread_name_prefix="BoseDaemon-worker")
+    self._listener = None
+    self._thread = None
+    self._clients = set()
+    self._closed = False
+
+  def __enter__(self):
+    return self.start()
+
+  def __exit__(self, *exc):
+    self.close()
+
+  def start(self, connect=False):
+    """Listens on path and accepts clients in a background thread"""
+    self._listener = self._listen()
+    self._thread = threading.Thread(target=self._acceptLoop, name="BoseDaemon", daemon=True)
+    self._thread.start()
+    if connect:
+      for macAddress in list(self._devices):
+        entry = self._device(macAddress)
+        self._queue(entry, lambda error, device=entry.device: error is None and self._connect(device))
+    return self
+
+  def serveForever(self, connect=True):
+    self.start(connect)
+    try:
+      self._thread.join()
+    finally:
+      self.close()
+
+  def close(self):
+    if self._closed:
+      return
+    self._closed = True
+    if self._listener is not None:
+      try:
+        self._listener.shutdown(socket.SHUT_RDWR) # wakes up accept
+      except OSError:
+        pass
+      self._listener.close()
+      self._listener = None
+      try:
+        os.unlink(self.path)
+      except FileNotFoundError: # removed by someone else, the clients and devices still have to be closed
+        pass
+    for client in list(self._clients):
+      try:
+        client.shutdown(socket.SHUT_RDWR)
+      except OSError:
+        pass
+    if self._thread is not None and self._thread is not threading.current_thread():
+      self._thread.join()
+    self._executor.shutdown()
+    with self._devicesLock:
+      for entry in self._devices.values():
+        if entry is not None:
+          entry.device.close()
+
+  def _listen(self):
+    if os.path.exists(self.path): # only replace a stale socket, not a running daemon
+      probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+      try:
+        probe.connect(self.path)
+      except (ConnectionRefusedError, FileNotFoundError):
+        os.unlink(self.path)
+      else:
+        raise Exception(f"Daemon already running on {self.path}")
+      finally:
+        probe.close()
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    listener.bind(self.path)
+    os.chmod(self.path, 0o600)
+    listener.listen(socket.SOMAXCONN)
+    return listener
+
+  def _acceptLoop(self):
+    while not self._closed:
+      try:
+        client, _ = self._listener.accept()
+      except OSError: # closed
+        return
+      self._clients.add(client)
+      threading.Thread(target=self._serveClient, args=(client,), name="BoseDaemon-client", daemon=True).start()
+
+  def _serveClient(self, client):
+    writeLock = threading.Lock()
+    def respond(response):
+      data = (json.dumps(response) + "\n").encode()
+      with writeLock:
+        try:
+          client.sendall(data)
+        except OSError:
+          pass # the client is gone, its remaining responses are dropped
+
+    try:
+      with client.makefile("rb") as lines:
+        for line in lines:
+          if not line.strip():
+            continue
+          try:
+            request = json.loads(line)
+          except ValueError as e:
+            respond(self._response(None, error=e))
+            continue
+          self._submit(request, respond)
+    except OSError:
+      pass
+    finally:
+      self._clients.discard(client)
+      client.close()
+
+  def _submit(self, request, respond):
+    if not isinstance(request, dict) or request.get("device") is None:
+      try:
+        future = self._execute(self._handle, request, lambda: self._run(request))
+      except ConnectionError as e:
+        respond(self._response(request, error=e))
+        return
+      future.add_done_callback(lambda future: respond(future.result()))
+      return
+    try:
+      entry = self._device(MacAddress(request["device"]))
+    except Exception as e:
+      respond(self._response(request, error=e))
+      return
+    run = lambda: commands.call(entry.device, request.get("command"), request.get("args") or ())
+    self._queue(entry, lambda error: respond(self._handle(request, run) if error is None else self._response(request, error=error)))
+
+  def _execute(self, function, *args):
+    """Submits function to the pool, ConnectionError once the daemon is closed"""
+    if self._closed:
+      raise ConnectionError("Daemon closed")
+    try:
+      return self._executor.submit(function, *args)
+    except RuntimeError: # shut down by a concurrent close
+      raise ConnectionError("Daemon closed")
+
+  def _queue(self, entry, job):
+    with entry.lock:
+      entry.jobs.append(job)
+      if entry.draining:
+        return
+      entry.draining = True
+    try:
+      self._execute(self._drain, entry)
+    except ConnectionError as e:
+      self._fail(entry, e)
+
+  def _drain(self, entry):
+    while True:
+      with entry.lock:
+        if not entry.jobs:
+          entry.draining = False
+          return
+        if self._closed:
+          break
+        job = entry.jobs.popleft()
+      job(None)
+    self._fail(entry, ConnectionError("Daemon closed"))
+
+  @staticmethod
+  def _fail(entry, error):
+    with entry.lock:
+      jobs, entry.jobs = entry.jobs, deque()
+      entry.draining = False
+    for job in jobs:
+      job(error)
+
+  def _handle(self, request, run):
+    try:
+      result = run()
+    except Exception as e:
+      return self._response(request, error=e)
+    return self._response(request, result)
+
+  @staticmethod
+  def _response(request, result=None, error=None):
+    requestId = request.get("id") if isinstance(request, dict) else None
+    if error is not None:
+      return {"id": requestId, "ok": False, "error": commands.toJson(error)}
+    return {"id": requestId, "ok": True, "result": commands.toJson(result)}
+
+  def _run(self, request):
+    command = request.get("command")
+    if command == "ping":
+      return "pong"
+    if command == "devices":
+      return self._deviceStates()
+    raise Exception(f"Unknown daemon command: {command}")
+
+  def _device(self, macAddress):
+    with self._devicesLock:
+      if self._closed:
+        raise ConnectionError("Daemon closed")
+      if macAddress not in self._devices and not self.allowUnknown:
+        raise Exception(f"Unknown device: {macAddress}")
+      entry = self._devices.get(macAddress)
+      if entry is None:
+        entry = self._devices[macAddress] = _DeviceEntry(self._deviceFactory(macAddress))
+      return entry
+
+  @staticmethod
+  def _connect(device):
+    try:
+      device.connect()
+    except Exception:
+      pass # retried by the first command
+
+  def _deviceStates(self):
+    with self._devicesLock:
+      return {str(macAddress): entry is not None and entry.device.isConnected for macAddress, entry in self._devices.items()}
+
+
+class DaemonClient:
+  """
+  Client of a BoseDaemon. call returns the JSON result (e.g. enums by name) or raises DaemonError; device returns
+  a proxy that is used like a BoseDevice, e.g. client.device(mac).getAnr().
+
+  A client can be shared by threads: their requests are all in flight at the same time and a reader thread hands
+  every response to the call waiting for its id. timeout (in seconds) applies to connecting and to every call.
+  """
+
+  def __init__(self, path=DEFAULT_PATH, timeout=None):
+    self.timeout = timeout
+    self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    self.socket.settimeout(timeout)
+    self.socket.connect(path)
+    self.socket.settimeout(None)
+    self._lines = self.socket.makefile("rb")
+    self._lock = threading.Lock()
+    self._sendLock = threading.Lock()
+    self._pending = {} # request id -> Future of the response
+    self._nextId = 0
+    self._error = None # why the connection is gone
+    self._reader = threading.Thread(target=self._readLoop, name="DaemonClient", daemon=True)
+    self._reader.start()
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc):
+    self.close()
+
+  def close(self):
+    try:
+      self.socket.shutdown(socket.SHUT_RDWR) # wakes up the reader
+    except OSError:
+      pass
+    if self._reader is not threading.current_thread():
+      self._reader.join()
+    self._lines.close()
+    self.socket.close()
+
+  def call(self, device, command, *args):
+    future = Future()
+    with self._lock:
+      if self._error is not None:
+        raise self._error
+      self._nextId += 1
+      requestId = self._nextId
+      self._pending[requestId] = future
+    try:
+      with self._sendLock:
+        self.socket.sendall((json.dumps({"id": requestId, "device": None if device is None else str(device), "command": command, "args": args}) + "\n").encode())
+      response = future.result(self.timeout)
+    except futures.TimeoutError:
+      raise TimeoutError(f"No response to {command} within {self.timeout} seconds") from None
+    finally:
+      with self._lock: # the response of an abandoned request is dropped by the reader
+        self._pending.pop(requestId, None)
+    if not response["ok"]:
+      raise DaemonError(response["error"]["type"], response["error"]["message"])
+    return response["result"]
+
+  def _readLoop(self):
+    try:
+      for line in self._lines:
+        response = json.loads(line)
+        with self._lock:
+          future = self._pending.pop(response.get("id"), None)
+        if future is not None:
+          future.set_result(response)
+      error = ConnectionError("Daemon closed the connection")
+    except (OSError, ValueError) as e:
+      error = e if isinstance(e, ConnectionError) else ConnectionError(str(e))
+    with self._lock:
+      self._error = error
+      pending, self._pending = self._pending, {}
+    for future in pending.values():
+      future.set_exception(error)
+
+  def ping(self):
+    return self.call(None, "ping")
+
+  def devices(self):
+    return self.call(None, "devices")
+
+  def device(self, macAddress):
+    return _DeviceProxy(self, macAddress)
+
+
+class _DeviceProxy:
+  def __init__(self, client, macAddress):
+    self._client = client
+    self._macAddress = macAddress
+
+  def __getattr__(self, command):
+    if command not in commands.COMMANDS:
+      raise AttributeError(command)
+    return lambda *args: self._client.call(self._macAddress, command, *args)
+
+
+def main(argv=None):
+  parser = argparse.ArgumentParser(description="Keeps connections to Bose devices and serves their commands over a Unix socket")
+  parser.add_argument("devices", nargs="*", help="mac addresses of the devices to connect to")
+  parser.add_argument("--socket", default=DEFAULT_PATH, help=f"path of the Unix socket (default {DEFAULT_PATH})")
+  parser.add_argument("--allow-unknown", action="store_true", help="also serve devices that are not listed")
+  parser.add_argument("--timeout", type=float, default=10.0, help="seconds per command")
+  parser.add_argument("--workers", type=int, default=16, help="commands run at the same time (across devices)")
+  args = parser.parse_args(argv)
+
+  daemon = BoseDaemon(args.socket, args.devices, allowUnknown=args.allow_unknown, timeout=args.timeout, workers=args.workers)
+  try:
+    daemon.serveForever()
+  except KeyboardInterrupt:
+    pass
+  return 0
+
+if __name__ == "__main__":
+  sys.exit(main())
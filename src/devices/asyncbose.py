@@ -0,0 +1,387 @@
+import asyncio
+import socket
+import time
+
+from .bose import BoseDevice
+from .helpers import MacAddress, _applyBitmask, _macAddressToBytes, _bytesToHexString
+from .framing import FrameDecoder, FrameEncoder
+from .routing import PendingRequest, ResponseRouter
+
+
+class AsyncBoseDevice:
+  """
+  asyncio counterpart of BoseDevice.
+
+  A single reader task owns the receiving side of the socket and matches the responses to the outstanding
+  requests by function block and function, so many requests can be in flight on one connection at the same time.
+  Enums, setting classes and decoders are shared with BoseDevice.
+
+  Besides the default timeout, commands can be bounded with asyncio.wait_for/asyncio.timeout; a command that times
+  out or is cancelled keeps swallowing its late response, so the connection stays usable.
+  """
+
+  PORT = BoseDevice.PORT
+  LATE_RESPONSE_GRACE = BoseDevice.LATE_RESPONSE_GRACE
+
+  Operator = BoseDevice.Operator
+  FunctionBlock = BoseDevice.FunctionBlock
+  Function = BoseDevice.Function
+  VoicePromptSetting = BoseDevice.VoicePromptSetting
+  AnrLevel = BoseDevice.AnrLevel
+  ActionButtonSetting = BoseDevice.ActionButtonSetting
+  SidetoneLevel = BoseDevice.SidetoneLevel
+  PairedDevice = BoseDevice.PairedDevice
+  ChirpStopReason = BoseDevice.ChirpStopReason
+
+  _CODECS = BoseDevice._CODECS
+  _decodeAll = BoseDevice._decodeAll
+
+  def __init__(self, macAddress, *, onUnsolicited=None, timeout=None, discovery=None):
+    self.macAddress = macAddress
+    self.timeout = timeout # default deadline in seconds for every command, None waits forever
+    self.discovery = discovery # optional DiscoveryCache, see BoseDevice
+    self._model = None
+    self.socket = None
+    self._decoder = FrameDecoder()
+    self._encoder = FrameEncoder()
+    self._router = ResponseRouter(onUnsolicited)
+    self._writeLock = asyncio.Lock()
+    self._reader = None
+
+  @classmethod
+  async def create(cls, macAddress, **kwargs):
+    device = cls(macAddress, **kwargs)
+    await device.connect()
+    return device
+
+  async def connect(self):
+    loop = asyncio.get_running_loop()
+    sock = socket.socket(socket.AF_BLUETOOTH, socket.SOCK_STREAM, socket.BTPROTO_RFCOMM)
+    sock.setblocking(False)
+    try:
+      await loop.sock_connect(sock, (self.macAddress, self.PORT))
+    except BaseException:
+      sock.close()
+      raise
+    self.attach(sock)
+
+  def attach(self, sock):
+    """Uses an already connected socket and starts the reader task"""
+    sock.setblocking(False)
+    self.socket = sock
+    self._model = None
+    self._reader = asyncio.get_running_loop().create_task(self._readLoop())
+
+  async def close(self):
+    if self._reader is not None:
+      self._reader.cancel()
+      try:
+        await self._reader
+      except asyncio.CancelledError:
+        pass
+      self._reader = None
+    if self.socket is not None:
+      self.socket.close()
+      self.socket = None
+    self._router.failAll(ConnectionError("Connection closed"))
+
+  def cancel(self, functionBlock=None, function=None):
+    """Cancels the outstanding commands (of the given function block and function, None matches everything), returns how many"""
+    return self._router.cancel(time.monotonic() + self.LATE_RESPONSE_GRACE, None if functionBlock is None else functionBlock.value, None if function is None else function.value)
+
+  async def __aenter__(self):
+    if self.socket is None:
+      await self.connect()
+    return self
+
+  async def __aexit__(self, *exc):
+    await self.close()
+
+
+  ###########################
+  #  COMPOSITES/PROCEDURES  #
+  ###########################
+
+
+  async def startChirp(self):
+    await self.setChirp(True)
+
+  async def stopChirp(self):
+    await self.setChirp(False)
+
+
+  #######################
+  #  GENERIC FUNCTIONS  #
+  #######################
+
+  async def getFunctionBlockInfo(self, functionBlock):
+    return (await self._discover(functionBlock, self.Function.FUNCTION_BLOCK_INFO, self.Operator.GET)).decode()
+
+
+  ##################
+  #  PRODUCT INFO  #
+  ##################
+
+  async def getBmapVersion(self):
+    return (await self._request(self.FunctionBlock.PRODUCT_INFO, self.Function.BMAP_VERSION, self.Operator.GET)).decode()
+
+  async def getSupportedFunctionBlocks(self):
+    supportBitMask = await self._discover(self.FunctionBlock.PRODUCT_INFO, self.Function.ALL_FUNCTION_BLOCKS, self.Operator.GET)
+    return _applyBitmask(self.FunctionBlock, supportBitMask)
+
+  async def getSupportedFunctionBlockVersions(self):
+    versions = await self._discover(self.FunctionBlock.PRODUCT_INFO, self.Function.ALL_FUNCTION_BLOCKS, self.Operator.START, expectList=True)
+    return [ver.decode() for ver in versions]
+
+  async def getProductIdVariant(self):
+    return await self._request(self.FunctionBlock.PRODUCT_INFO, self.Function.PRODUCT_ID_VARIANT, self.Operator.GET)
+
+  async def getAllDeviceNumbers(self):
+    return await self._sendAndParseAll(self.FunctionBlock.PRODUCT_INFO, self.Function.ALL_FUNCTIONS)
+
+  async def getFirmwareVersion(self):
+    return await self._sendAndParse(self.FunctionBlock.PRODUCT_INFO, self.Function.FIRMWARE_VERSION, self.Operator.GET)
+
+  async def getMacAddress(self):
+    return await self._sendAndParse(self.FunctionBlock.PRODUCT_INFO, self.Function.MAC_ADDRESS, self.Operator.GET)
+
+  async def getSerialNumber(self):
+    return await self._sendAndParse(self.FunctionBlock.PRODUCT_INFO, self.Function.SERIAL_NUMBER, self.Operator.GET)
+
+  async def getHardwareRevision(self):
+    return await self._sendAndParse(self.FunctionBlock.PRODUCT_INFO, self.Function.HARDWARE_REVISION, self.Operator.GET)
+
+  async def getComponentDevices(self):
+    return await self._sendAndParse(self.FunctionBlock.PRODUCT_INFO, self.Function.COMPONENT_DEVICES, self.Operator.GET)
+
+
+  ##############
+  #  SETTINGS  #
+  ##############
+
+  async def getAllSettings(self):
+    return await self._sendAndParseAll(self.FunctionBlock.SETTINGS, self.Function.ALL_SETTINGS)
+
+  async def getDeviceName(self):
+    return await self._sendAndParse(self.FunctionBlock.SETTINGS, self.Function.DEVICE_NAME, self.Operator.GET)
+
+  async def setDeviceName(self, name):
+    return await self._set(self.FunctionBlock.SETTINGS, self.Function.DEVICE_NAME, name)
+
+  async def getVoicePrompts(self):
+    return await self._sendAndParse(self.FunctionBlock.SETTINGS, self.Function.VOICE_PROMPTS, self.Operator.GET)
+
+  async def setVoicePrompts(self, config):
+    return await self._set(self.FunctionBlock.SETTINGS, self.Function.VOICE_PROMPTS, config)
+
+  async def getStandbyTimer(self):
+    return await self._sendAndParse(self.FunctionBlock.SETTINGS, self.Function.STANDBY_TIMER, self.Operator.GET)
+
+  async def setStandbyTimer(self, time):
+    return await self._set(self.FunctionBlock.SETTINGS, self.Function.STANDBY_TIMER, time)
+
+  async def getCnc(self):
+    numberOfSteps, currentStep = await self._sendAndParse(self.FunctionBlock.SETTINGS, self.Function.CNC, self.Operator.GET)
+    return numberOfSteps, currentStep
+
+  async def setCnc(self, numberOfSteps, currentStep):
+    numberOfSteps, currentStep = await self._set(self.FunctionBlock.SETTINGS, self.Function.CNC, numberOfSteps, currentStep)
+    return numberOfSteps, currentStep
+
+  async def getAnr(self):
+    noiseCancellingLevel, supportedLevels = await self._sendAndParse(self.FunctionBlock.SETTINGS, self.Function.ANR, self.Operator.GET)
+    return noiseCancellingLevel, supportedLevels
+
+  async def setAnr(self, noiseCancellingLevel):
+    noiseCancellingLevel, supportedLevels = await self._set(self.FunctionBlock.SETTINGS, self.Function.ANR, noiseCancellingLevel)
+    return noiseCancellingLevel, supportedLevels
+
+  async def getBassControl(self):
+    minStep, maxStep, currentStep = await self._sendAndParse(self.FunctionBlock.SETTINGS, self.Function.BASS_CONTROL, self.Operator.GET)
+    return minStep, maxStep, currentStep
+
+  async def setBassControl(self, currentStep):
+    minStep, maxStep, currentStep = await self._set(self.FunctionBlock.SETTINGS, self.Function.BASS_CONTROL, currentStep)
+    return minStep, maxStep, currentStep
+
+  async def getAlerts(self):
+    ringtoneEnabled, hapticsEnabled = await self._sendAndParse(self.FunctionBlock.SETTINGS, self.Function.ALERTS, self.Operator.GET)
+    return ringtoneEnabled, hapticsEnabled
+
+  async def setAlerts(self, ringtoneEnabled, hapticsEnabled):
+    ringtoneEnabled, hapticsEnabled = await self._set(self.FunctionBlock.SETTINGS, self.Function.ALERTS, ringtoneEnabled, hapticsEnabled)
+    return ringtoneEnabled, hapticsEnabled
+
+  async def getButtons(self):
+    return await self._sendAndParse(self.FunctionBlock.SETTINGS, self.Function.BUTTONS, self.Operator.GET)
+
+  async def setButtons(self, config):
+    return await self._set(self.FunctionBlock.SETTINGS, self.Function.BUTTONS, config)
+
+  async def getMultipoint(self):
+    isSupported, isEnabled = await self._sendAndParse(self.FunctionBlock.SETTINGS, self.Function.MULTIPOINT, self.Operator.GET)
+    return isSupported, isEnabled
+
+  async def setMultipoint(self, isSupported, isEnabled):
+    isSupported, isEnabled = await self._set(self.FunctionBlock.SETTINGS, self.Function.MULTIPOINT, isSupported, isEnabled)
+    return isSupported, isEnabled
+
+  async def getSidetone(self):
+    persist, sidetoneLevel, supportedSidetoneLevels = await self._sendAndParse(self.FunctionBlock.SETTINGS, self.Function.SIDETONE, self.Operator.GET)
+    return persist, sidetoneLevel, supportedSidetoneLevels
+
+  async def setSidetone(self, persist, sidetoneLevel):
+    persist, sidetoneLevel, supportedSidetoneLevels = await self._set(self.FunctionBlock.SETTINGS, self.Function.SIDETONE, persist, sidetoneLevel)
+    return persist, sidetoneLevel, supportedSidetoneLevels
+
+  async def getImuVolumeControl(self):
+    return await self._sendAndParse(self.FunctionBlock.SETTINGS, self.Function.IMU_VOLUME_CT, self.Operator.GET)
+
+  async def setImuVolumeControl(self, isEnabled):
+    await self._set(self.FunctionBlock.SETTINGS, self.Function.IMU_VOLUME_CT, isEnabled)
+
+
+  #######################
+  #  Device Management  #
+  #######################
+
+  async def connectDevice(self, macOfOtherDevice):
+    response = await self._request(self.FunctionBlock.DEVICE_MANAGEMENT, self.Function.CONNECT_DEV, self.Operator.START, 0, *_macAddressToBytes(macOfOtherDevice))
+    return _bytesToHexString(response) # TODO
+
+  async def connectDeviceAndKeep(self, macOfOtherDevice, productTypeOfOtherDevice, macOfDeviceToKeep):
+    b1 = ((productTypeOfOtherDevice.value << 7) | 0b10000) & 255
+    return _bytesToHexString(await self._requestWithStatus(self.FunctionBlock.DEVICE_MANAGEMENT, self.Function.CONNECT_DEV, self.Operator.START, b1, *_macAddressToBytes(macOfOtherDevice), *_macAddressToBytes(macOfDeviceToKeep)))
+
+  async def listDevices(self):
+    response = await self._request(self.FunctionBlock.DEVICE_MANAGEMENT, self.Function.LIST_DEVICES, self.Operator.GET)
+    device1Connected = bool(response[0] & 0b01)
+    device2Connected = bool(response[0] & 0b10)
+    macAddresses = [MacAddress.fromBuffer(response, i) for i in range(1, len(response), 6)]
+    return (device1Connected, device2Connected), macAddresses
+
+  async def getDeviceInfo(self, macOfConnectedDevice):
+    return self.PairedDevice(await self._request(self.FunctionBlock.DEVICE_MANAGEMENT, self.Function.DEVICE_INFO, self.Operator.GET, *_macAddressToBytes(macOfConnectedDevice)))
+
+  async def getExtendedDeviceInfo(self, macOfConnectedDevice):
+    return await self._request(self.FunctionBlock.DEVICE_MANAGEMENT, self.Function.DEVICE_INFO_EXT, self.Operator.GET, *_macAddressToBytes(macOfConnectedDevice))
+
+
+  #############
+  #  Control  #
+  #############
+
+  async def getAllControls(self):
+    return await self._sendAndParseAll(self.FunctionBlock.CONTROL, self.Function.ALL_CONTROLS)
+
+  async def getChirp(self):
+    isInProgress, stopReason = await self._sendAndParse(self.FunctionBlock.CONTROL, self.Function.CHIRP, self.Operator.GET)
+    return isInProgress, stopReason
+
+  async def setChirp(self, chirping):
+    await self._set(self.FunctionBlock.CONTROL, self.Function.CHIRP, chirping, operator=self.Operator.START)
+
+
+
+  async def _readLoop(self):
+    loop = asyncio.get_running_loop()
+    decoder = self._decoder
+    dispatch = self._router.dispatch
+    try:
+      while True:
+        decoder.commit(await loop.sock_recv_into(self.socket, decoder.getWritableView()))
+        for functionBlock, function, operator, payload in decoder.frames():
+          dispatch(functionBlock, function, operator, payload)
+    except asyncio.CancelledError:
+      raise
+    except Exception as e:
+      self._router.failAll(e)
+
+  async def _sendCommand(self, functionBlock, function, operator, *payload):
+    async with self._writeLock:
+      await asyncio.get_running_loop().sock_sendall(self.socket, self._encoder.encode(functionBlock.value, function.value, operator.value, payload))
+
+  def _expect(self, functionBlock, function, *, expectList=False, listWithFunction=False):
+    """Registers a request for the next response with the given function block and function without sending anything"""
+    future = asyncio.get_running_loop().create_future()
+    self._router.add(PendingRequest(functionBlock.value, function.value, future, expectList=expectList, listWithFunction=listWithFunction))
+    return future
+
+  def _checkConnected(self):
+    if self._reader is None or self._reader.done():
+      raise ConnectionError("Not connected")
+
+  async def _wait(self, future, deadline=None):
+    """Waits for an expected response until deadline (time.monotonic), by default until timeout from now"""
+    if deadline is None and self.timeout is not None:
+      deadline = time.monotonic() + self.timeout
+    try:
+      if deadline is None:
+        return await future
+      return await asyncio.wait_for(asyncio.shield(future), max(0, deadline - time.monotonic()))
+    except asyncio.TimeoutError:
+      self._router.abandon(future, time.monotonic() + self.LATE_RESPONSE_GRACE, timedOut=True)
+      return future.result() # raises CommandTimeout, unless the response made it after all
+    except asyncio.CancelledError:
+      self._router.abandon(future, time.monotonic() + self.LATE_RESPONSE_GRACE)
+      raise
+
+  async def _request(self, functionBlock, function, operator, *payload, expectList=False, listWithFunction=False):
+    self._checkConnected()
+    future = self._expect(functionBlock, function, expectList=expectList, listWithFunction=listWithFunction)
+    try:
+      await self._sendCommand(functionBlock, function, operator, *payload)
+    except BaseException:
+      self._router.abandon(future, time.monotonic() + self.LATE_RESPONSE_GRACE)
+      raise
+    return await self._wait(future)
+
+  async def _requestWithStatus(self, functionBlock, function, operator, *payload):
+    """
+    _request for commands whose START ... FINAL response is followed by a STATUS frame with the result, returns its
+    payload. The STATUS is expected before sending, since it can arrive in the same read as the rest of the response.
+    """
+    self._checkConnected()
+    deadline = None if self.timeout is None else time.monotonic() + self.timeout
+    pending = [self._expect(functionBlock, function), self._expect(functionBlock, function)]
+    try:
+      await self._sendCommand(functionBlock, function, operator, *payload)
+      await self._wait(pending[0], deadline)
+      return await self._wait(pending[1], deadline)
+    except BaseException:
+      for future in pending:
+        self._router.abandon(future, time.monotonic() + self.LATE_RESPONSE_GRACE)
+      raise
+
+  async def _discoveryModel(self):
+    if self._model is None:
+      productIdVariant, firmwareVersion = await asyncio.gather(
+        self._request(self.FunctionBlock.PRODUCT_INFO, self.Function.PRODUCT_ID_VARIANT, self.Operator.GET),
+        self._request(self.FunctionBlock.PRODUCT_INFO, self.Function.FIRMWARE_VERSION, self.Operator.GET),
+        return_exceptions=True,
+      )
+      if isinstance(productIdVariant, BaseException) or isinstance(firmwareVersion, BaseException):
+        return None
+      self._model = self.discovery.model(productIdVariant, firmwareVersion.decode())
+    return self._model
+
+  async def _discover(self, functionBlock, function, operator, *, expectList=False):
+    model = None if self.discovery is None else await self._discoveryModel()
+    if model is None:
+      return await self._request(functionBlock, function, operator, expectList=expectList)
+    key = (functionBlock.value, function.value, operator.value)
+    response = self.discovery.get(model, key)
+    if response is None:
+      response = await self._request(functionBlock, function, operator, expectList=expectList)
+      self.discovery.put(model, key, response)
+    return response
+
+  async def _sendAndParse(self, functionBlock, function, operator, *payload):
+    return self._CODECS.get(functionBlock.value, function.value).decode(await self._request(functionBlock, function, operator, *payload))
+
+  async def _set(self, functionBlock, function, *args, operator=None):
+    payload = self._CODECS.encode(functionBlock.value, function.value, *args)
+    return await self._sendAndParse(functionBlock, function, operator or self.Operator.SET_GET, *payload)
+
+  async def _sendAndParseAll(self, functionBlock, function):
+    return self._decodeAll(functionBlock, await self._request(functionBlock, function, self.Operator.START, expectList=True, listWithFunction=True))
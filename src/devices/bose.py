@@ -1,17 +1,280 @@
+import logging
+import random
 import socket
+import threading
+import time
 
+from concurrent import futures
+from concurrent.futures import Future
+from contextlib import contextmanager
 from enum import Enum
-from .helpers import NestedEnum, _bytesToMacAddress, _applyBitmask, _macAddressToBytes, _bytesToHexString
+from . import metrics
+from .helpers import NestedEnum, MacAddress, _applyBitmask, _macAddressToBytes, _bytesToHexString
+from .framing import FrameDecoder, FrameEncoder
+from .routing import CommandTimeout, PendingRequest, ResponseRouter
+from .codecs import Codec, CodecRegistry, packer, unpacker
+
+_logger = logging.getLogger(__name__)
 
 
 class BoseDevice:
   PORT = 8
+  LATE_RESPONSE_GRACE = 5.0 # seconds a timed out or cancelled request keeps swallowing its late response frames
   
-  def __init__(self, macAddress):
+  def __init__(self, macAddress, *, cache=None, discovery=None, sock=None, timeout=None, lazy=False, reconnect=None, socketFactory=None, onConnectionLost=None, onConnectionRestored=None):
     self.macAddress = macAddress
-  
-    self.socket = socket.socket(socket.AF_BLUETOOTH, socket.SOCK_STREAM, socket.BTPROTO_RFCOMM)
-    self.socket.connect((self.macAddress, self.PORT))
+    self.cache = cache # optional SettingsCache, filled by every STATUS frame that is received
+    self.discovery = discovery # optional DiscoveryCache, shared with all devices of the same model and firmware
+    self.timeout = timeout # default deadline in seconds for every command, None waits forever
+    self.reconnect = reconnect # optional Backoff for (re)connecting, commands also retry once over a restored connection
+    self.onConnectionLost = onConnectionLost         # onConnectionLost(exception)
+    self.onConnectionRestored = onConnectionRestored # onConnectionRestored()
+    self.socket = None
+    self._socketFactory = socketFactory # returns a new connected socket, RFCOMM to macAddress by default
+    self._local = threading.local() # deadlines set with deadline() only apply to the thread that set them
+    self._decoder = FrameDecoder()
+    self._encoder = FrameEncoder()
+    self._router = ResponseRouter()
+    self._routerLock = threading.Lock()
+    self._sendLock = threading.Lock()
+    self._connectLock = threading.RLock()
+    self._subscribers = {} # (functionBlock, function) -> callbacks, None acts as wildcard
+    self._readerThread = None
+    self._readerWanted = cache is not None # the cache has to see unsolicited STATUS frames while no command is waiting
+    self._keepaliveThread = None
+    self._keepaliveStop = threading.Event()
+    self._wasConnected = False
+    self._closed = False
+    self._model = None # discovery cache key of the current connection
+    self._lastActivity = time.monotonic()
+  
+    if sock is not None: # already connected transport, e.g. a simulated device
+      self._attach(sock)
+    elif not lazy:
+      self.connect()
+
+  def connect(self):
+    """
+    Connects (again) if not connected. Commands do this on their own: without reconnect with a single attempt,
+    otherwise retrying with its backoff.
+    """
+    with self._connectLock:
+      if self._closed:
+        raise ConnectionError("Device closed")
+      if self.socket is None:
+        self._attach(self._openSocket())
+
+  def close(self):
+    self._closed = True
+    self._keepaliveStop.set()
+    with self._connectLock:
+      sock, self.socket = self.socket, None
+    if sock is not None:
+      self._shutdown(sock)
+    if self._readerThread is not None and self._readerThread is not threading.current_thread():
+      self._readerThread.join()
+    self._readerThread = None
+    with self._routerLock:
+      self._router.failAll(ConnectionError("Device closed"))
+    if self._keepaliveThread is not None and self._keepaliveThread is not threading.current_thread():
+      self._keepaliveThread.join()
+    self._keepaliveThread = None
+
+  @property
+  def isConnected(self):
+    return self.socket is not None
+
+
+  ################
+  #  CONNECTION  #
+  ################
+
+  class Backoff:
+    """
+    Jittered exponential backoff: up to attempts connection attempts, waiting initial * factor**n seconds (at most
+    maximum, minus up to jitter of it at random) between them
+    """
+
+    def __init__(self, initial=0.5, maximum=30.0, factor=2.0, attempts=6, jitter=0.5, *, random=random.random):
+      self.initial = initial
+      self.maximum = maximum
+      self.factor = factor
+      self.attempts = attempts
+      self.jitter = jitter
+      self._random = random
+
+    def delays(self):
+      for attempt in range(self.attempts - 1):
+        delay = min(self.maximum, self.initial * self.factor ** attempt)
+        yield delay * (1 - self.jitter * self._random())
+
+  def startKeepalive(self, interval=30.0, timeout=5.0):
+    """
+    Probes the connection with getBmapVersion whenever nothing was sent or received for interval seconds (starts the
+    reader). A probe without response within timeout counts as a lost connection, which is then restored right away
+    if reconnect is set.
+    """
+    self.startReader()
+    if self._keepaliveThread is not None:
+      return
+    self._keepaliveStop.clear()
+    self._keepaliveThread = threading.Thread(target=self._keepaliveLoop, args=(interval, timeout), name=f"BoseDevice-{self.macAddress}-keepalive", daemon=True)
+    self._keepaliveThread.start()
+
+  def _keepaliveLoop(self, interval, timeout):
+    while not self._keepaliveStop.wait(max(0, self._lastActivity + interval - time.monotonic())):
+      if time.monotonic() - self._lastActivity < interval:
+        continue
+      sock = self.socket
+      try:
+        with self.deadline(timeout):
+          self.getBmapVersion() # reconnects on its own if the connection is broken
+      except CommandTimeout as e:
+        self._connectionLost(sock, e)
+        if self.reconnect is not None and not self._closed:
+          try:
+            self._ensureConnected()
+          except OSError:
+            pass
+      except (OSError, futures.CancelledError):
+        pass
+      self._lastActivity = time.monotonic() # nothing to probe again before the next interval
+
+  def _openSocket(self):
+    if self._socketFactory is not None:
+      return self._socketFactory()
+    sock = socket.socket(socket.AF_BLUETOOTH, socket.SOCK_STREAM, socket.BTPROTO_RFCOMM)
+    try:
+      sock.connect((self.macAddress, self.PORT))
+    except OSError:
+      sock.close()
+      raise
+    return sock
+
+  def _attach(self, sock):
+    self.socket = sock
+    self._decoder = FrameDecoder()
+    self._model = None # the firmware might have been updated in the meantime
+    self._lastActivity = time.monotonic()
+    self._wasConnected = True
+    if self._readerWanted:
+      self._startReaderThread()
+
+  @staticmethod
+  def _shutdown(sock):
+    try:
+      sock.shutdown(socket.SHUT_RDWR) # wakes up the reader thread
+    except OSError:
+      pass
+    sock.close()
+
+  def _ensureConnected(self):
+    if self.socket is not None:
+      return
+    with self._connectLock:
+      if self.socket is not None:
+        return
+      restoring = self._wasConnected
+      delays = iter(self.reconnect.delays()) if self.reconnect is not None else iter(())
+      while True:
+        try:
+          self.connect()
+          break
+        except OSError:
+          delay = next(delays, None)
+          if delay is None or self._closed:
+            raise
+          time.sleep(delay)
+    if restoring and self.onConnectionRestored is not None:
+      self.onConnectionRestored()
+
+  def _connectionLost(self, sock, exception):
+    """Drops the broken connection sock (if it still is the current one), all outstanding commands fail"""
+    with self._connectLock:
+      if sock is None or self.socket is not sock:
+        return
+      self.socket = None
+      reader, self._readerThread = self._readerThread, None
+      self._shutdown(sock)
+    if reader is not None and reader is not threading.current_thread():
+      reader.join()
+    with self._routerLock:
+      self._router.failAll(exception if isinstance(exception, ConnectionError) else ConnectionError(str(exception)))
+    if self.onConnectionLost is not None and not self._closed:
+      self.onConnectionLost(exception)
+
+
+  ##################
+  #  NOTIFICATIONS #
+  ##################
+
+  def startReader(self):
+    """
+    Starts a background thread that owns the receiving side of the socket. Responses are handed to the waiting
+    callers, everything else (status updates, notifications, ...) goes to the subscribed callbacks. Without the
+    reader, unsolicited frames are only delivered while a command is waiting for its response. The reader is
+    restarted for every new connection. Devices with a settings cache always run it, otherwise a setting changed on
+    the device (e.g. with a button) would be served from the stale cache entry until it expires.
+    """
+    with self._connectLock:
+      self._readerWanted = True
+      if self.socket is not None and self._readerThread is None:
+        self._startReaderThread()
+
+  def _startReaderThread(self):
+    self._readerThread = threading.Thread(target=self._readLoop, args=(self.socket, self._decoder), name=f"BoseDevice-{self.macAddress}", daemon=True)
+    self._readerThread.start()
+
+  def subscribe(self, callback, functionBlock=None, function=None):
+    """
+    Calls callback(functionBlock, function, operator, payload) (as plain values and bytes) for every unsolicited
+    frame of the given function block and function, None matches everything. With the reader running, callbacks are
+    called on the reader thread and must not wait for responses themselves. Exceptions raised by a callback are
+    logged (logger devices.bose) and do not affect the connection or the other callbacks.
+    """
+    if function is not None and functionBlock is None:
+      raise ValueError("A function can only be subscribed together with its function block")
+    key = (None if functionBlock is None else functionBlock.value, None if function is None else function.value)
+    self._subscribers[key] = self._subscribers.get(key, []) + [callback]
+    return key, callback
+
+  def unsubscribe(self, subscription):
+    key, callback = subscription
+    callbacks = [c for c in self._subscribers.get(key, []) if c is not callback]
+    if callbacks:
+      self._subscribers[key] = callbacks
+    else:
+      self._subscribers.pop(key, None)
+
+
+  ###############
+  #  DEADLINES  #
+  ###############
+
+  @contextmanager
+  def deadline(self, seconds):
+    """
+    All commands of the current thread within the block have to be completed within seconds (measured from now),
+    otherwise they raise CommandTimeout. Nested deadlines can only shorten the outer one, None adds no limit.
+    """
+    previous = getattr(self._local, "deadline", None)
+    deadline = None if seconds is None else time.monotonic() + seconds
+    if previous is not None and (deadline is None or previous < deadline):
+      deadline = previous
+    self._local.deadline = deadline
+    try:
+      yield
+    finally:
+      self._local.deadline = previous
+
+  def cancel(self, functionBlock=None, function=None):
+    """
+    Cancels the outstanding commands (of the given function block and function, None matches everything), their
+    callers get a CancelledError. Returns how many commands were cancelled. Without the reader running, a caller
+    blocked on the socket only notices with the next received frame or its deadline.
+    """
+    with self._routerLock:
+      return self._router.cancel(time.monotonic() + self.LATE_RESPONSE_GRACE, None if functionBlock is None else functionBlock.value, None if function is None else function.value)
 
 
   ###########################
@@ -34,8 +297,22 @@ class BoseDevice:
   #######################
 
   def getFunctionBlockInfo(self, functionBlock):
-    self._sendCommand(functionBlock, self.Function.FUNCTION_BLOCK_INFO, self.Operator.GET)
-    return self._parseResponse().decode()
+    return self._discover(functionBlock, self.Function.FUNCTION_BLOCK_INFO, self.Operator.GET).decode()
+  
+  def getSnapshot(self, reads):
+    """
+    Reads several functions in one go: all GET requests are written with a single send and the responses are
+    collected as they arrive, so the whole batch only costs about one round trip.
+    reads is an iterable of (FunctionBlock, Function) pairs, the values are decoded like the single getters do.
+    """
+    return self._pipeline([(functionBlock, function, self.Operator.GET, b"") for functionBlock, function in reads])
+  
+  def setMany(self, writes):
+    """
+    Counterpart of getSnapshot for SET_GET: writes is an iterable of (FunctionBlock, Function, args) with the
+    arguments of the matching set method, returns a Snapshot of the decoded responses (i.e. the new values).
+    """
+    return self._pipeline([(functionBlock, function, self.Operator.SET_GET, self._CODECS.encode(functionBlock.value, function.value, *args)) for functionBlock, function, args in writes])
   
   
   ##################
@@ -43,39 +320,35 @@ class BoseDevice:
   ##################
   
   def getBmapVersion(self):
-    self._sendCommand(self.FunctionBlock.PRODUCT_INFO, self.Function.BMAP_VERSION, self.Operator.GET)
-    return self._parseResponse().decode()
+    return self._request(self.FunctionBlock.PRODUCT_INFO, self.Function.BMAP_VERSION, self.Operator.GET).decode() # not cached, the keepalive probes with it
   
   def getSupportedFunctionBlocks(self):
-    self._sendCommand(self.FunctionBlock.PRODUCT_INFO, self.Function.ALL_FUNCTION_BLOCKS, self.Operator.GET)
-    supportBitMask = self._parseResponse()
+    supportBitMask = self._discover(self.FunctionBlock.PRODUCT_INFO, self.Function.ALL_FUNCTION_BLOCKS, self.Operator.GET)
     return _applyBitmask(self.FunctionBlock, supportBitMask)
   
   def getSupportedFunctionBlockVersions(self):
-    self._sendCommand(self.FunctionBlock.PRODUCT_INFO, self.Function.ALL_FUNCTION_BLOCKS, self.Operator.START)
-    return [ver.decode() for ver in self._parseResponse(expectList=True)]
+    return [ver.decode() for ver in self._discover(self.FunctionBlock.PRODUCT_INFO, self.Function.ALL_FUNCTION_BLOCKS, self.Operator.START, expectList=True)]
   
   def getProductIdVariant(self):
-    self._sendCommand(self.FunctionBlock.PRODUCT_INFO, self.Function.PRODUCT_ID_VARIANT, self.Operator.GET)
-    return self._parseResponse() # TODO: map to some device variant class or something
+    return self._request(self.FunctionBlock.PRODUCT_INFO, self.Function.PRODUCT_ID_VARIANT, self.Operator.GET) # TODO: map to some device variant class or something
   
   def getAllDeviceNumbers(self):
     return self._sendAndParseAll(self.FunctionBlock.PRODUCT_INFO, self.Function.ALL_FUNCTIONS)
   
-  def getFirmwareVersion(self):
-    return self._sendAndParse(self.FunctionBlock.PRODUCT_INFO, self.Function.FIRMWARE_VERSION, self.Operator.GET)
+  def getFirmwareVersion(self, refresh=False):
+    return self._sendAndParse(self.FunctionBlock.PRODUCT_INFO, self.Function.FIRMWARE_VERSION, self.Operator.GET, refresh=refresh)
   
-  def getMacAddress(self):
-    return self._sendAndParse(self.FunctionBlock.PRODUCT_INFO, self.Function.MAC_ADDRESS, self.Operator.GET)
+  def getMacAddress(self, refresh=False):
+    return self._sendAndParse(self.FunctionBlock.PRODUCT_INFO, self.Function.MAC_ADDRESS, self.Operator.GET, refresh=refresh)
   
-  def getSerialNumber(self):
-    return self._sendAndParse(self.FunctionBlock.PRODUCT_INFO, self.Function.SERIAL_NUMBER, self.Operator.GET)
+  def getSerialNumber(self, refresh=False):
+    return self._sendAndParse(self.FunctionBlock.PRODUCT_INFO, self.Function.SERIAL_NUMBER, self.Operator.GET, refresh=refresh)
   
-  def getHardwareRevision(self):
-    return self._sendAndParse(self.FunctionBlock.PRODUCT_INFO, self.Function.HARDWARE_REVISION, self.Operator.GET)
+  def getHardwareRevision(self, refresh=False):
+    return self._sendAndParse(self.FunctionBlock.PRODUCT_INFO, self.Function.HARDWARE_REVISION, self.Operator.GET, refresh=refresh)
   
-  def getComponentDevices(self):
-    return self._sendAndParse(self.FunctionBlock.PRODUCT_INFO, self.Function.COMPONENT_DEVICES, self.Operator.GET)
+  def getComponentDevices(self, refresh=False):
+    return self._sendAndParse(self.FunctionBlock.PRODUCT_INFO, self.Function.COMPONENT_DEVICES, self.Operator.GET, refresh=refresh)
   
   
   ##############
@@ -85,83 +358,87 @@ class BoseDevice:
   def getAllSettings(self):
     return self._sendAndParseAll(self.FunctionBlock.SETTINGS, self.Function.ALL_SETTINGS)
   
-  def getDeviceName(self):
-    return self._sendAndParse(self.FunctionBlock.SETTINGS, self.Function.DEVICE_NAME, self.Operator.GET)
+  def getDeviceName(self, refresh=False):
+    return self._sendAndParse(self.FunctionBlock.SETTINGS, self.Function.DEVICE_NAME, self.Operator.GET, refresh=refresh)
   
   def setDeviceName(self, name):
-    return self._sendAndParse(self.FunctionBlock.SETTINGS, self.Function.DEVICE_NAME, self.Operator.SET_GET, *name.encode())
+    return self._set(self.FunctionBlock.SETTINGS, self.Function.DEVICE_NAME, name)
   
-  def getVoicePrompts(self):
-    return self._sendAndParse(self.FunctionBlock.SETTINGS, self.Function.VOICE_PROMPTS, self.Operator.GET)
+  def getVoicePrompts(self, refresh=False):
+    return self._sendAndParse(self.FunctionBlock.SETTINGS, self.Function.VOICE_PROMPTS, self.Operator.GET, refresh=refresh)
   
   def setVoicePrompts(self, config):
-    return self._sendAndParse(self.FunctionBlock.SETTINGS, self.Function.VOICE_PROMPTS, self.Operator.SET_GET, *config._getPayload())
+    return self._set(self.FunctionBlock.SETTINGS, self.Function.VOICE_PROMPTS, config)
   
-  def getStandbyTimer(self):
-    return self._sendAndParse(self.FunctionBlock.SETTINGS, self.Function.STANDBY_TIMER, self.Operator.GET)
+  def getStandbyTimer(self, refresh=False):
+    return self._sendAndParse(self.FunctionBlock.SETTINGS, self.Function.STANDBY_TIMER, self.Operator.GET, refresh=refresh)
   
   def setStandbyTimer(self, time):
-    return self._sendAndParse(self.FunctionBlock.SETTINGS, self.Function.STANDBY_TIMER, self.Operator.SET_GET, time)
+    return self._set(self.FunctionBlock.SETTINGS, self.Function.STANDBY_TIMER, time)
   
-  def getCnc(self):
-    numberOfSteps, currentStep = self._sendAndParse(self.FunctionBlock.SETTINGS, self.Function.CNC, self.Operator.GET)
+  def getCnc(self, refresh=False):
+    numberOfSteps, currentStep = self._sendAndParse(self.FunctionBlock.SETTINGS, self.Function.CNC, self.Operator.GET, refresh=refresh)
     return numberOfSteps, currentStep
   
   def setCnc(self, numberOfSteps, currentStep):
-    numberOfSteps, currentStep = self._sendAndParse(self.FunctionBlock.SETTINGS, self.Function.CNC, self.Operator.SET_GET, numberOfSteps, currentStep)
+    numberOfSteps, currentStep = self._set(self.FunctionBlock.SETTINGS, self.Function.CNC, numberOfSteps, currentStep)
     return numberOfSteps, currentStep
   
-  def getAnr(self):
-    noiseCancellingLevel, supportedLevels = self._sendAndParse(self.FunctionBlock.SETTINGS, self.Function.ANR, self.Operator.GET)
+  def getAnr(self, refresh=False):
+    noiseCancellingLevel, supportedLevels = self._sendAndParse(self.FunctionBlock.SETTINGS, self.Function.ANR, self.Operator.GET, refresh=refresh)
     return noiseCancellingLevel, supportedLevels
   
   def setAnr(self, noiseCancellingLevel):
-    noiseCancellingLevel, supportedLevels = self._sendAndParse(self.FunctionBlock.SETTINGS, self.Function.ANR, self.Operator.SET_GET, noiseCancellingLevel.value)
+    noiseCancellingLevel, supportedLevels = self._set(self.FunctionBlock.SETTINGS, self.Function.ANR, noiseCancellingLevel)
     return noiseCancellingLevel, supportedLevels
   
-  def getBassControl(self):
-    minStep, maxStep, currentStep = self._sendAndParse(self.FunctionBlock.SETTINGS, self.Function.BASS_CONTROL, self.Operator.GET)
+  def getBassControl(self, refresh=False):
+    minStep, maxStep, currentStep = self._sendAndParse(self.FunctionBlock.SETTINGS, self.Function.BASS_CONTROL, self.Operator.GET, refresh=refresh)
     return minStep, maxStep, currentStep
   
   def setBassControl(self, currentStep):
-    minStep, maxStep, currentStep = self._sendAndParse(self.FunctionBlock.SETTINGS, self.Function.BASS_CONTROL, self.Operator.SET_GET, currentStep)
+    minStep, maxStep, currentStep = self._set(self.FunctionBlock.SETTINGS, self.Function.BASS_CONTROL, currentStep)
     return minStep, maxStep, currentStep
   
-  def getAlerts(self):
-    ringtoneEnabled, hapticsEnabled = self._sendAndParse(self.FunctionBlock.SETTINGS, self.Function.ALERTS, self.Operator.GET)
+  def getAlerts(self, refresh=False):
+    ringtoneEnabled, hapticsEnabled = self._sendAndParse(self.FunctionBlock.SETTINGS, self.Function.ALERTS, self.Operator.GET, refresh=refresh)
     return ringtoneEnabled, hapticsEnabled
     
   def setAlerts(self, ringtoneEnabled, hapticsEnabled):
-    ringtoneEnabled, hapticsEnabled = self._sendAndParse(self.FunctionBlock.SETTINGS, self.Function.ALERTS, self.Operator.SET_GET, ringtoneEnabled | (hapticsEnabled << 1))
+    ringtoneEnabled, hapticsEnabled = self._set(self.FunctionBlock.SETTINGS, self.Function.ALERTS, ringtoneEnabled, hapticsEnabled)
     return ringtoneEnabled, hapticsEnabled
   
-  def getButtons(self):
-    return self._sendAndParse(self.FunctionBlock.SETTINGS, self.Function.BUTTONS, self.Operator.GET)
+  def getButtons(self, refresh=False):
+    return self._sendAndParse(self.FunctionBlock.SETTINGS, self.Function.BUTTONS, self.Operator.GET, refresh=refresh)
   
   def setButtons(self, config):
-    return self._sendAndParse(self.FunctionBlock.SETTINGS, self.Function.BUTTONS, self.Operator.SET_GET, *config._getPayload())
+    return self._set(self.FunctionBlock.SETTINGS, self.Function.BUTTONS, config)
   
-  def getMultipoint(self):
-    isSupported, isEnabled = self._sendAndParse(self.FunctionBlock.SETTINGS, self.Function.MULTIPOINT, self.Operator.GET)
+  def getMultipoint(self, refresh=False):
+    isSupported, isEnabled = self._sendAndParse(self.FunctionBlock.SETTINGS, self.Function.MULTIPOINT, self.Operator.GET, refresh=refresh)
     return isSupported, isEnabled
   
   def setMultipoint(self, isSupported, isEnabled):
-    isSupported, isEnabled = self._sendAndParse(self.FunctionBlock.SETTINGS, self.Function.MULTIPOINT, self.Operator.SET_GET, isEnabled | (isSupported << 1))
+    isSupported, isEnabled = self._set(self.FunctionBlock.SETTINGS, self.Function.MULTIPOINT, isSupported, isEnabled)
     return isSupported, isEnabled
   
-  def getSidetone(self):
-    persist, sidetoneLevel, supportedSidetoneLevels = self._sendAndParse(self.FunctionBlock.SETTINGS, self.Function.SIDETONE, self.Operator.GET)
+  def getSidetone(self, refresh=False):
+    persist, sidetoneLevel, supportedSidetoneLevels = self._sendAndParse(self.FunctionBlock.SETTINGS, self.Function.SIDETONE, self.Operator.GET, refresh=refresh)
     return persist, sidetoneLevel, supportedSidetoneLevels
 
   def setSidetone(self, persist, sidetoneLevel):
-    persist, sidetoneLevel, supportedSidetoneLevels = self._sendAndParse(self.FunctionBlock.SETTINGS, self.Function.BUTTONS, self.Operator.SET_GET, persist, sidetoneLevel)
+    persist, sidetoneLevel, supportedSidetoneLevels = self._set(self.FunctionBlock.SETTINGS, self.Function.SIDETONE, persist, sidetoneLevel)
     return persist, sidetoneLevel, supportedSidetoneLevels
   
-  def getImuVolumeControl(self):
-    return self._sendAndParse(self.FunctionBlock.SETTINGS, self.Function.IMU_VOLUME_CT, self.Operator.GET)
+  def getImuVolumeControl(self, refresh=False):
+    return self._sendAndParse(self.FunctionBlock.SETTINGS, self.Function.IMU_VOLUME_CT, self.Operator.GET, refresh=refresh)
     
   def setImuVolumeControl(self, isEnabled):
-    self._sendAndParse(self.FunctionBlock.SETTINGS, self.Function.IMU_VOLUME_CT, self.Operator.SET_GET, isEnabled)
+    self._set(self.FunctionBlock.SETTINGS, self.Function.IMU_VOLUME_CT, isEnabled)
+  
+  def applyProfile(self, profile):
+    """Brings the settings in line with a SettingsProfile, only sending what differs; returns its ProfileReport"""
+    return profile.apply(self)
     
     
   #####################
@@ -176,15 +453,11 @@ class BoseDevice:
   #######################
   
   def connectDevice(self, macOfOtherDevice):
-    self._sendCommand(self.FunctionBlock.DEVICE_MANAGEMENT, self.Function.CONNECT_DEV, self.Operator.START, 0, *_macAddressToBytes(macOfOtherDevice))
-    return _bytesToHexString(self._parseResponse()) # TODO
+    return _bytesToHexString(self._request(self.FunctionBlock.DEVICE_MANAGEMENT, self.Function.CONNECT_DEV, self.Operator.START, 0, *_macAddressToBytes(macOfOtherDevice))) # TODO
   
   def connectDeviceAndKeep(self, macOfOtherDevice, productTypeOfOtherDevice, macOfDeviceToKeep):
     b1 = ((productTypeOfOtherDevice.value << 7) | 0b10000) & 255
-    self._sendCommand(self.FunctionBlock.DEVICE_MANAGEMENT, self.Function.CONNECT_DEV, self.Operator.START, b1, *_macAddressToBytes(macOfOtherDevice), *_macAddressToBytes(macOfDeviceToKeep))
-    self._parseResponse() # Start
-    return _bytesToHexString(self._parseResponse())
-    #return _bytesToHexString(self._parseResponse()) # TODO
+    return _bytesToHexString(self._requestWithStatus(self.FunctionBlock.DEVICE_MANAGEMENT, self.Function.CONNECT_DEV, self.Operator.START, b1, *_macAddressToBytes(macOfOtherDevice), *_macAddressToBytes(macOfDeviceToKeep)))
   
   def disconnectDevice(self, macOfOtherDevice):
     pass # TODO
@@ -193,20 +466,17 @@ class BoseDevice:
     pass # TODO
   
   def listDevices(self):
-    self._sendCommand(self.FunctionBlock.DEVICE_MANAGEMENT, self.Function.LIST_DEVICES, self.Operator.GET)
-    response = self._parseResponse()
+    response = self._request(self.FunctionBlock.DEVICE_MANAGEMENT, self.Function.LIST_DEVICES, self.Operator.GET)
     device1Connected = bool(response[0] & 0b01)
     device2Connected = bool(response[0] & 0b10)
-    macAddresses = [_bytesToMacAddress(response[i:i+6]) for i in range(1, len(response), 6)]
+    macAddresses = [MacAddress.fromBuffer(response, i) for i in range(1, len(response), 6)]
     return (device1Connected, device2Connected), macAddresses
   
   def getDeviceInfo(self, macOfConnectedDevice):
-    self._sendCommand(self.FunctionBlock.DEVICE_MANAGEMENT, self.Function.DEVICE_INFO, self.Operator.GET, *_macAddressToBytes(macOfConnectedDevice))
-    return self.PairedDevice(self._parseResponse())
+    return self.PairedDevice(self._request(self.FunctionBlock.DEVICE_MANAGEMENT, self.Function.DEVICE_INFO, self.Operator.GET, *_macAddressToBytes(macOfConnectedDevice)))
   
   def getExtendedDeviceInfo(self, macOfConnectedDevice):
-    self._sendCommand(self.FunctionBlock.DEVICE_MANAGEMENT, self.Function.DEVICE_INFO_EXT, self.Operator.GET, *_macAddressToBytes(macOfConnectedDevice))
-    return self._parseResponse()
+    return self._request(self.FunctionBlock.DEVICE_MANAGEMENT, self.Function.DEVICE_INFO_EXT, self.Operator.GET, *_macAddressToBytes(macOfConnectedDevice))
   
   def clearDeviceList(self):
     pass
@@ -240,12 +510,12 @@ class BoseDevice:
   def getAllControls(self):
     return self._sendAndParseAll(self.FunctionBlock.CONTROL, self.Function.ALL_CONTROLS)
   
-  def getChirp(self):
-    isInProgress, stopReason = self._sendAndParse(self.FunctionBlock.CONTROL, self.Function.CHIRP, self.Operator.GET)
+  def getChirp(self, refresh=False):
+    isInProgress, stopReason = self._sendAndParse(self.FunctionBlock.CONTROL, self.Function.CHIRP, self.Operator.GET, refresh=refresh)
     return isInProgress, stopReason
   
   def setChirp(self, chirping):
-    self._sendAndParse(self.FunctionBlock.CONTROL, self.Function.CHIRP, self.Operator.START, chirping)
+    self._set(self.FunctionBlock.CONTROL, self.Function.CHIRP, chirping, operator=self.Operator.START)
   
   
   class Operator(Enum):
@@ -414,7 +684,7 @@ class BoseDevice:
       SPEAKER = 2
     
     def __init__(self, bytes):
-      self.macAddress = _bytesToMacAddress(bytes[:6])
+      self.macAddress = MacAddress.fromBuffer(bytes)
       self.isConnected   = bool(bytes[6] & 0b0001)
       self.isLocalDevice = bool(bytes[6] & 0x0010)
       self.isBoseProduct = bool(bytes[6] & 0x0100)
@@ -431,6 +701,37 @@ class BoseDevice:
       
       self.name = bytes[pos:].decode()
     
+  class Snapshot:
+    """Result of getSnapshot, indexed by (FunctionBlock, Function); reading an entry that failed raises its error"""
+    
+    def __init__(self, values, errors):
+      self._values = values
+      self._errors = errors
+      
+    def __getitem__(self, key):
+      functionBlock, function = key
+      key = (functionBlock.value, function.value)
+      if key in self._errors:
+        raise self._errors[key]
+      return self._values[key]
+    
+    def __contains__(self, key):
+      functionBlock, function = key
+      return (functionBlock.value, function.value) in self._values
+    
+    def __len__(self):
+      return len(self._values)
+    
+    def get(self, functionBlock, function, default=None):
+      return self._values.get((functionBlock.value, function.value), default)
+    
+    @property
+    def errors(self):
+      return dict(self._errors)
+    
+    def __repr__(self):
+      return f"Snapshot<values={self._values}, errors={self._errors}>"
+    
   class ChirpStopReason(Enum):
     NEVER_SAW_CHIRP = 0
     USER_PUSHED_BUTTON = 1
@@ -441,69 +742,301 @@ class BoseDevice:
     
     
   def _sendCommand(self, functionBlock, function, operator, *payload):
-    self.socket.send(bytes([functionBlock.value, function.value, operator.value, len(payload), *payload]))
-  
-  def _parseResponse(self, *, withFunction=False, expectList=False, listWithFunction=False):
-    # TODO: maybe add some check that the result matches the request or something?
-    _, function = self.socket.recv(2)
-    status = self.socket.recv(1)[0]
-    length = self.socket.recv(1)[0]
-    payload = self.socket.recv(length)
-
-    if (status == BoseDevice.Operator.ERROR.value):
-      raise Exception(f"Invalid response, error code: {payload[0]}")
-    elif (status == BoseDevice.Operator.START.value or expectList):
-      data = []
+    self._ensureConnected()
+    with self._sendLock: # the encoder buffer is shared, so encoding is part of the critical section
+      frame = self._encoder.encode(functionBlock.value, function.value, operator.value, payload)
+      self.socket.sendall(frame)
+      size = len(frame)
+    self._lastActivity = time.monotonic()
+    if metrics.active is not None:
+      metrics.active.frameSent(self.macAddress, functionBlock.value, function.value, size)
+  
+  def _receiveFrame(self, deadline=None, sock=None, decoder=None):
+    sock = sock or self.socket
+    decoder = decoder or self._decoder
+    frame = decoder.nextFrame()
+    if frame is None and deadline is not None:
+      try:
+        while frame is None:
+          remaining = deadline - time.monotonic()
+          if remaining <= 0:
+            raise socket.timeout()
+          sock.settimeout(remaining)
+          decoder.readFrom(sock) # a partial frame stays buffered in the decoder
+          frame = decoder.nextFrame()
+      finally:
+        sock.settimeout(None)
+    while frame is None:
+      decoder.readFrom(sock)
+      frame = decoder.nextFrame()
+    self._lastActivity = time.monotonic()
+    if self.cache is not None:
+      self._updateCache(*frame)
+    if metrics.active is not None:
+      metrics.active.frameReceived(self.macAddress, *frame)
+    return frame
+  
+  def _updateCache(self, functionBlock, function, operator, payload):
+    key = (functionBlock, function)
+    if key not in self._CODECS:
+      return
+    if operator == BoseDevice.Operator.STATUS.value: # solicited or not, this is the current state of the setting
+      self.cache.put(key, bytes(payload))
+    elif operator == BoseDevice.Operator.ERROR.value:
+      self.cache.invalidate(key)
+  
+  def _handleFrame(self, functionBlock, function, operator, payload):
+    with self._routerLock:
+      handled = self._router.dispatch(functionBlock, function, operator, payload)
+    if not handled:
+      self._notify(functionBlock, function, operator, bytes(payload))
+  
+  def _notify(self, functionBlock, function, operator, payload):
+    callbacks = self._subscribers.get((functionBlock, function), []) + self._subscribers.get((functionBlock, None), []) + self._subscribers.get((None, None), [])
+    for callback in callbacks:
+      try:
+        callback(functionBlock, function, operator, payload)
+      except Exception: # a subscriber must not take down the reader (and with it the connection)
+        _logger.exception("Subscriber %r failed on function %s of function block %s", callback, function, functionBlock)
+  
+  def _readLoop(self, sock, decoder):
+    try:
       while True:
-        part = self._parseResponse(withFunction=listWithFunction)
-        if part is None:
-          break
-        data.append(part)
-      return data
-    elif (status == BoseDevice.Operator.STATUS.value):
-      if withFunction:
-        return function, payload
-      return payload
-    elif (status == BoseDevice.Operator.PROCESS.value):
-      return self._parseResponse(withFunction=withFunction, expectList=expectList, listWithFunction=listWithFunction)
-    elif (status == BoseDevice.Operator.FINAL.value):
-      return None
-    
-    raise Exception(f"Encountered illegal state, response type/status: {status}")
-  
-  def _sendAndParse(self, functionBlock, function, operator, *payload):
-    self._sendCommand(functionBlock, function, operator, *payload)
-    return self._FUNCTIONS[functionBlock][function.value][1](self._parseResponse())
+        self._handleFrame(*self._receiveFrame(None, sock, decoder))
+    except Exception as e:
+      self._connectionLost(sock, e)
+  
+  def _expect(self, functionBlock, function, *, expectList=False, listWithFunction=False):
+    """Registers a request for the next response with the given function block and function without sending anything"""
+    future = Future()
+    with self._routerLock:
+      self._router.add(PendingRequest(functionBlock.value, function.value, future, expectList=expectList, listWithFunction=listWithFunction))
+    return future
+  
+  def _deadline(self):
+    deadline = getattr(self._local, "deadline", None)
+    if self.timeout is not None:
+      own = time.monotonic() + self.timeout
+      deadline = own if deadline is None else min(deadline, own)
+    return deadline
+  
+  def _wait(self, future):
+    deadline = self._deadline()
+    try:
+      if self._readerThread is None:
+        while not future.done(): # nobody else reads from the socket, so do it ourselves
+          self._handleFrame(*self._receiveFrame(deadline))
+      return future.result(None if deadline is None else max(0, deadline - time.monotonic()))
+    except (socket.timeout, futures.TimeoutError):
+      pass
+    with self._routerLock: # the request stays routed, so its late response cannot be mistaken for the next one's
+      self._router.abandon(future, time.monotonic() + self.LATE_RESPONSE_GRACE, timedOut=True)
+    return future.result() # raises CommandTimeout, unless the response made it after all
+  
+  def _retrying(self, attempt):
+    """
+    Runs attempt() over the current connection, connecting first. A broken connection is dropped and, with
+    reconnect, attempt runs once more over the restored connection.
+    """
+    for retry in (False, True):
+      self._ensureConnected()
+      sock = self.socket
+      try:
+        return attempt()
+      except ConnectionError as e: # broken pipe, reset, closed by the device, ...
+        self._connectionLost(sock, e)
+        if retry or self.reconnect is None or self._closed:
+          raise
+  
+  def _request(self, functionBlock, function, operator, *payload, expectList=False, listWithFunction=False):
+    def attempt():
+      future = self._expect(functionBlock, function, expectList=expectList, listWithFunction=listWithFunction)
+      collector = metrics.active
+      if collector is None:
+        self._sendCommand(functionBlock, function, operator, *payload)
+        return self._wait(future)
+      start = time.perf_counter()
+      exception = None
+      try:
+        self._sendCommand(functionBlock, function, operator, *payload)
+        return self._wait(future)
+      except BaseException as e:
+        exception = e
+        raise
+      finally: # failed and timed out commands count as well, they are the slow ones
+        collector.commandDone(self.macAddress, functionBlock.value, function.value, time.perf_counter() - start, metrics.outcome(exception))
+    return self._retrying(attempt)
+  
+  def _requestWithStatus(self, functionBlock, function, operator, *payload):
+    """
+    _request for commands whose START ... FINAL response is followed by a STATUS frame with the result, returns its
+    payload. The STATUS is expected before sending, otherwise the reader thread could take it for unsolicited.
+    """
+    def attempt():
+      pending = [self._expect(functionBlock, function), self._expect(functionBlock, function)]
+      try:
+        self._sendCommand(functionBlock, function, operator, *payload)
+        self._wait(pending[0])
+        return self._wait(pending[1])
+      except ConnectionError:
+        raise # all outstanding requests fail with the connection
+      except BaseException:
+        self._abandon(pending) # e.g. an ERROR response, the STATUS will not come anymore
+        raise
+    with self.deadline(self.timeout):
+      return self._retrying(attempt)
+  
+  def _pipeline(self, requests):
+    requests = list(requests)
+    collector = metrics.active
+    
+    def attempt():
+      with self._sendLock: # the encoder buffer is shared
+        frames = self._encoder.encodeAll((functionBlock.value, function.value, operator.value, payload) for functionBlock, function, operator, payload in requests)
+        pending = [self._expect(functionBlock, function) for functionBlock, function, _, _ in requests]
+        start = time.perf_counter()
+        try:
+          self.socket.sendall(frames)
+        except BaseException:
+          self._abandon(pending)
+          raise
+      self._lastActivity = time.monotonic()
+      with self.deadline(self.timeout):
+        for (functionBlock, function, _, payload), future in zip(requests, pending):
+          if collector is not None:
+            collector.frameSent(self.macAddress, functionBlock.value, function.value, 4 + len(payload))
+          exception = None
+          try:
+            self._wait(future)
+          except Exception as e: # kept in the snapshot
+            exception = e
+          if collector is not None:
+            collector.commandDone(self.macAddress, functionBlock.value, function.value, time.perf_counter() - start, metrics.outcome(exception))
+          if isinstance(exception, ConnectionError):
+            raise exception # the whole batch is sent again if the connection is restored
+      return pending
+    pending = self._retrying(attempt)
+    
+    values = {}
+    errors = {}
+    for (functionBlock, function, _, _), future in zip(requests, pending):
+      key = (functionBlock.value, function.value)
+      exception = futures.CancelledError() if future.cancelled() else future.exception()
+      if exception is not None:
+        errors[key] = exception
+        continue
+      values[key] = self._CODECS.decode(*key, future.result())
+    return self.Snapshot(values, errors)
+  
+  def _abandon(self, pending):
+    with self._routerLock:
+      for future in pending:
+        self._router.abandon(future, time.monotonic() + self.LATE_RESPONSE_GRACE)
+  
+  def _discoveryModel(self):
+    if self._model is None:
+      snapshot = self.getSnapshot([(self.FunctionBlock.PRODUCT_INFO, self.Function.PRODUCT_ID_VARIANT), (self.FunctionBlock.PRODUCT_INFO, self.Function.FIRMWARE_VERSION)])
+      if snapshot.errors:
+        return None
+      self._model = self.discovery.model(snapshot[self.FunctionBlock.PRODUCT_INFO, self.Function.PRODUCT_ID_VARIANT], snapshot[self.FunctionBlock.PRODUCT_INFO, self.Function.FIRMWARE_VERSION])
+    return self._model
+  
+  def _discover(self, functionBlock, function, operator, *, expectList=False):
+    """_request for responses that only change with the firmware, answered from the discovery cache if possible"""
+    model = None if self.discovery is None else self._discoveryModel()
+    if model is None:
+      return self._request(functionBlock, function, operator, expectList=expectList)
+    key = (functionBlock.value, function.value, operator.value)
+    response = self.discovery.get(model, key)
+    if response is None:
+      response = self._request(functionBlock, function, operator, expectList=expectList)
+      self.discovery.put(model, key, response)
+    return response
+  
+  def _sendAndParse(self, functionBlock, function, operator, *payload, refresh=False):
+    key = (functionBlock.value, function.value)
+    decode = self._CODECS.get(*key).decode
+    if self.cache is not None and operator == self.Operator.GET and not refresh:
+      cached = self.cache.get(key)
+      if cached is not None:
+        if metrics.active is not None:
+          metrics.active.cacheHit(self.macAddress, *key)
+        return decode(cached)
+    
+    return decode(self._request(functionBlock, function, operator, *payload))
+  
+  def _set(self, functionBlock, function, *args, operator=None):
+    payload = self._CODECS.encode(functionBlock.value, function.value, *args)
+    return self._sendAndParse(functionBlock, function, operator or self.Operator.SET_GET, *payload)
   
   def _sendAndParseAll(self, functionBlock, function):
-    self._sendCommand(functionBlock, function, self.Operator.START)
-    values = self._parseResponse(expectList=True, listWithFunction=True)
-    values = {k: f(v) for k, f, v in map(lambda x: (*self._FUNCTIONS[functionBlock].get(x[0]), x[1]), values)} # apply the correct transformation to each component -> mac address should be converted using  _bytesToMacAddress, everything else simply bytes.decode
-    return values
-
-  _FUNCTIONS = {
-    FunctionBlock.PRODUCT_INFO: {
-      Function.FIRMWARE_VERSION: bytes.decode,
-      Function.MAC_ADDRESS: _bytesToMacAddress,
-      Function.SERIAL_NUMBER: bytes.decode,
-      Function.HARDWARE_REVISION: bytes.decode, # TODO
-      Function.COMPONENT_DEVICES: bytes.decode, # TODO
-    },
-    FunctionBlock.SETTINGS: {
-      Function.DEVICE_NAME: lambda x: x[1:].decode(),
-      Function.VOICE_PROMPTS: lambda x: BoseDevice.VoicePromptSetting(x),
-      Function.STANDBY_TIMER: lambda x: x[0],
-      Function.CNC: lambda x: (x[0], x[1]),
-      Function.ANR: lambda x: (BoseDevice.AnrLevel(x[0]), _applyBitmask(BoseDevice.AnrLevel, x[1:])),
-      Function.BASS_CONTROL: lambda x: (x[0], x[1], x[2]),
-      Function.ALERTS: lambda x: (bool(x[0] & 0b01), bool(x[0] & 0b10)),
-      Function.BUTTONS: lambda x: BoseDevice.ActionButtonSetting(x),
-      Function.MULTIPOINT: lambda x: (bool(x[0] & 0b10),  bool(x[0] & 0x01)), # TODO
-      Function.SIDETONE: lambda x: (x[0], BoseDevice.SidetoneLevel(x[1]), _applyBitmask(BoseDevice.SidetoneLevel, x[2:])),
-      Function.IMU_VOLUME_CT: lambda x: bool(x),
-    },
-    FunctionBlock.CONTROL: {
-      Function.CHIRP: lambda x: (bool(x[0] & 1), BoseDevice.ChirpStopReason((x[0] >> 1) & 0b1111111))
-    }
-  }
-  _FUNCTIONS = {ko: {ki.value: [ki, vi] for ki, vi in vo.items()} for ko, vo in _FUNCTIONS.items()}
\ No newline at end of file
+    return self._decodeAll(functionBlock, self._request(functionBlock, function, self.Operator.START, expectList=True, listWithFunction=True))
+  
+  @classmethod
+  def _decodeAll(cls, functionBlock, values):
+    # apply the correct transformation to each component -> mac address should be converted to a MacAddress, everything else simply bytes.decode
+    # entries without a known codec are kept as raw bytes under their function value
+    getCodec = cls._CODECS.get
+    functionBlock = functionBlock.value
+    decoded = {}
+    for function, payload in values:
+      codec = getCodec(functionBlock, function)
+      if codec is None:
+        decoded[function] = payload
+      else:
+        decoded[codec.member] = codec.decode(payload)
+    return decoded
+
+  def _codecTable():
+    # deferred until the first codec lookup, see CodecRegistry
+    FunctionBlock = BoseDevice.FunctionBlock
+    Function = BoseDevice.Function
+    return [
+      Codec(FunctionBlock.PRODUCT_INFO, Function.PRODUCT_ID_VARIANT, "PRODUCT_ID_VARIANT"), # raw, like getProductIdVariant
+      Codec(FunctionBlock.PRODUCT_INFO, Function.FIRMWARE_VERSION, "FIRMWARE_VERSION", bytes.decode),
+      Codec(FunctionBlock.PRODUCT_INFO, Function.MAC_ADDRESS, "MAC_ADDRESS", MacAddress.fromBuffer),
+      Codec(FunctionBlock.PRODUCT_INFO, Function.SERIAL_NUMBER, "SERIAL_NUMBER", bytes.decode),
+      Codec(FunctionBlock.PRODUCT_INFO, Function.HARDWARE_REVISION, "HARDWARE_REVISION", bytes.decode), # TODO
+      Codec(FunctionBlock.PRODUCT_INFO, Function.COMPONENT_DEVICES, "COMPONENT_DEVICES", bytes.decode), # TODO
+
+      Codec(FunctionBlock.SETTINGS, Function.DEVICE_NAME, "DEVICE_NAME",
+            lambda x: x[1:].decode(),
+            str.encode),
+      Codec(FunctionBlock.SETTINGS, Function.VOICE_PROMPTS, "VOICE_PROMPTS",
+            lambda x: BoseDevice.VoicePromptSetting(x),
+            lambda config: config._getPayload()),
+      Codec(FunctionBlock.SETTINGS, Function.STANDBY_TIMER, "STANDBY_TIMER",
+            lambda x: x[0],
+            packer("B")),
+      Codec(FunctionBlock.SETTINGS, Function.CNC, "CNC",
+            unpacker("BB"),
+            packer("BB")),
+      Codec(FunctionBlock.SETTINGS, Function.ANR, "ANR",
+            lambda x: (BoseDevice.AnrLevel(x[0]), _applyBitmask(BoseDevice.AnrLevel, x[1:])),
+            lambda noiseCancellingLevel: bytes([noiseCancellingLevel.value])),
+      Codec(FunctionBlock.SETTINGS, Function.BASS_CONTROL, "BASS_CONTROL",
+            unpacker("BBB"),
+            packer("B")),
+      Codec(FunctionBlock.SETTINGS, Function.ALERTS, "ALERTS",
+            lambda x: (bool(x[0] & 0b01), bool(x[0] & 0b10)),
+            lambda ringtoneEnabled, hapticsEnabled: bytes([ringtoneEnabled | (hapticsEnabled << 1)])),
+      Codec(FunctionBlock.SETTINGS, Function.BUTTONS, "BUTTONS",
+            lambda x: BoseDevice.ActionButtonSetting(x),
+            lambda config: config._getPayload()),
+      Codec(FunctionBlock.SETTINGS, Function.MULTIPOINT, "MULTIPOINT",
+            lambda x: (bool(x[0] & 0b10),  bool(x[0] & 0x01)), # TODO
+            lambda isSupported, isEnabled: bytes([isEnabled | (isSupported << 1)])),
+      Codec(FunctionBlock.SETTINGS, Function.SIDETONE, "SIDETONE",
+            lambda x: (x[0], BoseDevice.SidetoneLevel(x[1]), _applyBitmask(BoseDevice.SidetoneLevel, x[2:])),
+            lambda persist, sidetoneLevel: bytes([persist, sidetoneLevel])),
+      Codec(FunctionBlock.SETTINGS, Function.IMU_VOLUME_CT, "IMU_VOLUME_CT",
+            lambda x: bool(x),
+            lambda isEnabled: bytes([isEnabled])),
+
+      Codec(FunctionBlock.CONTROL, Function.CHIRP, "CHIRP",
+            lambda x: (bool(x[0] & 1), BoseDevice.ChirpStopReason((x[0] >> 1) & 0b1111111)),
+            lambda chirping: bytes([chirping])),
+    ]
+
+  _CODECS = CodecRegistry(_codecTable)
+  del _codecTable
@@ -0,0 +1,48 @@
+import time
+
+
+class SettingsCache:
+  """
+  Read-through cache for the raw STATUS payloads of a device, keyed by (functionBlock, function) values.
+
+  Every entry expires after its own TTL (None means it never expires), the TTL for single functions can be
+  overridden with setTtl. A BoseDevice with a cache runs its reader thread, which puts and invalidates entries
+  concurrently to the getters.
+  """
+
+  def __init__(self, defaultTtl=None, *, clock=time.monotonic):
+    self.defaultTtl = defaultTtl
+    self._ttls = {}
+    self._entries = {} # key -> (expiresAt, payload)
+    self._clock = clock
+    self.hits = 0
+    self.misses = 0
+
+  def setTtl(self, functionBlock, function, ttl):
+    self._ttls[(functionBlock.value, function.value)] = ttl
+
+  def get(self, key):
+    entry = self._entries.get(key)
+    if entry is not None:
+      expiresAt, payload = entry
+      if expiresAt is None or expiresAt > self._clock():
+        self.hits += 1
+        return payload
+      self._entries.pop(key, None) # the reader thread might have replaced or dropped it in the meantime
+    self.misses += 1
+    return None
+
+  def put(self, key, payload):
+    ttl = self._ttls.get(key, self.defaultTtl)
+    if ttl is not None and ttl <= 0:
+      return
+    self._entries[key] = (None if ttl is None else self._clock() + ttl, payload)
+
+  def invalidate(self, key=None):
+    if key is None:
+      self._entries.clear()
+    else:
+      self._entries.pop(key, None)
+
+  def __len__(self):
+    return len(self._entries)
@@ -0,0 +1,80 @@
+import struct
+
+
+def _raw(payload):
+  return bytes(payload)
+
+
+class Codec:
+  """Decoder (payload -> value) and optional encoder (arguments -> payload) of a single function of a function block"""
+
+  __slots__ = ("functionBlock", "function", "member", "name", "decode", "encode")
+
+  def __init__(self, functionBlock, function, name, decode=_raw, encode=None):
+    self.functionBlock = functionBlock.value
+    self.function = function.value
+    self.member = function # Function enum member, only used as key for results (note that it might be an alias)
+    self.name = name       # the actual name of the function within its block
+    self.decode = decode
+    self.encode = encode
+
+  def __repr__(self):
+    return f"Codec<functionBlock={self.functionBlock}, function={self.function}, name={self.name}>"
+
+
+class CodecRegistry:
+  """
+  Maps (functionBlock, function) values to their codec with a single dict lookup.
+
+  Function values are only unique within a function block, so the registry is keyed by both and never goes
+  through the (aliased) Function enum.
+  """
+
+  def __init__(self, codecs):
+    """codecs is an iterable of Codec, or a function returning one that is only called by the first lookup"""
+    if callable(codecs):
+      self._build = codecs
+    else:
+      self._codecs = self._index(codecs)
+
+  def __getattr__(self, name):
+    # only reached until the deferred table is built, afterwards _codecs is a plain attribute
+    if name != "_codecs":
+      raise AttributeError(name)
+    self._codecs = self._index(self._build())
+    return self._codecs
+
+  @staticmethod
+  def _index(codecs):
+    return {(codec.functionBlock, codec.function): codec for codec in codecs}
+
+  def __contains__(self, key):
+    return key in self._codecs
+
+  def __iter__(self):
+    return iter(self._codecs.values())
+
+  def get(self, functionBlock, function):
+    return self._codecs.get((functionBlock, function))
+
+  def decode(self, functionBlock, function, payload):
+    """Decodes a payload, functions without a known codec are returned as raw bytes"""
+    codec = self._codecs.get((functionBlock, function))
+    if codec is None:
+      return bytes(payload)
+    return codec.decode(payload)
+
+  def encode(self, functionBlock, function, *args):
+    codec = self._codecs.get((functionBlock, function))
+    if codec is None or codec.encode is None:
+      raise ValueError(f"No encoder for function {function} of function block {functionBlock}")
+    return codec.encode(*args)
+
+
+def unpacker(layout):
+  """Decoder for fixed payload layouts, returns the unpacked tuple"""
+  return struct.Struct(layout).unpack_from
+
+def packer(layout):
+  """Encoder for fixed payload layouts"""
+  return struct.Struct(layout).pack
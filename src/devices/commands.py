@@ -0,0 +1,99 @@
+from enum import Enum
+
+from .bose import BoseDevice
+from .helpers import MacAddress
+from .profile import SettingsProfile
+
+# Calling BoseDevice commands by name with JSON arguments and turning their results into JSON values, shared by the
+# daemon and the command line
+
+# BoseDevice methods that can be called by name; setVoicePrompts/setButtons take setting objects, use applyProfile
+COMMANDS = frozenset([
+  "startChirp", "stopChirp", "startMusicSharing", "getFunctionBlockInfo", "getSnapshot",
+  "getBmapVersion", "getSupportedFunctionBlocks", "getSupportedFunctionBlockVersions", "getProductIdVariant", "getAllDeviceNumbers",
+  "getFirmwareVersion", "getMacAddress", "getSerialNumber", "getHardwareRevision", "getComponentDevices",
+  "getAllSettings", "getDeviceName", "setDeviceName", "getVoicePrompts", "getStandbyTimer", "setStandbyTimer", "getCnc", "setCnc",
+  "getAnr", "setAnr", "getBassControl", "setBassControl", "getAlerts", "setAlerts", "getButtons", "getMultipoint", "setMultipoint",
+  "getSidetone", "setSidetone", "getImuVolumeControl", "setImuVolumeControl", "applyProfile",
+  "connectDevice", "connectDeviceAndKeep", "disconnectDevice", "removeDevice", "listDevices", "getDeviceInfo", "getExtendedDeviceInfo",
+  "clearDeviceList", "getPairingMode", "setPairingMode", "getLocalMacAddress", "prepareP2P", "getP2PMode", "setP2PMode", "startRouting",
+  "getAllControls", "getChirp", "setChirp",
+])
+
+def _enumValue(enum):
+  return lambda value: enum[value].value if isinstance(value, str) else value
+
+def _reads(reads):
+  return [(BoseDevice.FunctionBlock[functionBlock], BoseDevice.Function[function]) for functionBlock, function in reads]
+
+# positional arguments of the commands, by command; enums are given by name
+_ARGUMENTS = {
+  "getFunctionBlockInfo": (BoseDevice.FunctionBlock.__getitem__,),
+  "getSnapshot": (_reads,),
+  "setAnr": (BoseDevice.AnrLevel.__getitem__,),
+  "setSidetone": (None, _enumValue(BoseDevice.SidetoneLevel)),
+  "applyProfile": (SettingsProfile.fromDict,),
+  "connectDeviceAndKeep": (None, BoseDevice.PairedDevice.ProductType.__getitem__, None),
+}
+
+# commands returning a dict keyed by Function, whose members are aliased across function blocks
+_FUNCTION_BLOCKS = {
+  "getAllSettings": BoseDevice.FunctionBlock.SETTINGS,
+  "getAllControls": BoseDevice.FunctionBlock.CONTROL,
+  "getAllDeviceNumbers": BoseDevice.FunctionBlock.PRODUCT_INFO,
+}
+
+
+def call(device, command, args=()):
+  """
+  Runs a command of COMMANDS on a BoseDevice with the (JSON) arguments converted to what the method expects; dicts
+  keyed by function are keyed by function name instead
+  """
+  if command not in COMMANDS:
+    raise Exception(f"Unknown command: {command}")
+  converters = _ARGUMENTS.get(command, ())
+  args = [value if i >= len(converters) or converters[i] is None else converters[i](value) for i, value in enumerate(args)]
+  result = getattr(device, command)(*args)
+  if command in _FUNCTION_BLOCKS and isinstance(result, dict):
+    functionBlock = _FUNCTION_BLOCKS[command].value
+    result = {_functionName(functionBlock, function.value if isinstance(function, Enum) else function): value for function, value in result.items()}
+  return result
+
+
+def toJson(value):
+  """
+  Converts command results to JSON compatible values: enums by name, mac addresses as strings, raw payloads as hex,
+  tuples as lists, setting objects as dicts of their attributes and snapshots as dicts keyed by function name
+  """
+  if value is None or isinstance(value, (bool, int, float, str)):
+    return value
+  if isinstance(value, Enum):
+    return value.name
+  if isinstance(value, MacAddress):
+    return str(value)
+  if isinstance(value, (bytes, bytearray, memoryview)):
+    return bytes(value).hex()
+  if isinstance(value, dict):
+    return {_key(key): toJson(item) for key, item in value.items()}
+  if isinstance(value, (list, tuple, set, frozenset)):
+    return [toJson(item) for item in value]
+  if isinstance(value, BaseException):
+    return {"type": type(value).__name__, "message": str(value)}
+  if isinstance(value, BoseDevice.Snapshot):
+    return {
+      "values": {_qualifiedName(*key): toJson(item) for key, item in value._values.items()},
+      "errors": {_qualifiedName(*key): toJson(error) for key, error in value._errors.items()},
+    }
+  return {name: toJson(item) for name, item in vars(value).items() if not name.startswith("_")}
+
+def _key(key):
+  if isinstance(key, Enum):
+    return key.name
+  return str(key)
+
+def _functionName(functionBlock, function):
+  codec = BoseDevice._CODECS.get(functionBlock, function)
+  return codec.name if codec is not None else str(function)
+
+def _qualifiedName(functionBlock, function):
+  return f"{BoseDevice.FunctionBlock(functionBlock).name}.{_functionName(functionBlock, function)}"
@@ -0,0 +1,79 @@
+import json
+import os
+import threading
+
+
+class DiscoveryCache:
+  """
+  Persistent cache for the capability discovery responses of a device (supported function blocks and their
+  versions, function block info), which only change with the firmware.
+
+  Entries are shared by all devices of the same model, i.e. the same PRODUCT_ID_VARIANT payload and firmware version,
+  and keyed by the (functionBlock, function, operator) values of the request. The raw response payloads (or lists of
+  payloads) are kept, so cached responses are decoded by exactly the same code as fresh ones.
+
+  With a path, the cache is stored as JSON lines: every learned response is appended as one line and later lines
+  win, so the file can be shared by several processes and never has to be rewritten. Without a path it only lives
+  in memory.
+  """
+
+  def __init__(self, path=None):
+    self.path = path
+    self.hits = 0
+    self.misses = 0
+    self._entries = {} # (model, key) -> payload
+    self._lock = threading.Lock()
+    if path is not None and os.path.exists(path):
+      self._load()
+
+  @staticmethod
+  def model(productIdVariant, firmwareVersion):
+    return (bytes(productIdVariant).hex(), firmwareVersion)
+
+  def _load(self):
+    with open(self.path) as f:
+      for line in f:
+        try:
+          entry = json.loads(line)
+          model = (entry["product"], entry["firmware"])
+          key = (entry["functionBlock"], entry["function"], entry["operator"])
+          payload = entry["payload"]
+        except (ValueError, KeyError, TypeError): # e.g. a line cut off by a crash while appending
+          continue
+        self._entries[(model, key)] = [bytes.fromhex(p) for p in payload] if isinstance(payload, list) else bytes.fromhex(payload)
+
+  def get(self, model, key):
+    payload = self._entries.get((model, key))
+    if payload is None:
+      self.misses += 1
+    else:
+      self.hits += 1
+    return payload
+
+  def put(self, model, key, payload):
+    with self._lock:
+      self._entries[(model, key)] = payload
+      if self.path is None:
+        return
+      functionBlock, function, operator = key
+      entry = {
+        "product": model[0],
+        "firmware": model[1],
+        "functionBlock": functionBlock,
+        "function": function,
+        "operator": operator,
+        "payload": [bytes(p).hex() for p in payload] if isinstance(payload, list) else bytes(payload).hex(),
+      }
+      with open(self.path, "a") as f:
+        f.write(json.dumps(entry) + "\n")
+
+  def invalidate(self, model=None):
+    with self._lock:
+      if model is None:
+        self._entries.clear()
+      else:
+        for entry in [entry for entry in self._entries if entry[0] == model]:
+          del self._entries[entry]
+
+  def __len__(self):
+    return len(self._entries)
@@ -0,0 +1,308 @@
+import errno
+import heapq
+import itertools
+import selectors
+import socket
+import threading
+import time
+
+from collections import deque
+from concurrent.futures import Future
+
+from .asyncbose import AsyncBoseDevice
+from .routing import PendingRequest
+
+
+class _Wait:
+  """Awaitable for a concurrent.futures.Future, it yields the future to the fleet, which resumes the command once it is done"""
+
+  def __init__(self, future):
+    self.future = future
+
+  def __await__(self):
+    if not self.future.done():
+      yield self.future
+    return self.future.result()
+
+
+class FleetDevice(AsyncBoseDevice):
+  """
+  A device managed by a BoseFleet.
+
+  It has the same command methods as AsyncBoseDevice, but they are driven by the fleet thread instead of an event
+  loop. Use BoseFleet.submit to run them, do not await them yourself. Commands that are not answered within timeout
+  fail with CommandTimeout and keep swallowing their late response, like with the other devices.
+  """
+
+  def __init__(self, fleet, macAddress, sock, timeout=None):
+    super().__init__(macAddress, timeout=timeout)
+    self.fleet = fleet
+    self.socket = sock
+    self.isConnected = False
+    self._outgoing = bytearray() # queued frames that have not been written yet
+
+  def _checkConnected(self):
+    if self.socket is None:
+      raise ConnectionError("Not connected")
+
+  def _expect(self, functionBlock, function, *, expectList=False, listWithFunction=False):
+    future = Future()
+    self._router.add(PendingRequest(functionBlock.value, function.value, future, expectList=expectList, listWithFunction=listWithFunction))
+    return future
+
+  async def _wait(self, future, deadline=None):
+    if deadline is None and self.timeout is not None:
+      deadline = time.monotonic() + self.timeout
+    if deadline is not None and not future.done():
+      timer = self.fleet._callAt(deadline, lambda: self._router.abandon(future, time.monotonic() + self.LATE_RESPONSE_GRACE, timedOut=True))
+      future.add_done_callback(lambda _: timer.cancel())
+    return await _Wait(future)
+
+  async def _sendCommand(self, functionBlock, function, operator, *payload):
+    self._outgoing += self._encoder.encode(functionBlock.value, function.value, operator.value, payload)
+    self.fleet._updateInterest(self)
+
+  async def close(self):
+    """Disconnects and removes the device from its fleet, submit it like the other commands"""
+    self.fleet._drop(self, ConnectionError("Connection closed"))
+
+  async def _discoveryModel(self):
+    # AsyncBoseDevice gathers both requests with asyncio, which does not run on the fleet thread
+    if self._model is None:
+      try:
+        productIdVariant = await self._request(self.FunctionBlock.PRODUCT_INFO, self.Function.PRODUCT_ID_VARIANT, self.Operator.GET)
+        firmwareVersion = await self._request(self.FunctionBlock.PRODUCT_INFO, self.Function.FIRMWARE_VERSION, self.Operator.GET)
+      except Exception:
+        return None
+      self._model = self.discovery.model(productIdVariant, firmwareVersion.decode())
+    return self._model
+
+  def _onReadable(self):
+    try:
+      self._decoder.readFrom(self.socket)
+    except (BlockingIOError, InterruptedError):
+      return
+    for functionBlock, function, operator, payload in self._decoder.frames():
+      self._router.dispatch(functionBlock, function, operator, payload)
+
+  def _onWritable(self):
+    if not self.isConnected:
+      error = self.socket.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+      if error:
+        raise ConnectionError(error, errno.errorcode.get(error, "connect failed"))
+      self.isConnected = True
+    if self._outgoing:
+      try:
+        sent = self.socket.send(self._outgoing)
+      except (BlockingIOError, InterruptedError):
+        return
+      del self._outgoing[:sent]
+    self.fleet._updateInterest(self)
+
+
+class _Timer:
+  def __init__(self, function):
+    self.function = function
+
+  def cancel(self):
+    self.function = None
+
+
+class BoseFleet:
+  """
+  Manages many devices on a single thread: all sockets are non-blocking and multiplexed with a selector.
+
+  Commands are the names of the BoseDevice/AsyncBoseDevice methods, e.g. submit(macAddress, "getAnr") or
+  runAll("getFirmwareVersion"). Each device queues its frames and can have many commands in flight, every command
+  returns a concurrent.futures.Future. timeout is the default deadline in seconds of every command, None waits
+  forever.
+  """
+
+  def __init__(self, timeout=None):
+    self.timeout = timeout
+    self.devices = {}
+    self._selector = selectors.DefaultSelector()
+    self._calls = deque() # functions to run on the fleet thread
+    self._ready = deque() # commands that can continue
+    self._timers = []     # heap of (when, sequence, _Timer), only used on the fleet thread
+    self._sequence = itertools.count()
+    self._wakeReceiver, self._wakeSender = socket.socketpair()
+    self._wakeReceiver.setblocking(False)
+    self._wakeSender.setblocking(False)
+    self._selector.register(self._wakeReceiver, selectors.EVENT_READ, None)
+    self._thread = None
+    self._closed = False
+
+  def start(self):
+    if self._thread is None:
+      self._thread = threading.Thread(target=self._run, name="BoseFleet", daemon=True)
+      self._thread.start()
+    return self
+
+  def close(self):
+    self._closed = True
+    self._wake()
+    if self._thread is not None and self._thread is not threading.current_thread():
+      self._thread.join()
+    self._thread = None
+
+  def __enter__(self):
+    return self.start()
+
+  def __exit__(self, *exc):
+    self.close()
+
+  def add(self, macAddress, sock=None):
+    """Adds a device, connecting to it without blocking unless an already connected socket is passed"""
+    connected = sock is not None
+    if sock is None:
+      sock = socket.socket(socket.AF_BLUETOOTH, socket.SOCK_STREAM, socket.BTPROTO_RFCOMM)
+    sock.setblocking(False)
+    device = FleetDevice(self, macAddress, sock, self.timeout)
+    device.isConnected = connected
+
+    def register():
+      if not connected:
+        error = sock.connect_ex((macAddress, AsyncBoseDevice.PORT))
+        if error not in (0, errno.EINPROGRESS, errno.EAGAIN):
+          sock.close()
+          raise ConnectionError(error, errno.errorcode.get(error, "connect failed"))
+        device.isConnected = error == 0
+      self.devices[macAddress] = device
+      self._selector.register(sock, self._interest(device), device)
+      return device
+    return self._callSoon(register)
+
+  def remove(self, macAddress):
+    return self._callSoon(lambda: self._drop(self.devices[macAddress], ConnectionError("Device removed from fleet")))
+
+  def submit(self, macAddress, command, *args, **kwargs):
+    future = Future()
+    def start():
+      try:
+        coroutine = getattr(self.devices[macAddress], command)(*args, **kwargs)
+      except Exception as e:
+        future.set_exception(e)
+        return
+      self._ready.append((coroutine, future))
+    self._callSoon(start)
+    return future
+
+  def submitAll(self, command, *args, **kwargs):
+    return {macAddress: self.submit(macAddress, command, *args, **kwargs) for macAddress in list(self.devices)}
+
+  def runAll(self, command, *args, timeout=None, **kwargs):
+    """
+    Runs a command on all devices and returns the results (or the exceptions) by mac address. timeout is the time in
+    seconds to wait for all of them together, None waits until every command is done.
+    """
+    deadline = None if timeout is None else time.monotonic() + timeout
+    futures = self.submitAll(command, *args, **kwargs)
+    results = {}
+    for macAddress, future in futures.items():
+      try:
+        results[macAddress] = future.result(None if deadline is None else max(0, deadline - time.monotonic()))
+      except Exception as e:
+        results[macAddress] = e
+    return results
+
+
+  def _callSoon(self, function):
+    future = Future()
+    self._calls.append((function, future))
+    self._wake()
+    return future
+
+  def _callAt(self, when, function):
+    """Calls function on the fleet thread at when (time.monotonic), unless the returned timer is cancelled"""
+    timer = _Timer(function)
+    heapq.heappush(self._timers, (when, next(self._sequence), timer))
+    return timer
+
+  def _runTimers(self):
+    now = time.monotonic()
+    while self._timers and self._timers[0][0] <= now:
+      function = heapq.heappop(self._timers)[2].function
+      if function is not None:
+        function()
+    return max(0, self._timers[0][0] - now) if self._timers else None
+
+  def _wake(self):
+    if threading.current_thread() is self._thread:
+      return
+    try:
+      self._wakeSender.send(b"\x00")
+    except BlockingIOError:
+      pass # already woken up
+
+  @staticmethod
+  def _interest(device):
+    if device._outgoing or not device.isConnected:
+      return selectors.EVENT_READ | selectors.EVENT_WRITE
+    return selectors.EVENT_READ
+
+  def _updateInterest(self, device):
+    if device.socket is not None:
+      self._selector.modify(device.socket, self._interest(device), device)
+
+  def _drop(self, device, exception):
+    if self.devices.get(device.macAddress) is device:
+      del self.devices[device.macAddress]
+    if device.socket is not None:
+      self._selector.unregister(device.socket)
+      device.socket.close()
+      device.socket = None
+    device._router.failAll(exception)
+
+  def _step(self, coroutine, future):
+    try:
+      waitFor = coroutine.send(None)
+    except StopIteration as e:
+      future.set_result(e.value)
+      return
+    except BaseException as e:
+      future.set_exception(e)
+      return
+    waitFor.add_done_callback(lambda _: self._ready.append((coroutine, future)))
+
+  def _run(self):
+    while not self._closed:
+      while self._calls:
+        function, future = self._calls.popleft()
+        try:
+          future.set_result(function())
+        except BaseException as e:
+          future.set_exception(e)
+
+      while self._ready:
+        self._step(*self._ready.popleft())
+
+      timeout = self._runTimers()
+      if self._calls or self._ready:
+        timeout = 0
+      for key, events in self._selector.select(timeout):
+        device = key.data
+        if device is None:
+          try:
+            while self._wakeReceiver.recv(4096):
+              pass
+          except BlockingIOError:
+            pass
+          continue
+        try:
+          if events & selectors.EVENT_WRITE:
+            device._onWritable()
+          if events & selectors.EVENT_READ and device.socket is not None:
+            device._onReadable()
+        except OSError as e:
+          self._drop(device, e if isinstance(e, ConnectionError) else ConnectionError(str(e)))
+
+    for device in list(self.devices.values()):
+      self._drop(device, ConnectionError("Fleet closed"))
+    while self._ready:
+      self._step(*self._ready.popleft())
+    while self._calls:
+      self._calls.popleft()[1].set_exception(ConnectionError("Fleet closed"))
+    self._selector.close()
+    self._wakeReceiver.close()
+    self._wakeSender.close()
@@ -0,0 +1,127 @@
+HEADER_LENGTH = 4
+MAX_PAYLOAD_LENGTH = 255
+MAX_FRAME_LENGTH = HEADER_LENGTH + MAX_PAYLOAD_LENGTH
+
+
+class FrameDecoder:
+  """
+  Incremental BMAP frame decoder working on a single receive buffer.
+
+  Data is pulled in with large reads (readFrom) or pushed in (feed), complete frames are then taken out of the
+  buffer with nextFrame/frames. Frames are returned as (functionBlock, function, operator, payload) where payload
+  is a memoryview into the receive buffer, so it is only valid until the next call to readFrom/feed. Convert it
+  with bytes(payload) if you need to keep it around.
+  """
+
+  DEFAULT_BUFFER_SIZE = 4096
+
+  def __init__(self, bufferSize=DEFAULT_BUFFER_SIZE):
+    if bufferSize < MAX_FRAME_LENGTH:
+      raise ValueError(f"Buffer size must be at least {MAX_FRAME_LENGTH} bytes")
+
+    self._buffer = bytearray(bufferSize)
+    self._view = memoryview(self._buffer)
+    self._start = 0 # first byte that has not been consumed yet
+    self._end = 0   # first byte that has not been filled yet
+
+  @property
+  def pending(self):
+    return self._end - self._start
+
+  def clear(self):
+    self._start = 0
+    self._end = 0
+
+  def _makeRoom(self):
+    if self._start == self._end:
+      self._start = 0
+      self._end = 0
+    elif len(self._buffer) - self._end < MAX_FRAME_LENGTH:
+      pending = self._end - self._start
+      self._buffer[:pending] = self._buffer[self._start:self._end]
+      self._start = 0
+      self._end = pending
+
+  def getWritableView(self):
+    """Returns the free part of the receive buffer, call commit with the number of bytes that were written into it"""
+    self._makeRoom()
+    return self._view[self._end:]
+
+  def commit(self, size):
+    if not size:
+      raise ConnectionError("Connection closed by peer")
+    self._end += size
+    return size
+
+  def readFrom(self, sock):
+    """Reads whatever the socket has available (up to the free buffer space) with a single recv_into call"""
+    return self.commit(sock.recv_into(self.getWritableView()))
+
+  def feed(self, data):
+    """Copies already received data into the buffer, e.g. when the bytes do not come directly from a socket"""
+    data = memoryview(data)
+    while data:
+      self._makeRoom()
+      size = min(len(data), len(self._buffer) - self._end)
+      if not size:
+        raise BufferError("Receive buffer is full")
+      self._view[self._end:self._end+size] = data[:size]
+      self._end += size
+      data = data[size:]
+
+  def nextFrame(self):
+    """Returns the next complete frame or None if the buffer does not contain a complete frame yet"""
+    start = self._start
+    if self._end - start < HEADER_LENGTH:
+      return None
+
+    buffer = self._buffer
+    payloadStart = start + HEADER_LENGTH
+    payloadEnd = payloadStart + buffer[start + 3]
+    if payloadEnd > self._end:
+      return None
+
+    self._start = payloadEnd
+    return buffer[start], buffer[start + 1], buffer[start + 2], self._view[payloadStart:payloadEnd]
+
+  def frames(self):
+    """Yields all complete frames that are currently in the buffer"""
+    while True:
+      frame = self.nextFrame()
+      if frame is None:
+        return
+      yield frame
+
+  __iter__ = frames
+
+
+class FrameEncoder:
+  """
+  Encodes BMAP frames into a reusable send buffer.
+
+  The returned memoryview points into the internal buffer and is only valid until the next call to encode.
+  """
+
+  def __init__(self):
+    self._buffer = bytearray(MAX_FRAME_LENGTH)
+    self._view = memoryview(self._buffer)
+
+  def encode(self, functionBlock, function, operator, payload=b""):
+    length = len(payload)
+    if length > MAX_PAYLOAD_LENGTH:
+      raise ValueError(f"Payload too long ({length} > {MAX_PAYLOAD_LENGTH} bytes)")
+
+    buffer = self._buffer
+    buffer[0] = functionBlock
+    buffer[1] = function
+    buffer[2] = operator
+    buffer[3] = length
+    buffer[HEADER_LENGTH:HEADER_LENGTH+length] = payload
+    return self._view[:HEADER_LENGTH+length]
+
+  def encodeAll(self, frames):
+    """Encodes several (functionBlock, function, operator, payload) frames back to back, so they can be written with a single send"""
+    data = bytearray()
+    for functionBlock, function, operator, payload in frames:
+      data += self.encode(functionBlock, function, operator, payload)
+    return data
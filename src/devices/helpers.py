@@ -1,4 +1,5 @@
 import enum
+import struct
 
 class NestedEnum(enum.Enum):
     def __new__(cls, *args):
@@ -33,14 +34,133 @@ def _bytesToBitmask(bytes):
     ret |= b
   return ret
   
+class MacAddress:
+  """
+  Immutable, hashable mac address backed by an int.
+
+  Recently used addresses are interned (up to MAX_INTERNED of them, together with the strings they were parsed
+  from), so looking them up again is a dict hit and their cached string and byte forms are reused. Partial addresses
+  hold only the lower length bytes (e.g. the 3 bytes advertised by 1.0.4 devices), they are formatted zero padded
+  and never equal a full address, use matches() to compare them with one.
+  """
+
+  __slots__ = ("value", "length", "_string", "_bytes")
+
+  LENGTH = 6
+  MAX_INTERNED = 4096
+  _interned = {}
+  _parsed = {}
+  _unpackers = {6: (struct.Struct(">HI").unpack_from, 32), 3: (struct.Struct(">BH").unpack_from, 16)}
+
+  def __new__(cls, address, length=None):
+    if isinstance(address, MacAddress):
+      return address
+    if isinstance(address, int):
+      return cls._intern(address, length or cls.LENGTH)
+    if isinstance(address, str):
+      mac = cls._parsed.get(address)
+      if mac is None or (length is not None and mac.length != length):
+        digits = address.replace(":", "").replace("-", "")
+        mac = cls._intern(int(digits, 16), length or len(digits) // 2)
+        if len(cls._parsed) >= cls.MAX_INTERNED:
+          cls._parsed.clear()
+        cls._parsed[address] = mac
+      return mac
+    return cls.fromBuffer(address, 0, len(address) if length is None else length)
+
+  @classmethod
+  def fromBuffer(cls, buffer, offset=0, length=6):
+    """Reads length bytes at offset of any buffer (bytes, bytearray, memoryview) without slicing it"""
+    unpacker = cls._unpackers.get(length)
+    if unpacker is None:
+      return cls._intern(int.from_bytes(buffer[offset:offset+length], "big"), length)
+    unpack, shift = unpacker
+    high, low = unpack(buffer, offset)
+    return cls._intern((high << shift) | low, length)
+
+  @classmethod
+  def _intern(cls, value, length):
+    key = value | (length << 48)
+    mac = cls._interned.get(key)
+    if mac is None:
+      if not 0 <= value < (1 << (8 * length)) or length > cls.LENGTH:
+        raise ValueError(f"Invalid mac address: {value:#x} ({length} bytes)")
+      mac = object.__new__(cls)
+      _set = object.__setattr__
+      _set(mac, "value", value)
+      _set(mac, "length", length)
+      _set(mac, "_string", None)
+      _set(mac, "_bytes", None)
+      if len(cls._interned) >= cls.MAX_INTERNED: # clearing is atomic, unlike evicting single entries while other threads insert
+        cls._interned.clear()
+      mac = cls._interned.setdefault(key, mac)
+    return mac
+
+  def __setattr__(self, name, value):
+    raise AttributeError(f"MacAddress is immutable, cannot set {name}")
+
+  @property
+  def isPartial(self):
+    return self.length < self.LENGTH
+
+  @property
+  def oui(self):
+    """Organizationally unique identifier (upper 3 bytes), None for partial addresses"""
+    return None if self.isPartial else self.value >> 24
+
+  def matches(self, other):
+    """Whether both addresses agree on the bytes they both know, i.e. a partial address matches its full address"""
+    other = MacAddress(other)
+    length = min(self.length, other.length)
+    mask = (1 << (8 * length)) - 1
+    return (self.value & mask) == (other.value & mask)
+
+  def __str__(self):
+    string = self._string
+    if string is None:
+      h = f"{self.value:012x}"
+      string = f"{h[0:2]}:{h[2:4]}:{h[4:6]}:{h[6:8]}:{h[8:10]}:{h[10:12]}"
+      object.__setattr__(self, "_string", string)
+    return string
+
+  def __bytes__(self):
+    data = self._bytes
+    if data is None:
+      data = self.value.to_bytes(self.LENGTH, "big")
+      object.__setattr__(self, "_bytes", data)
+    return data
+
+  def __int__(self):
+    return self.value
+
+  def __format__(self, spec):
+    return format(str(self), spec)
+
+  def __eq__(self, other):
+    if self is other:
+      return True
+    if not isinstance(other, MacAddress):
+      return NotImplemented
+    return self.value == other.value and self.length == other.length
+
+  def __hash__(self):
+    return hash(self.value | (self.length << 48))
+
+  def __reduce__(self):
+    return (MacAddress, (self.value, self.length))
+
+  def __repr__(self):
+    return f"MacAddress<{self}{', partial' if self.isPartial else ''}>"
+
+
 def _bytesToMacAddress(bytes):
-  return ":".join([f"{p:02x}" for p in bytes])
+  return str(MacAddress.fromBuffer(bytes, 0, len(bytes)))
 
 def _bytesToHexString(bytes):
   return " ".join([f"{p:02x}" for p in bytes])
 
 def _macAddressToBytes(macAddress):
-  return bytes(map(lambda x: int(x, 16), (macAddress.split(":"))))
+  return bytes(MacAddress(macAddress))
 
 def _applyBitmask(enum, bitmask):
   if (isinstance(bitmask, bytes)):
@@ -0,0 +1,225 @@
+import bisect
+import threading
+import time
+
+
+# Instrumentation of the hot paths: BoseDevice and the scanner look up the module global active and do nothing else
+# while it is None, so disabled metrics only cost an attribute lookup and a comparison per frame.
+active = None
+
+def enable(metrics=None):
+  """Starts recording into metrics (a new Metrics by default) and returns it"""
+  global active
+  active = metrics if metrics is not None else Metrics()
+  return active
+
+def disable():
+  global active
+  active = None
+
+def outcome(exception):
+  """Outcome label of a command that raised exception, None if it succeeded"""
+  if exception is None:
+    return "ok"
+  return "timeout" if isinstance(exception, TimeoutError) else "error"
+
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram:
+  """Latency histogram with fixed bucket upper bounds (in seconds), cumulative like Prometheus when exported"""
+
+  def __init__(self, buckets=DEFAULT_BUCKETS):
+    self.buckets = buckets
+    self.counts = [0] * (len(buckets) + 1) # the last one counts everything above the largest bound
+    self.count = 0
+    self.sum = 0.0
+
+  def observe(self, value):
+    self.counts[bisect.bisect_left(self.buckets, value)] += 1
+    self.count += 1
+    self.sum += value
+
+  def cumulative(self):
+    """Yields (upper bound, count of values <= it), the last bound is infinity"""
+    total = 0
+    for bound, count in zip(self.buckets + (float("inf"),), self.counts):
+      total += count
+      yield bound, total
+
+  def quantile(self, q):
+    """Upper bound of the bucket containing the q quantile, None without observations"""
+    if not self.count:
+      return None
+    rank = q * self.count
+    for bound, total in self.cumulative():
+      if total >= rank:
+        return bound
+
+
+class Metrics:
+  """
+  Counters and latency histograms of the devices and scanner, keyed by (device, functionBlock, function) values;
+  device is None unless perDevice is set.
+
+  Commands are timed from sending the request until the response is complete or the command failed, by outcome
+  (ok, error or timeout). Bytes are counted as framed on the wire, error frames by error code.
+  """
+
+  def __init__(self, *, perDevice=False, buckets=DEFAULT_BUCKETS, clock=time.monotonic):
+    self.perDevice = perDevice
+    self.buckets = buckets
+    self._clock = clock
+    self._lock = threading.Lock()
+    self.reset()
+
+  def reset(self):
+    with self._lock:
+      self.started = self._clock()
+      self.latencies = {} # (*key, outcome) -> Histogram
+      self.bytesSent = {}
+      self.bytesReceived = {}
+      self.errorFrames = {} # (*key, error code) -> count
+      self.processFrames = {}
+      self.cacheHits = {}
+      self.advertisements = 0
+      self.parseAttempts = 0
+      self.hits = 0
+
+  def _key(self, device, functionBlock, function):
+    return (str(device) if self.perDevice else None, functionBlock, function)
+
+  ###########
+  #  HOOKS  #
+  ###########
+
+  def commandDone(self, device, functionBlock, function, seconds, outcome="ok"):
+    key = (*self._key(device, functionBlock, function), outcome)
+    with self._lock:
+      histogram = self.latencies.get(key)
+      if histogram is None:
+        histogram = self.latencies[key] = Histogram(self.buckets)
+      histogram.observe(seconds)
+
+  def frameSent(self, device, functionBlock, function, size):
+    key = self._key(device, functionBlock, function)
+    with self._lock:
+      self.bytesSent[key] = self.bytesSent.get(key, 0) + size
+
+  def frameReceived(self, device, functionBlock, function, operator, payload):
+    key = self._key(device, functionBlock, function)
+    with self._lock:
+      self.bytesReceived[key] = self.bytesReceived.get(key, 0) + 4 + len(payload) # header + payload
+      if operator == _ERROR:
+        key = (*key, payload[0] if payload else None)
+        self.errorFrames[key] = self.errorFrames.get(key, 0) + 1
+      elif operator == _PROCESS:
+        self.processFrames[key] = self.processFrames.get(key, 0) + 1
+
+  def cacheHit(self, device, functionBlock, function):
+    key = self._key(device, functionBlock, function)
+    with self._lock:
+      self.cacheHits[key] = self.cacheHits.get(key, 0) + 1
+
+  def advertisement(self, parseAttempts, hits):
+    """One advertisement reached the scanner, parseAttempts parsers looked at it and hits of them accepted it"""
+    with self._lock:
+      self.advertisements += 1
+      self.parseAttempts += parseAttempts
+      self.hits += hits
+
+  ############
+  #  EXPORT  #
+  ############
+
+  def snapshot(self):
+    """Current values as plain (JSON compatible) data, including the scanner rates since the start or last reset"""
+    with self._lock:
+      elapsed = max(self._clock() - self.started, 1e-9)
+      return {
+        "elapsed": elapsed,
+        "commands": [dict(_labels(key[:3]), outcome=key[3], count=histogram.count, sum=histogram.sum, p50=histogram.quantile(0.5), p99=histogram.quantile(0.99),
+                          buckets={str(bound): total for bound, total in histogram.cumulative()}) for key, histogram in self.latencies.items()],
+        "bytesSent": [dict(_labels(key), bytes=count) for key, count in self.bytesSent.items()],
+        "bytesReceived": [dict(_labels(key), bytes=count) for key, count in self.bytesReceived.items()],
+        "errorFrames": [dict(_labels(key[:3]), code=key[3], count=count) for key, count in self.errorFrames.items()],
+        "processFrames": [dict(_labels(key), count=count) for key, count in self.processFrames.items()],
+        "cacheHits": [dict(_labels(key), count=count) for key, count in self.cacheHits.items()],
+        "scanner": {
+          "advertisements": self.advertisements,
+          "parseAttempts": self.parseAttempts,
+          "hits": self.hits,
+          "advertisementsPerSecond": self.advertisements / elapsed,
+          "parseAttemptsPerSecond": self.parseAttempts / elapsed,
+          "hitsPerSecond": self.hits / elapsed,
+          "hitRate": self.hits / self.advertisements if self.advertisements else None,
+        },
+      }
+
+  def prometheus(self, prefix="oboe"):
+    """Current values in the Prometheus text exposition format"""
+    lines = []
+    def family(name, kind, description):
+      lines.append(f"# HELP {prefix}_{name} {description}")
+      lines.append(f"# TYPE {prefix}_{name} {kind}")
+
+    with self._lock:
+      family("command_latency_seconds", "histogram", "Time from sending a command until its response is complete")
+      for key, histogram in self.latencies.items():
+        labels = f"{_prometheusLabels(key[:3])},outcome=\"{key[3]}\""
+        for bound, total in histogram.cumulative():
+          lines.append(f"{prefix}_command_latency_seconds_bucket{{{labels},le=\"{'+Inf' if bound == float('inf') else bound}\"}} {total}")
+        lines.append(f"{prefix}_command_latency_seconds_sum{{{labels}}} {histogram.sum}")
+        lines.append(f"{prefix}_command_latency_seconds_count{{{labels}}} {histogram.count}")
+      for name, counters, description in (
+        ("sent_bytes_total", self.bytesSent, "Bytes of the frames sent"),
+        ("received_bytes_total", self.bytesReceived, "Bytes of the frames received"),
+        ("process_frames_total", self.processFrames, "PROCESS frames received"),
+        ("cache_hits_total", self.cacheHits, "Getters answered from the settings cache"),
+      ):
+        family(name, "counter", description)
+        for key, count in counters.items():
+          lines.append(f"{prefix}_{name}{{{_prometheusLabels(key)}}} {count}")
+      family("error_frames_total", "counter", "ERROR frames received, by error code")
+      for key, count in self.errorFrames.items():
+        lines.append(f"{prefix}_error_frames_total{{{_prometheusLabels(key[:3])},code=\"{key[3]}\"}} {count}")
+      for name, value, description in (
+        ("scanner_advertisements_total", self.advertisements, "Advertisements seen by the scanner"),
+        ("scanner_parse_attempts_total", self.parseAttempts, "Advertisements handed to a parser"),
+        ("scanner_hits_total", self.hits, "Advertisements a parser accepted"),
+      ):
+        family(name, "counter", description)
+        lines.append(f"{prefix}_{name} {value}")
+    return "\n".join(lines) + "\n"
+
+
+def _names(functionBlock, function):
+  from .bose import BoseDevice # bose uses this module
+  try:
+    functionBlockName = BoseDevice.FunctionBlock(functionBlock).name
+  except ValueError:
+    functionBlockName = str(functionBlock)
+  codec = BoseDevice._CODECS.get(functionBlock, function)
+  return functionBlockName, codec.name if codec is not None else str(function)
+
+def _labels(key):
+  device, functionBlock, function = key
+  functionBlockName, functionName = _names(functionBlock, function)
+  labels = {"functionBlock": functionBlockName, "function": functionName}
+  if device is not None:
+    labels["device"] = device
+  return labels
+
+def _prometheusLabels(key):
+  device, functionBlock, function = key
+  functionBlockName, functionName = _names(functionBlock, function)
+  labels = f"function_block=\"{functionBlockName}\",function=\"{functionName}\""
+  if device is not None:
+    labels = f"device=\"{device}\"," + labels
+  return labels
+
+
+# operator values, see BoseDevice.Operator
+_ERROR = 0x04
+_PROCESS = 0x07
@@ -0,0 +1,204 @@
+import copy
+
+from enum import Enum
+
+from .bose import BoseDevice
+
+FunctionBlock = BoseDevice.FunctionBlock
+Function = BoseDevice.Function
+
+
+class _Field:
+  """
+  A profile field: the setting function it belongs to, how to read its current value from the decoded setting and
+  (optionally) which values the device supports according to that setting
+  """
+  def __init__(self, name, function, read, type=None, supported=None):
+    self.name = name
+    self.function = function
+    self.read = read
+    self.type = type # Enum of the value, if any (used by fromDict/toDict)
+    self.supported = supported
+
+def _withAttributes(current, **attributes):
+  setting = copy.copy(current)
+  for name, value in attributes.items():
+    setattr(setting, name, value)
+  return setting,
+
+_FIELDS = [
+  _Field("deviceName", Function.DEVICE_NAME, lambda name: name),
+  _Field("anr", Function.ANR, lambda anr: anr[0], BoseDevice.AnrLevel, lambda anr: anr[1]),
+  _Field("cnc", Function.CNC, lambda cnc: cnc[1], supported=lambda cnc: range(cnc[0])),
+  _Field("standbyTimer", Function.STANDBY_TIMER, lambda minutes: minutes),
+  _Field("voicePromptsEnabled", Function.VOICE_PROMPTS, lambda voicePrompts: voicePrompts.isEnabled),
+  _Field("voicePromptLanguage", Function.VOICE_PROMPTS, lambda voicePrompts: voicePrompts.language, BoseDevice.VoicePromptSetting.Language, lambda voicePrompts: voicePrompts.supportedLanguages),
+  _Field("buttonAction", Function.BUTTONS, lambda buttons: buttons.configuredFunctionality, BoseDevice.ActionButtonSetting.ActionButtonModes, lambda buttons: buttons.supportedFunctionality if buttons.isConfigurable else ()),
+  _Field("ringtoneEnabled", Function.ALERTS, lambda alerts: alerts[0]),
+  _Field("hapticsEnabled", Function.ALERTS, lambda alerts: alerts[1]),
+  _Field("multipoint", Function.MULTIPOINT, lambda multipoint: multipoint[1], supported=lambda multipoint: (False, True) if multipoint[0] else (False,)),
+  _Field("sidetone", Function.SIDETONE, lambda sidetone: sidetone[1], BoseDevice.SidetoneLevel, lambda sidetone: sidetone[2]),
+]
+
+# arguments of the set method of every function, from its current (decoded) setting and the wanted field values
+_ARGUMENTS = {
+  Function.DEVICE_NAME: lambda current, deviceName: (deviceName,),
+  Function.ANR: lambda current, anr: (anr,),
+  Function.CNC: lambda current, cnc: (current[0], cnc),
+  Function.STANDBY_TIMER: lambda current, standbyTimer: (standbyTimer,),
+  Function.VOICE_PROMPTS: lambda current, voicePromptsEnabled, voicePromptLanguage: _withAttributes(current, isEnabled=voicePromptsEnabled, language=voicePromptLanguage),
+  Function.BUTTONS: lambda current, buttonAction: _withAttributes(current, configuredFunctionality=buttonAction),
+  Function.ALERTS: lambda current, ringtoneEnabled, hapticsEnabled: (ringtoneEnabled, hapticsEnabled),
+  Function.MULTIPOINT: lambda current, multipoint: (current[0], multipoint),
+  Function.SIDETONE: lambda current, sidetone: (current[0], sidetone.value),
+}
+
+
+class SettingsProfile:
+  """
+  Declarative target state for the settings of a device; fields that are None are left as they are.
+
+  Apply it with BoseDevice.applyProfile: the current settings are read with a single ALL_SETTINGS request, only the
+  settings with a field that differs are written (all of them pipelined, see BoseDevice.setMany) and the outcome is
+  reported per field.
+  """
+
+  FIELDS = tuple(field.name for field in _FIELDS)
+
+  def __init__(self, *, deviceName=None, anr=None, cnc=None, standbyTimer=None, voicePromptsEnabled=None, voicePromptLanguage=None,
+               buttonAction=None, ringtoneEnabled=None, hapticsEnabled=None, multipoint=None, sidetone=None):
+    self.deviceName = deviceName
+    self.anr = anr
+    self.cnc = cnc
+    self.standbyTimer = standbyTimer
+    self.voicePromptsEnabled = voicePromptsEnabled
+    self.voicePromptLanguage = voicePromptLanguage
+    self.buttonAction = buttonAction
+    self.ringtoneEnabled = ringtoneEnabled
+    self.hapticsEnabled = hapticsEnabled
+    self.multipoint = multipoint
+    self.sidetone = sidetone
+
+  @classmethod
+  def fromDict(cls, values):
+    """Profile from a dict (e.g. parsed JSON) with enum values given by name"""
+    unknown = set(values) - set(cls.FIELDS)
+    if unknown:
+      raise Exception(f"Unknown profile fields: {', '.join(sorted(unknown))}")
+    kwargs = {}
+    for field in _FIELDS:
+      value = values.get(field.name)
+      if value is not None and field.type is not None and not isinstance(value, field.type):
+        value = field.type[value]
+      kwargs[field.name] = value
+    return cls(**kwargs)
+
+  def toDict(self):
+    values = {}
+    for field in _FIELDS:
+      value = getattr(self, field.name)
+      if value is not None:
+        values[field.name] = value.name if isinstance(value, Enum) else value
+    return values
+
+  def __repr__(self):
+    return f"SettingsProfile<{self.toDict()}>"
+
+  def apply(self, device):
+    report = ProfileReport()
+    wanted = [field for field in _FIELDS if getattr(self, field.name) is not None]
+    if not wanted:
+      return report
+    settings = device.getAllSettings()
+
+    writes = []
+    for function, fields in _byFunction(wanted).items():
+      if function not in settings:
+        for field in fields:
+          report._add(field.name, FieldResult.Status.UNSUPPORTED)
+        continue
+      current = settings[function]
+      changed = []
+      for field in fields:
+        before, value = field.read(current), getattr(self, field.name)
+        if value == before:
+          report._add(field.name, FieldResult.Status.UNCHANGED, before, before)
+        elif field.supported is not None and value not in field.supported(current):
+          report._add(field.name, FieldResult.Status.UNSUPPORTED, before)
+        else:
+          changed.append(field)
+      if not changed:
+        continue
+      # fields of the same function that are not changed keep their current value
+      values = [getattr(self, field.name) if field in changed else field.read(current) for field in _FIELDS if field.function == function]
+      writes.append((function, current, changed, _ARGUMENTS[function](current, *values)))
+
+    if not writes:
+      return report
+    responses = device.setMany((FunctionBlock.SETTINGS, function, args) for function, _, _, args in writes)
+    for function, current, changed, _ in writes:
+      error = responses.errors.get((FunctionBlock.SETTINGS.value, function.value))
+      for field in changed:
+        before = field.read(current)
+        if error is not None:
+          report._add(field.name, FieldResult.Status.FAILED, before, error=error)
+          continue
+        after = field.read(responses[FunctionBlock.SETTINGS, function])
+        status = FieldResult.Status.CHANGED if after == getattr(self, field.name) else FieldResult.Status.REJECTED
+        report._add(field.name, status, before, after)
+    return report
+
+def _byFunction(fields):
+  functions = {}
+  for field in fields:
+    functions.setdefault(field.function, []).append(field)
+  return functions
+
+
+class FieldResult:
+  class Status(Enum):
+    UNCHANGED = "unchanged"     # already had the wanted value, nothing was sent
+    CHANGED = "changed"         # set and confirmed by the device
+    REJECTED = "rejected"       # set, but the device answered with a different value
+    UNSUPPORTED = "unsupported" # the device does not have the setting or does not support the value, nothing was sent
+    FAILED = "failed"           # the device answered with an error, see error
+
+  def __init__(self, status, before=None, after=None, error=None):
+    self.status = status
+    self.before = before
+    self.after = after
+    self.error = error
+
+  def __repr__(self):
+    return f"FieldResult<status={self.status.value}, before={self.before}, after={self.after}, error={self.error}>"
+
+
+class ProfileReport:
+  """Result of applying a SettingsProfile, maps the field names to their FieldResult"""
+
+  def __init__(self):
+    self.results = {}
+
+  def _add(self, name, status, before=None, after=None, error=None):
+    self.results[name] = FieldResult(status, before, after, error)
+
+  def __getitem__(self, name):
+    return self.results[name]
+
+  def __iter__(self):
+    return iter(self.results.items())
+
+  def __len__(self):
+    return len(self.results)
+
+  @property
+  def changed(self):
+    return [name for name, result in self.results.items() if result.status == FieldResult.Status.CHANGED]
+
+  @property
+  def ok(self):
+    """True if every field has its wanted value now"""
+    return all(result.status in (FieldResult.Status.UNCHANGED, FieldResult.Status.CHANGED) for result in self.results.values())
+
+  def __repr__(self):
+    return f"ProfileReport<{self.results}>"
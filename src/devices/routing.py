@@ -0,0 +1,192 @@
+import time
+
+from collections import deque
+
+
+class CommandTimeout(TimeoutError):
+  """A request did not get its (complete) response before its deadline"""
+
+  def __init__(self, functionBlock, function):
+    super().__init__(f"No response for function {function} of function block {functionBlock} before the deadline")
+    self.functionBlock = functionBlock
+    self.function = function
+
+
+class PendingRequest:
+  """
+  An outstanding request waiting for its response frames.
+
+  The future can be anything with the usual future interface (asyncio.Future, concurrent.futures.Future, ...).
+  Abandoned requests (timed out or cancelled) stay in the router until expires, so a late response is swallowed
+  instead of being taken for the response to the next request of the same function.
+  """
+
+  def __init__(self, functionBlock, function, future, *, expectList=False, listWithFunction=False):
+    self.functionBlock = functionBlock
+    self.function = function
+    self.future = future
+    self.expectList = expectList
+    self.listWithFunction = listWithFunction
+    self.items = []
+    self.expires = None
+
+  def isExpired(self, now):
+    return self.expires is not None and self.expires <= now
+
+  def resolve(self, value):
+    if not self.future.done():
+      self.future.set_result(value)
+
+  def fail(self, exception):
+    if not self.future.done():
+      self.future.set_exception(exception)
+
+
+class ResponseRouter:
+  """
+  Matches incoming frames to outstanding requests by function block and function.
+
+  Requests with the same function block and function are answered in the order they were added. While a list
+  response (START ... FINAL) is running, all status frames of that function block belong to the list, since the
+  single entries of a list carry the function of the entry and not the one of the request.
+  Frames that cannot be matched to any request are passed to onUnsolicited(functionBlock, function, operator, payload).
+  """
+
+  def __init__(self, onUnsolicited=None, *, clock=time.monotonic):
+    self.onUnsolicited = onUnsolicited
+    self._clock = clock
+    self._pending = {}     # (functionBlock, function) -> deque of requests
+    self._activeLists = {} # functionBlock -> request currently receiving list entries
+
+  def __len__(self):
+    return sum(map(len, self._pending.values())) + len(self._activeLists)
+
+  def add(self, request):
+    self._pending.setdefault((request.functionBlock, request.function), deque()).append(request)
+    return request
+
+  def _popPending(self, functionBlock, function):
+    request = self._peekPending(functionBlock, function)
+    if request is None:
+      return None
+    queue = self._pending[(functionBlock, function)]
+    queue.popleft()
+    if not queue:
+      del self._pending[(functionBlock, function)]
+    return request
+
+  def _peekPending(self, functionBlock, function):
+    queue = self._pending.get((functionBlock, function))
+    if not queue:
+      return None
+    while queue[0].expires is not None and queue[0].isExpired(self._clock()): # the late response never came
+      queue.popleft()
+      if not queue:
+        del self._pending[(functionBlock, function)]
+        return None
+    return queue[0]
+
+  def abandon(self, future, expires, timedOut=False):
+    """
+    Gives up on the request of future but keeps absorbing its response frames until expires. The future fails with
+    CommandTimeout if timedOut is set, otherwise it is cancelled. Returns False if the request was not outstanding.
+    """
+    for request in self._requests():
+      if request.future is future:
+        self._abandon(request, expires, timedOut)
+        return True
+    return False
+
+  def cancel(self, expires, functionBlock=None, function=None):
+    """Abandons all outstanding requests (of the given function block and function, None matches everything), returns how many"""
+    requests = [request for request in self._requests() if request.expires is None and functionBlock in (None, request.functionBlock) and function in (None, request.function)]
+    for request in requests:
+      self._abandon(request, expires)
+    return len(requests)
+
+  def _abandon(self, request, expires, timedOut=False):
+    request.expires = expires
+    if timedOut:
+      request.fail(CommandTimeout(request.functionBlock, request.function))
+    else:
+      request.future.cancel()
+
+  def _requests(self):
+    yield from self._activeLists.values()
+    for queue in self._pending.values():
+      yield from queue
+
+  def dispatch(self, functionBlock, function, operator, payload):
+    """Hands a received frame to the matching request, returns False if the frame was unsolicited"""
+    listRequest = self._activeLists.get(functionBlock)
+    if listRequest is not None and listRequest.expires is not None and listRequest.isExpired(self._clock()): # the list never finished
+      del self._activeLists[functionBlock]
+      listRequest = None
+
+    if operator == _STATUS:
+      if listRequest is not None:
+        payload = bytes(payload)
+        listRequest.items.append((function, payload) if listRequest.listWithFunction else payload)
+        return True
+
+      request = self._popPending(functionBlock, function)
+      if request is None:
+        return self._unsolicited(functionBlock, function, operator, payload)
+      if request.expectList: # the first frame of an expected list only opens it
+        self._activeLists[functionBlock] = request
+        return True
+      request.resolve(bytes(payload))
+      return True
+
+    if operator == _START:
+      request = self._popPending(functionBlock, function)
+      if request is None:
+        return self._unsolicited(functionBlock, function, operator, payload)
+      self._activeLists[functionBlock] = request
+      return True
+
+    if operator == _FINAL:
+      if listRequest is None:
+        return self._unsolicited(functionBlock, function, operator, payload)
+      del self._activeLists[functionBlock]
+      listRequest.resolve(listRequest.items)
+      return True
+
+    if operator == _PROCESS:
+      if listRequest is None and self._peekPending(functionBlock, function) is None:
+        return self._unsolicited(functionBlock, function, operator, payload)
+      return True
+
+    if operator == _ERROR:
+      if listRequest is not None:
+        del self._activeLists[functionBlock]
+        request = listRequest
+      else:
+        request = self._popPending(functionBlock, function)
+      if request is None:
+        return self._unsolicited(functionBlock, function, operator, payload)
+      request.fail(Exception(f"Invalid response, error code: {payload[0] if payload else None}"))
+      return True
+
+    return self._unsolicited(functionBlock, function, operator, payload)
+
+  def _unsolicited(self, functionBlock, function, operator, payload):
+    if self.onUnsolicited is not None:
+      self.onUnsolicited(functionBlock, function, operator, bytes(payload))
+    return False
+
+  def failAll(self, exception):
+    requests = [request for queue in self._pending.values() for request in queue]
+    requests.extend(self._activeLists.values())
+    self._pending.clear()
+    self._activeLists.clear()
+    for request in requests:
+      request.fail(exception)
+
+
+# operator values, see BoseDevice.Operator (bose imports this module)
+_STATUS = 0x03
+_ERROR = 0x04
+_START = 0x05
+_FINAL = 0x06
+_PROCESS = 0x07
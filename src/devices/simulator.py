@@ -0,0 +1,385 @@
+import heapq
+import itertools
+import random
+import selectors
+import socket
+import threading
+import time
+
+from enum import Enum
+
+from .bose import BoseDevice
+from .framing import FrameDecoder, FrameEncoder
+from .helpers import MacAddress, _macAddressToBytes
+
+
+FunctionBlock = BoseDevice.FunctionBlock
+Function = BoseDevice.Function
+Operator = BoseDevice.Operator
+
+
+class SimulatedBoseDevice:
+  """
+  State and protocol logic of a simulated BMAP peripheral, without any I/O.
+
+  handle() takes a request frame and returns the response frames as (functionBlock, function, operator, payload)
+  tuples. The state is kept as the raw STATUS payloads, so it is decoded by exactly the same code as real devices.
+  """
+
+  class ErrorCode(Enum):
+    LENGTH                     = 0x01
+    CHECKSUM                   = 0x02
+    FUNCTION_BLOCK_NOT_SUPPORTED = 0x03
+    FUNCTION_NOT_SUPPORTED     = 0x04
+    OPERATOR_NOT_SUPPORTED     = 0x05
+    INVALID_DATA               = 0x06
+
+  BLOCK_VERSIONS = {
+    FunctionBlock.PRODUCT_INFO: "1.0.0",
+    FunctionBlock.SETTINGS: "1.0.4",
+    FunctionBlock.STATUS: "1.0.0",
+    FunctionBlock.DEVICE_MANAGEMENT: "1.0.3",
+    FunctionBlock.CONTROL: "1.0.0",
+    FunctionBlock.NOTIFICATIONS: "1.0.0",
+  }
+
+  def __init__(self, *, name="Bose QC35 II", macAddress="04:52:c7:00:00:01", bmapVersion="1.0.4", firmwareVersion="4.5.2", serialNumber="075316Z00000001", productId=0x4020, productVariant=0x01):
+    self.bmapVersion = bmapVersion
+    self.pairedDevices = {} # mac address -> (isConnected, name)
+    self.errors = {}        # (functionBlock, function) values -> error code, to simulate failing functions
+    self.state = {
+      (FunctionBlock.PRODUCT_INFO.value, Function.FIRMWARE_VERSION.value): firmwareVersion.encode(),
+      (FunctionBlock.PRODUCT_INFO.value, Function.MAC_ADDRESS.value): _macAddressToBytes(macAddress),
+      (FunctionBlock.PRODUCT_INFO.value, Function.SERIAL_NUMBER.value): serialNumber.encode(),
+      (FunctionBlock.PRODUCT_INFO.value, Function.HARDWARE_REVISION.value): b"1.0.0",
+      (FunctionBlock.PRODUCT_INFO.value, Function.COMPONENT_DEVICES.value): b"",
+
+      (FunctionBlock.SETTINGS.value, Function.DEVICE_NAME.value): b"\x00" + name.encode(),
+      (FunctionBlock.SETTINGS.value, Function.VOICE_PROMPTS.value): bytes([BoseDevice.VoicePromptSetting.CAN_CHANGE | BoseDevice.VoicePromptSetting.IS_ENABLED | BoseDevice.VoicePromptSetting.Language.EN_US.value, 0x00, 0x00, 0x01, 0x3f]),
+      (FunctionBlock.SETTINGS.value, Function.STANDBY_TIMER.value): bytes([20]),
+      (FunctionBlock.SETTINGS.value, Function.CNC.value): bytes([11, 10]),
+      (FunctionBlock.SETTINGS.value, Function.ANR.value): bytes([BoseDevice.AnrLevel.HIGH.value, 0b1011]),
+      (FunctionBlock.SETTINGS.value, Function.BASS_CONTROL.value): bytes([0, 10, 5]),
+      (FunctionBlock.SETTINGS.value, Function.ALERTS.value): bytes([0b01]),
+      (FunctionBlock.SETTINGS.value, Function.BUTTONS.value): bytes([BoseDevice.ActionButtonSetting.DEFAULT_BUTTON_ID, BoseDevice.ActionButtonSetting.DEFAULT_EVENT_TYPE, BoseDevice.ActionButtonSetting.ActionButtonModes.ANR.value, 0b00110]),
+      (FunctionBlock.SETTINGS.value, Function.MULTIPOINT.value): bytes([0b11]),
+      (FunctionBlock.SETTINGS.value, Function.SIDETONE.value): bytes([1, BoseDevice.SidetoneLevel.OFF.value, 0b1111]),
+      (FunctionBlock.SETTINGS.value, Function.IMU_VOLUME_CT.value): bytes([0]),
+
+      (FunctionBlock.CONTROL.value, Function.CHIRP.value): bytes([0]),
+    }
+    self.state[(FunctionBlock.PRODUCT_INFO.value, Function.PRODUCT_ID_VARIANT.value)] = bytes([productId >> 8, productId & 0xff, productVariant])
+
+  def _setters(self):
+    settings = FunctionBlock.SETTINGS.value
+    return {
+      (settings, Function.DEVICE_NAME.value): lambda old, new: b"\x00" + new,
+      (settings, Function.VOICE_PROMPTS.value): lambda old, new: bytes([(old[0] & BoseDevice.VoicePromptSetting.CAN_CHANGE) | new[0]]) + old[1:],
+      (settings, Function.STANDBY_TIMER.value): lambda old, new: new[:1],
+      (settings, Function.CNC.value): lambda old, new: bytes([old[0], new[1]]),
+      (settings, Function.ANR.value): lambda old, new: new[:1] + old[1:],
+      (settings, Function.BASS_CONTROL.value): lambda old, new: old[:2] + new[:1],
+      (settings, Function.ALERTS.value): lambda old, new: new[:1],
+      (settings, Function.BUTTONS.value): lambda old, new: new[:3] + old[3:],
+      (settings, Function.MULTIPOINT.value): lambda old, new: bytes([(old[0] & 0b10) | (new[0] & 0b01)]),
+      (settings, Function.SIDETONE.value): lambda old, new: new[:2] + old[2:],
+      (settings, Function.IMU_VOLUME_CT.value): lambda old, new: new[:1],
+    }
+
+  def _listFunctions(self, functionBlock):
+    return [function for block, function in self.state if block == functionBlock]
+
+  def _supportedBlocksBitmask(self):
+    bitmask = 0
+    for block in self.BLOCK_VERSIONS:
+      bitmask |= 1 << block.value
+    return bitmask.to_bytes(3, "big")
+
+  def set(self, functionBlock, function, payload):
+    """Changes the state directly (e.g. a button press on the device), use notify on the server to announce it"""
+    self.state[(functionBlock.value, function.value)] = bytes(payload)
+
+  def status(self, functionBlock, function):
+    return (functionBlock.value, function.value, Operator.STATUS.value, self.state[(functionBlock.value, function.value)])
+
+  def handle(self, functionBlock, function, operator, payload):
+    key = (functionBlock, function)
+    if key in self.errors:
+      return [(functionBlock, function, Operator.ERROR.value, bytes([self.errors[key]]))]
+
+    supportedBlocks = {block.value for block in self.BLOCK_VERSIONS}
+    if functionBlock not in supportedBlocks:
+      return self._error(functionBlock, function, self.ErrorCode.FUNCTION_BLOCK_NOT_SUPPORTED)
+
+    if function == Function.FUNCTION_BLOCK_INFO.value and operator == Operator.GET.value:
+      return [(functionBlock, function, Operator.STATUS.value, self.BLOCK_VERSIONS[FunctionBlock(functionBlock)].encode())]
+
+    if functionBlock == FunctionBlock.PRODUCT_INFO.value:
+      return self._handleProductInfo(function, operator, payload)
+    if functionBlock == FunctionBlock.DEVICE_MANAGEMENT.value:
+      return self._handleDeviceManagement(function, operator, payload)
+    if functionBlock == FunctionBlock.CONTROL.value and function == Function.CHIRP.value and operator == Operator.START.value:
+      self.state[key] = bytes([payload[0] & 1]) if payload else b"\x00"
+      return [(functionBlock, function, Operator.STATUS.value, self.state[key])]
+    if function == 0x01 and operator == Operator.START.value and functionBlock in (FunctionBlock.SETTINGS.value, FunctionBlock.CONTROL.value):
+      return self._list(functionBlock, function, self._listFunctions(functionBlock))
+
+    return self._handleState(functionBlock, function, operator, payload)
+
+  def _handleState(self, functionBlock, function, operator, payload):
+    key = (functionBlock, function)
+    if key not in self.state:
+      return self._error(functionBlock, function, self.ErrorCode.FUNCTION_NOT_SUPPORTED)
+    if operator == Operator.GET.value:
+      return [(functionBlock, function, Operator.STATUS.value, self.state[key])]
+    if operator in (Operator.SET.value, Operator.SET_GET.value):
+      setter = self._setters().get(key)
+      if setter is None:
+        return self._error(functionBlock, function, self.ErrorCode.OPERATOR_NOT_SUPPORTED)
+      try:
+        self.state[key] = setter(self.state[key], bytes(payload))
+      except IndexError:
+        return self._error(functionBlock, function, self.ErrorCode.INVALID_DATA)
+      if operator == Operator.SET.value:
+        return []
+      return [(functionBlock, function, Operator.STATUS.value, self.state[key])]
+    return self._error(functionBlock, function, self.ErrorCode.OPERATOR_NOT_SUPPORTED)
+
+  def _handleProductInfo(self, function, operator, payload):
+    block = FunctionBlock.PRODUCT_INFO.value
+    if function == Function.BMAP_VERSION.value and operator == Operator.GET.value:
+      return [(block, function, Operator.STATUS.value, self.bmapVersion.encode())]
+    if function == Function.ALL_FUNCTION_BLOCKS.value and operator == Operator.GET.value:
+      return [(block, function, Operator.STATUS.value, self._supportedBlocksBitmask())]
+    if function == Function.ALL_FUNCTION_BLOCKS.value and operator == Operator.START.value:
+      versions = [(block, function, Operator.STATUS.value, version.encode()) for version in self.BLOCK_VERSIONS.values()]
+      return [(block, function, Operator.START.value, b"")] + versions + [(block, function, Operator.FINAL.value, b"")]
+    if function == Function.ALL_FUNCTIONS.value and operator == Operator.START.value:
+      functions = [f for f in self._listFunctions(block) if f != Function.PRODUCT_ID_VARIANT.value]
+      return self._list(block, function, functions)
+    return self._handleState(block, function, operator, payload)
+
+  def _handleDeviceManagement(self, function, operator, payload):
+    block = FunctionBlock.DEVICE_MANAGEMENT.value
+    if function == Function.LIST_DEVICES.value and operator == Operator.GET.value:
+      macs = list(self.pairedDevices)
+      flags = 0
+      for i, mac in enumerate(macs[:2]):
+        if self.pairedDevices[mac][0]:
+          flags |= 1 << i
+      return [(block, function, Operator.STATUS.value, bytes([flags]) + b"".join(_macAddressToBytes(mac) for mac in macs))]
+    if function == Function.DEVICE_INFO.value and operator == Operator.GET.value:
+      mac = str(MacAddress.fromBuffer(payload))
+      if mac not in self.pairedDevices:
+        return self._error(block, function, self.ErrorCode.INVALID_DATA)
+      isConnected, name = self.pairedDevices[mac]
+      return [(block, function, Operator.STATUS.value, bytes(payload[:6]) + bytes([int(isConnected), 0, 0]) + name.encode())]
+    if function == Function.CONNECT_DEV.value and operator == Operator.START.value:
+      if len(payload) < 7:
+        return self._error(block, function, self.ErrorCode.INVALID_DATA)
+      mac = str(MacAddress.fromBuffer(payload, 1))
+      self.pairedDevices[mac] = (True, self.pairedDevices.get(mac, (False, mac))[1])
+      return [(block, function, Operator.START.value, b""), (block, function, Operator.PROCESS.value, b""), (block, function, Operator.FINAL.value, b""), (block, function, Operator.STATUS.value, bytes(payload[1:7]))]
+    return self._error(block, function, self.ErrorCode.FUNCTION_NOT_SUPPORTED)
+
+  def _list(self, functionBlock, function, functions):
+    frames = [(functionBlock, function, Operator.START.value, b"")]
+    for f in functions:
+      frames.append((functionBlock, f, Operator.PROCESS.value, b""))
+      frames.append((functionBlock, f, Operator.STATUS.value, self.state[(functionBlock, f)]))
+    frames.append((functionBlock, function, Operator.FINAL.value, b""))
+    return frames
+
+  def _error(self, functionBlock, function, code):
+    return [(functionBlock, function, Operator.ERROR.value, bytes([code.value]))]
+
+
+class _Connection:
+  def __init__(self, sock, device):
+    self.socket = sock
+    self.device = device
+    self.decoder = FrameDecoder()
+    self.outgoing = bytearray()
+    self.lastSendAt = 0.0
+
+
+class BoseSimulator:
+  """
+  Serves SimulatedBoseDevices over stream sockets (socketpairs, Unix or TCP sockets) on a single selector thread.
+
+  latency and jitter (in seconds) delay every response, fragmentSize splits responses into several writes that are
+  fragmentDelay apart, and dropRate is the probability that a request is never answered.
+  """
+
+  def __init__(self, *, latency=0.0, jitter=0.0, fragmentSize=None, fragmentDelay=0.001, dropRate=0.0, seed=None):
+    self.latency = latency
+    self.jitter = jitter
+    self.fragmentSize = fragmentSize
+    self.fragmentDelay = fragmentDelay
+    self.dropRate = dropRate
+    self._random = random.Random(seed)
+    self._encoder = FrameEncoder()
+    self._selector = selectors.DefaultSelector()
+    self._connections = {} # device -> connections
+    self._timers = []      # heap of (sendAt, sequence, connection, data)
+    self._sequence = itertools.count()
+    self._calls = []
+    self._lock = threading.Lock()
+    self._wakeReceiver, self._wakeSender = socket.socketpair()
+    self._wakeReceiver.setblocking(False)
+    self._wakeSender.setblocking(False)
+    self._selector.register(self._wakeReceiver, selectors.EVENT_READ, ("wake", None))
+    self._thread = None
+    self._closed = False
+
+  def start(self):
+    if self._thread is None:
+      self._thread = threading.Thread(target=self._run, name="BoseSimulator", daemon=True)
+      self._thread.start()
+    return self
+
+  def close(self):
+    self._closed = True
+    self._wake()
+    if self._thread is not None:
+      self._thread.join()
+      self._thread = None
+
+  def __enter__(self):
+    return self.start()
+
+  def __exit__(self, *exc):
+    self.close()
+
+  def connect(self, device=None):
+    """Serves a device (a new SimulatedBoseDevice by default) over a socketpair and returns the client socket"""
+    client, server = socket.socketpair()
+    self._callSoon(lambda: self._add(server, device or SimulatedBoseDevice()))
+    return client
+
+  def listen(self, address, family=socket.AF_INET, factory=SimulatedBoseDevice):
+    """Accepts connections on a Unix or TCP address, every connection gets its own device from factory; returns the bound address"""
+    listener = socket.socket(family, socket.SOCK_STREAM)
+    if family == socket.AF_INET:
+      listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind(address)
+    listener.listen(socket.SOMAXCONN)
+    listener.setblocking(False)
+    self._callSoon(lambda: self._selector.register(listener, selectors.EVENT_READ, ("listener", factory)))
+    return listener.getsockname()
+
+  def notify(self, device, functionBlock, function, operator=Operator.STATUS, payload=None):
+    """Sends an unsolicited frame (by default the current STATUS of the function) to every connection of the device"""
+    if payload is None:
+      payload = device.state[(functionBlock.value, function.value)]
+    frame = (functionBlock.value, function.value, operator.value, bytes(payload))
+    self._callSoon(lambda: [self._schedule(connection, [frame]) for connection in self._connections.get(device, [])])
+
+
+  def _callSoon(self, function):
+    with self._lock:
+      self._calls.append(function)
+    self._wake()
+
+  def _wake(self):
+    try:
+      self._wakeSender.send(b"\x00")
+    except (BlockingIOError, OSError):
+      pass
+
+  def _add(self, sock, device):
+    sock.setblocking(False)
+    connection = _Connection(sock, device)
+    self._connections.setdefault(device, []).append(connection)
+    self._selector.register(sock, selectors.EVENT_READ, ("connection", connection))
+
+  def _remove(self, connection):
+    self._selector.unregister(connection.socket)
+    connection.socket.close()
+    connections = self._connections.get(connection.device, [])
+    if connection in connections:
+      connections.remove(connection)
+    if not connections:
+      self._connections.pop(connection.device, None)
+
+  def _schedule(self, connection, frames):
+    if not frames:
+      return
+    data = self._encoder.encodeAll(frames)
+    now = time.monotonic()
+    sendAt = now + self.latency + (self._random.uniform(0, self.jitter) if self.jitter else 0)
+    sendAt = max(sendAt, connection.lastSendAt) # responses never overtake each other
+    connection.lastSendAt = sendAt
+    if self.fragmentSize:
+      for i in range(0, len(data), self.fragmentSize):
+        heapq.heappush(self._timers, (sendAt, next(self._sequence), connection, data[i:i+self.fragmentSize]))
+        sendAt += self.fragmentDelay
+      connection.lastSendAt = sendAt
+    else:
+      heapq.heappush(self._timers, (sendAt, next(self._sequence), connection, data))
+
+  def _onReadable(self, connection):
+    try:
+      connection.decoder.readFrom(connection.socket)
+    except (BlockingIOError, InterruptedError):
+      return
+    except OSError:
+      self._remove(connection)
+      return
+    for functionBlock, function, operator, payload in connection.decoder.frames():
+      if self.dropRate and self._random.random() < self.dropRate:
+        continue
+      self._schedule(connection, connection.device.handle(functionBlock, function, operator, bytes(payload)))
+
+  def _flush(self, connection):
+    try:
+      sent = connection.socket.send(connection.outgoing)
+    except (BlockingIOError, InterruptedError):
+      sent = 0
+    except OSError:
+      self._remove(connection)
+      return
+    del connection.outgoing[:sent]
+    events = selectors.EVENT_READ | (selectors.EVENT_WRITE if connection.outgoing else 0)
+    self._selector.modify(connection.socket, events, ("connection", connection))
+
+  def _run(self):
+    while not self._closed:
+      with self._lock:
+        calls, self._calls = self._calls, []
+      for call in calls:
+        call()
+
+      now = time.monotonic()
+      while self._timers and self._timers[0][0] <= now:
+        _, _, connection, data = heapq.heappop(self._timers)
+        if connection.socket.fileno() < 0:
+          continue
+        connection.outgoing += data
+        self._flush(connection)
+
+      timeout = max(0, self._timers[0][0] - now) if self._timers else None
+      for key, events in self._selector.select(timeout):
+        kind, data = key.data
+        if kind == "wake":
+          try:
+            while self._wakeReceiver.recv(4096):
+              pass
+          except BlockingIOError:
+            pass
+        elif kind == "listener":
+          try:
+            sock, _ = key.fileobj.accept()
+          except BlockingIOError:
+            continue
+          self._add(sock, data())
+        else:
+          if events & selectors.EVENT_WRITE:
+            self._flush(data)
+          if events & selectors.EVENT_READ and data.socket.fileno() >= 0:
+            self._onReadable(data)
+
+    for key in list(self._selector.get_map().values()):
+      key.fileobj.close()
+    self._selector.close()
+    self._wakeSender.close()
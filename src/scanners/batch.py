@@ -0,0 +1,139 @@
+try:
+  import numpy
+except ModuleNotFoundError:
+  numpy = None
+
+from devices import bose
+
+_ProductType = bose.BoseDevice.PairedDevice.ProductType
+
+# widest record any of the parsers accepts (legacy format with both macs)
+RECORD_WIDTH = 18
+
+FIELDS = [
+  ("isValid", "?"),
+  ("format", "u1"),
+  ("bmapMajor", "u1"),
+  ("bmapMinor", "u4"), # the legacy format can shift minor by up to 19 bits, see BoseMFSParserLegacy
+  ("bmapPatch", "u1"),
+  ("isInPairingMode", "?"),
+  ("isDevice1Connected", "?"),
+  ("isDevice2Connected", "?"),
+  ("device1MacAddress", "u8"),
+  ("device2MacAddress", "u8"),
+  ("productType", "u1"), # value of BoseDevice.PairedDevice.ProductType
+  ("productId", "u2"),
+  ("productVariant", "u1"),
+  ("supportsMusicShare", "?"),
+  ("isInMusicShare", "?"),
+]
+
+
+def _requireNumpy():
+  if numpy is None:
+    raise ModuleNotFoundError("Batch decoding requires numpy")
+
+
+def pack(records):
+  """
+  Packs manufacturer specific fields (as built by BoseParser._getManufacturerSpecificField, i.e. starting with the
+  format byte) into a single buffer, returns (buffer, offsets) where record i is buffer[offsets[i]:offsets[i+1]]
+  """
+  _requireNumpy()
+  offsets = numpy.zeros(len(records) + 1, dtype=numpy.int64)
+  numpy.cumsum([len(record) for record in records], out=offsets[1:])
+  buffer = numpy.frombuffer(b"".join(bytes(record) for record in records), dtype=numpy.uint8)
+  return buffer, offsets
+
+
+def _bit(column, bitPos):
+  return ((column >> bitPos) & 1).astype(bool)
+
+def _readMac(matrix, rows, start, length):
+  value = numpy.zeros(len(rows), dtype=numpy.uint64)
+  for i in range(length):
+    column = numpy.minimum(start + i, RECORD_WIDTH - 1)
+    value = (value << numpy.uint64(8)) | matrix[rows, column].astype(numpy.uint64)
+  return value
+
+
+def decode(buffer, offsets):
+  """
+  Decodes all records of a packed buffer (see pack) at once into a structured array with the FIELDS dtype.
+
+  The results match BoseMFSParserLegacy and BoseMFSParser104 field by field, including their length checks; records
+  those parsers reject (or that neither handles) have isValid set to False and all other fields zeroed.
+  """
+  _requireNumpy()
+  buffer = numpy.frombuffer(buffer, dtype=numpy.uint8) if not isinstance(buffer, numpy.ndarray) else buffer
+  offsets = numpy.asarray(offsets, dtype=numpy.int64)
+  starts = offsets[:-1]
+  lengths = offsets[1:] - starts
+  count = len(starts)
+
+  # scatter the variable length records into a zero padded matrix, one column at a time
+  matrix = numpy.zeros((count, RECORD_WIDTH), dtype=numpy.uint8)
+  for column in range(RECORD_WIDTH):
+    present = lengths > column
+    matrix[present, column] = buffer[starts[present] + column]
+  d = [matrix[:, column] for column in range(RECORD_WIDTH)]
+  rows = numpy.arange(count)
+
+  result = numpy.zeros(count, dtype=FIELDS)
+  result["format"] = numpy.where(lengths > 0, d[0], 0)
+
+  headphones = _ProductType.HEADPHONES.value
+  speaker = _ProductType.SPEAKER.value
+
+  # legacy (format 0x00 and 0x10)
+  legacy = ((d[0] == 0x00) | (d[0] == 0x10)) & (lengths >= 6)
+  device1 = _bit(d[5], 0)
+  device2 = _bit(d[5], 1)
+  legacy &= lengths == 6 + 6 * device1 + 6 * device2
+  major = (d[0] >> 4) & 0x0f
+  minor = (d[0] & 0x0f).astype(numpy.uint32) << (4 + ((d[1] >> 4) & 0x0f)).astype(numpy.uint32)
+  patch = d[1] & 0x0f
+  mac1 = numpy.where(device1, _readMac(matrix, rows, 6, 6), 0)
+  mac2 = numpy.where(device2, _readMac(matrix, rows, 6 + 6 * device1, 6), 0)
+  _assign(result, legacy, {
+    "bmapMajor": major, "bmapMinor": minor, "bmapPatch": patch,
+    "isInPairingMode": _bit(d[5], 7),
+    "isDevice1Connected": device1, "isDevice2Connected": device2,
+    "device1MacAddress": mac1, "device2MacAddress": mac2,
+    "productType": numpy.where(_bit(d[5], 5), headphones, speaker),
+    "productId": (d[2].astype(numpy.uint16) << 8) | d[3],
+    "productVariant": d[4],
+    "supportsMusicShare": _bit(d[5], 4),
+    "isInMusicShare": _bit(d[5], 2) | _bit(d[5], 3),
+  })
+
+  # 1.0.4 (format 0x01)
+  v104 = (d[0] == 0x01) & (lengths >= 9)
+  device1 = _bit(d[2], 4)
+  device2 = _bit(d[2], 5)
+  v104 &= lengths == 9 + 3 * device1 + 3 * device2
+  mac1 = numpy.where(device1, _readMac(matrix, rows, 9, 3), 0)
+  mac2 = numpy.where(device2, _readMac(matrix, rows, 9 + 3 * device1, 3), 0)
+  _assign(result, v104, {
+    "bmapMajor": 1, "bmapMinor": 0, "bmapPatch": 4,
+    "isInPairingMode": _bit(d[2], 7),
+    "isDevice1Connected": device1, "isDevice2Connected": device2,
+    "device1MacAddress": mac1, "device2MacAddress": mac2,
+    "productType": numpy.where(_bit(d[3], 2), headphones, speaker),
+    "productId": d[1],
+    "productVariant": d[2] & 0x0f,
+    "supportsMusicShare": _bit(d[3], 1),
+    "isInMusicShare": _bit(d[3], 0),
+  })
+
+  return result
+
+def _assign(result, mask, fields):
+  result["isValid"] |= mask
+  for name, values in fields.items():
+    result[name] = numpy.where(mask, values, result[name])
+
+
+def decodeRecords(records):
+  """Shorthand for decode(*pack(records))"""
+  return decode(*pack(records))
@@ -1,26 +1,267 @@
+import sys
+
+from collections import OrderedDict
+
 from devices import bose
-from devices.helpers import _bytesToMacAddress
+from devices.helpers import MacAddress
+from .layout import Layout, Bits, Flag, Integer, Derived, Optional
 
 class ScannedBoseDevice:
+  """
+  Immutable result of parsing a single advertisement.
+
+  Mac addresses are kept as (interned) MacAddresses, the bmap version and the boolean flags are packed into single
+  ints; the string forms are only built when they are read. macAddress, device1Mac and device2Mac are strings (or
+  None) like they have always been, their MacAddress's cached string form.
+  """
+
+  __slots__ = ("name", "_macAddress", "_bmapVersion", "_flags", "_device1Mac", "_device2Mac", "productType", "productId", "productVariant")
+
+  _PAIRING_MODE = 0x01
+  _DEVICE1_CONNECTED = 0x02
+  _DEVICE2_CONNECTED = 0x04
+  _SUPPORTS_MUSIC_SHARE = 0x08
+  _IN_MUSIC_SHARE = 0x10
+
   def __init__(self, name, macAddress, bmapVersion, isInPairingMode, isDevice1Connected, device1MacAddress, isDevice2Connected, device2MacAddress, productType, productId, productVariant, supportsMusicShare, isInMusicShare):
-    self.name = name
-    self.macAddress = macAddress
-    self.bmapVersion = bmapVersion
-    self.isInPairingMode = isInPairingMode
-    self.isDevice1Connected = isDevice1Connected
-    self.isDevice2Connected = isDevice2Connected
-    self.device1Mac = device1MacAddress
-    self.device2Mac = device2MacAddress
-    self.productType = productType
-    self.productId = productId
-    self.productVariant = productVariant
-    self.supportsMusicShare = supportsMusicShare
-    self.isInMusicShare = isInMusicShare
+    if isinstance(macAddress, str) and len(macAddress) == 17: # CoreBluetooth only exposes uuids, those are kept as they are
+      macAddress = MacAddress(macAddress)
+    if isinstance(bmapVersion, str):
+      bmapVersion = tuple(map(int, bmapVersion.split(".")))
+    major, minor, patch = bmapVersion
+    flags = (self._PAIRING_MODE if isInPairingMode else 0) | (self._DEVICE1_CONNECTED if isDevice1Connected else 0) | (self._DEVICE2_CONNECTED if isDevice2Connected else 0) | (self._SUPPORTS_MUSIC_SHARE if supportsMusicShare else 0) | (self._IN_MUSIC_SHARE if isInMusicShare else 0)
+
+    _set = object.__setattr__
+    _set(self, "name", name)
+    _set(self, "_macAddress", macAddress)
+    _set(self, "_bmapVersion", (major << 40) | (minor << 8) | patch) # minor gets 32 bits, see the legacy parser
+    _set(self, "_flags", flags)
+    _set(self, "_device1Mac", device1MacAddress)
+    _set(self, "_device2Mac", device2MacAddress)
+    _set(self, "productType", productType)
+    _set(self, "productId", productId)
+    _set(self, "productVariant", productVariant)
+
+  def __setattr__(self, name, value):
+    raise AttributeError(f"ScannedBoseDevice is immutable, cannot set {name}")
+
+  def __delattr__(self, name):
+    raise AttributeError(f"ScannedBoseDevice is immutable, cannot delete {name}")
+
+  def _key(self):
+    return (self.name, self._macAddress, self._bmapVersion, self._flags, self._device1Mac, self._device2Mac, self.productType, self.productId, self.productVariant)
+
+  def __eq__(self, other):
+    if not isinstance(other, ScannedBoseDevice):
+      return NotImplemented
+    return self._key() == other._key()
+
+  def __hash__(self):
+    return hash(self._key())
+
+  def __reduce__(self):
+    return (ScannedBoseDevice, (self.name, self._macAddress, self.bmapVersionInfo, self.isInPairingMode, self.isDevice1Connected, self._device1Mac, self.isDevice2Connected, self._device2Mac, self.productType, self.productId, self.productVariant, self.supportsMusicShare, self.isInMusicShare))
+
+  @property
+  def macAddress(self):
+    return str(self._macAddress)
+
+  @property
+  def device1Mac(self):
+    return None if self._device1Mac is None else str(self._device1Mac)
+
+  @property
+  def device2Mac(self):
+    return None if self._device2Mac is None else str(self._device2Mac)
+
+  @property
+  def bmapVersionInfo(self):
+    return (self._bmapVersion >> 40, (self._bmapVersion >> 8) & 0xffffffff, self._bmapVersion & 0xff)
+
+  @property
+  def bmapVersion(self):
+    return ".".join(map(str, self.bmapVersionInfo))
+
+  @property
+  def isInPairingMode(self):
+    return bool(self._flags & self._PAIRING_MODE)
+
+  @property
+  def isDevice1Connected(self):
+    return bool(self._flags & self._DEVICE1_CONNECTED)
+
+  @property
+  def isDevice2Connected(self):
+    return bool(self._flags & self._DEVICE2_CONNECTED)
+
+  @property
+  def supportsMusicShare(self):
+    return bool(self._flags & self._SUPPORTS_MUSIC_SHARE)
+
+  @property
+  def isInMusicShare(self):
+    return bool(self._flags & self._IN_MUSIC_SHARE)
+
   def __repr__(self):
     return f"ScannedBoseDevice<name={self.name}, macAddress={self.macAddress}, isInPairingMode={self.isInPairingMode}>"
 
 
+class ParseCache:
+  """Bounded LRU cache for parse results (including misses, i.e. None), with hit/miss counters"""
+  _MISSING = object()
+  
+  def __init__(self, maxsize=1024):
+    self.maxsize = maxsize
+    self.hits = 0
+    self.misses = 0
+    self._entries = OrderedDict()
+    
+  def get(self, key):
+    value = self._entries.get(key, self._MISSING)
+    if value is self._MISSING:
+      self.misses += 1
+      return self._MISSING
+    self.hits += 1
+    self._entries.move_to_end(key)
+    return value
+  
+  def put(self, key, value):
+    if self.maxsize <= 0:
+      return
+    self._entries[key] = value
+    self._entries.move_to_end(key)
+    while len(self._entries) > self.maxsize:
+      self._entries.popitem(last=False)
+      
+  def resize(self, maxsize):
+    self.maxsize = maxsize
+    while len(self._entries) > max(maxsize, 0):
+      self._entries.popitem(last=False)
+      
+  def clear(self):
+    self._entries.clear()
+    self.hits = 0
+    self.misses = 0
+    
+  def __len__(self):
+    return len(self._entries)
+  
+  def __repr__(self):
+    return f"ParseCache<hits={self.hits}, misses={self.misses}, size={len(self._entries)}, maxsize={self.maxsize}>"
+
+
+class BoseMFSParser:
+  """
+  Base of the manufacturer specific field parsers. Every format is described by a Layout, whose compiled decoder
+  returns the OUTPUTS in the order ScannedBoseDevice expects them; formats without a (known) layout are invalid.
+  """
+  LAYOUT = None
+  OUTPUTS = ("bmapVersionInfo", "isInPairingMode", "isDevice1Connected", "device1MacAddress", "isDevice2Connected", "device2MacAddress", "productType", "productId", "variantId", "supportsMusicShare", "isInMusicShare")
+  CONSTANTS = {
+    "HEADPHONES": bose.BoseDevice.PairedDevice.ProductType.HEADPHONES,
+    "SPEAKER": bose.BoseDevice.PairedDevice.ProductType.SPEAKER,
+    "MacAddress": MacAddress.fromBuffer,
+  }
+
+  def __init__(self, data: bytes):
+    values = self.decode(data)
+    self.isValid = values is not None
+    if self.isValid:
+      for name, value in zip(self.OUTPUTS, values):
+        setattr(self, name, value)
+
+  @classmethod
+  def accepts(cls) -> bool:
+    """Whether advertisements in this format can be decoded at all"""
+    return cls.LAYOUT is not None
+
+  @classmethod
+  def decode(cls, data: bytes):
+    if cls.LAYOUT is None:
+      return None
+    return cls.LAYOUT.decode(data)
+
+  @staticmethod
+  def isBitSet(value: int, bitPos: int) -> bool:
+    return bool((value >> bitPos) & 0b01)
+  
+  @staticmethod
+  def shiftBitsMagic(value: int, shift1: int, shift2: int) -> int:
+    return (value >> shift1) & (255 >> (8 - shift2))
+
+class BoseMFSParserLegacy(BoseMFSParser):
+  LENGTH_MINIMUM = 6
+  LENGTH_PER_MAC = 6
+  LAYOUT = Layout(LENGTH_MINIMUM, [
+    Bits("bmapMajor", 0, 4, 4),
+    Bits("bmapMinorHigh", 0, 0, 4),
+    Bits("bmapMinorShift", 1, 4, 4),
+    Derived("bmapMinor", "bmapMinorHigh << 4 + bmapMinorShift"), # sic, this is how it has always been parsed
+    Bits("bmapPatch", 1, 0, 4),
+    Derived("bmapVersionInfo", "(bmapMajor, bmapMinor, bmapPatch)"),
+    Integer("productId", 2, 2),
+    Bits("variantId", 4),
+    Flag("isDevice1Connected", 5, 0),
+    Flag("isDevice2Connected", 5, 1),
+    Bits("musicShare", 5, 2, 2),
+    Derived("isInMusicShare", "musicShare != 0"),
+    Flag("supportsMusicShare", 5, 4), # TODO: also apparently it does not support music sharing, when bmap < 1.0.2
+    Flag("isHeadphones", 5, 5),
+    Derived("productType", "HEADPHONES if isHeadphones else SPEAKER"),
+    Flag("isInPairingMode", 5, 7),
+  ], [
+    Optional("device1MacAddress", "isDevice1Connected", LENGTH_PER_MAC, "MacAddress"),
+    Optional("device2MacAddress", "isDevice2Connected", LENGTH_PER_MAC, "MacAddress"),
+  ], BoseMFSParser.OUTPUTS, BoseMFSParser.CONSTANTS)
+
+class BoseMFSParser104(BoseMFSParser):
+  LENGTH_MINIMUM = 9
+  LENGTH_PER_MAC = 3 # only the lower half of the mac addresses is advertised
+  LAYOUT = Layout(LENGTH_MINIMUM, [
+    Bits("format", 0, allowed=(0x00, 0x01)),
+    Derived("bmapVersionInfo", "(1, 0, 4)"),
+    Bits("productId", 1), # TODO: some magic to convert to actual product id
+    Bits("variantId", 2, 0, 4),
+    Flag("isDevice1Connected", 2, 4),
+    Flag("isDevice2Connected", 2, 5),
+    Flag("isInPairingMode", 2, 7),
+    Flag("isInMusicShare", 3, 0),
+    Flag("supportsMusicShare", 3, 1),
+    Flag("isHeadphones", 3, 2),
+    Derived("productType", "HEADPHONES if isHeadphones else SPEAKER"),
+  ], [
+    Optional("device1MacAddress", "isDevice1Connected", LENGTH_PER_MAC, "MacAddress"),
+    Optional("device2MacAddress", "isDevice2Connected", LENGTH_PER_MAC, "MacAddress"),
+  ], BoseMFSParser.OUTPUTS, BoseMFSParser.CONSTANTS)
+
+class BoseMFSParser120(BoseMFSParser):
+  """
+  Unsupported: the layout of the 0x9E (bmap 1.2.0) format is not known yet, so it never accepts and every
+  advertisement decodes as invalid. Deprecated as a placeholder, it is replaced by the actual parser once the
+  layout is known.
+  """
+  LAYOUT = None # TODO: the 1.2.0 layout
+
+
 class BoseParser:
+  # advertisements of a device repeat several times a second with identical data, so the decoded results are reused
+  cache = ParseCache()
+  
+  # Bose puts its format identifier where the low byte of the company id would be, so this is all that can be
+  # checked before parsing; advertisements with any other low byte can never be Bose devices, nor can those of
+  # formats whose parser does not accept them (yet)
+  FORMATS = {
+    0x00: BoseMFSParserLegacy,
+    0x10: BoseMFSParserLegacy,
+    0x01: BoseMFSParser104,
+    0x9E: BoseMFSParser120,
+  }
+  FORMAT_IDS = frozenset(format for format, parser in FORMATS.items() if parser.accepts())
+  
+  @classmethod
+  def accepts(cls, companyId):
+    return (companyId & 0xff) in cls.FORMAT_IDS
+  
   @classmethod
   def _getManufacturerSpecificField(cls, advertisement_data):
     mfd = advertisement_data.manufacturer_data
@@ -35,24 +276,35 @@ class BoseParser:
       ms2 = (key >> 8) & 0xff
       return bytearray([ms1, ms2, *data])
     
-  @classmethod
-  def _isShortenedName(cls, advertisement_data):
-    try:
-      hasShortName = bool(advertisement_data.platform_data[1].scan.advertisement.get_sections_by_type(0x08).size)
-      hasLongName = bool(advertisement_data.platform_data[1].scan.advertisement.get_sections_by_type(0x09).size)
-      return hasShortName and not hasLongName # Windows
-    except:
-      pass
-    
-    try:
-      hasShortName = advertisement_data.platform_data[1].get("AdvertisingData").has(0x08)
-      hasLongName = advertisement_data.platform_data[1].get("AdvertisingData").has(0x09)
-      return hasShortName and not hasLongName # Linux
-    except:
-      pass
-    
+  @staticmethod
+  def _isShortenedNameWindows(advertisement_data):
+    platform_data = advertisement_data.platform_data
+    scan = getattr(platform_data[1], "scan", None) if len(platform_data) > 1 else None
+    if scan is None: # no scan response
+      return False
+    hasShortName = bool(scan.advertisement.get_sections_by_type(0x08).size)
+    hasLongName = bool(scan.advertisement.get_sections_by_type(0x09).size)
+    return hasShortName and not hasLongName
+  
+  @staticmethod
+  def _isShortenedNameLinux(advertisement_data):
+    platform_data = advertisement_data.platform_data
+    properties = platform_data[1] if len(platform_data) > 1 else None
+    if not isinstance(properties, dict):
+      return False
+    advertisingData = properties.get("AdvertisingData") or {}
+    return 0x08 in advertisingData and 0x09 not in advertisingData
+  
+  @staticmethod
+  def _isShortenedNameUnknown(advertisement_data):
     return False
   
+  # the layout of platform_data depends on the bleak backend, which is fixed per platform, so the check is picked once
+  _isShortenedName = {
+    "win32": _isShortenedNameWindows,
+    "linux": _isShortenedNameLinux,
+  }.get(sys.platform, _isShortenedNameUnknown)
+  
   @classmethod
   def getFullName(cls, device, advertisement_data):
     name = device.name
@@ -71,6 +323,18 @@ class BoseParser:
   
   @classmethod
   def parse(cls, device, advertisement_data):
+    mfd = advertisement_data.manufacturer_data
+    if not mfd or len(mfd) != 1 or not any(map(cls.accepts, mfd)):
+      return None
+    key = (device.address, device.name, advertisement_data.local_name, cls._isShortenedName(advertisement_data), tuple(mfd.items()))
+    parsed = cls.cache.get(key)
+    if parsed is ParseCache._MISSING:
+      parsed = cls._parse(device, advertisement_data)
+      cls.cache.put(key, parsed)
+    return parsed
+  
+  @classmethod
+  def _parse(cls, device, advertisement_data):
     mfs_data = cls._getManufacturerSpecificField(advertisement_data)
     if mfs_data is None:
       return
@@ -81,131 +345,11 @@ class BoseParser:
 
     macAddress = device.address
     
-    parserMode = mfs_data[0]
-    parser = None
-    if parserMode == 0x9E:
-      parser = BoseMFSParser120(mfs_data)
-    elif parserMode in [0x00, 0x10]:
-      parser = BoseMFSParserLegacy(mfs_data)
-    elif parserMode == 0x01:
-      parser = BoseMFSParser104(mfs_data)
-      
-    if (not parser) or (not parser.isValid):
-      return
-        
-    return ScannedBoseDevice(name, macAddress, parser.bmapVersion, parser.isInPairingMode, parser.isDevice1Connected, parser.device1MacAddress, parser.isDevice2Connected, parser.device2MacAddress, parser.productType, parser.productId, parser.variantId, parser.supportsMusicShare, parser.isInMusicShare)
-  
-  
-class BoseMFSParser:
-  @staticmethod
-  def isBitSet(value: int, bitPos: int) -> bool:
-    return bool((value >> bitPos) & 0b01)
-  
-  @staticmethod
-  def shiftBitsMagic(value: int, shift1: int, shift2: int) -> int:
-    return (value >> shift1) & (255 >> (8 - shift2))
-
-class BoseMFSParserLegacy(BoseMFSParser):
-  LENGTH_MINIMUM = 6
-  LENGTH_PER_MAC = 6
-  def __init__(self, data: bytes):
-    self.isValid = True
-    
-    if len(data) < self.LENGTH_MINIMUM:
-      self.isValid = False
+    parser = cls.FORMATS.get(mfs_data[0])
+    if parser is None or not parser.accepts():
       return
-    
-    bmv1 = self.shiftBitsMagic(data[0], 4, 4)
-    bmv2 = self.shiftBitsMagic(data[0], 0, 4) << 4 + self.shiftBitsMagic(data[1], 4, 4)
-    bmv3 = self.shiftBitsMagic(data[1], 0, 4)
-    self.bmapVersion = f"{bmv1}.{bmv2}.{bmv3}"
-    
-    self.isInPairingMode = self.isBitSet(data[5], 7)
-    
-    self.isDevice1Connected = self.isBitSet(data[5], 0)
-    self.isDevice2Connected = self.isBitSet(data[5], 1)
-    
-    expectedLength = self.LENGTH_MINIMUM
-    if self.isDevice1Connected:
-      expectedLength += self.LENGTH_PER_MAC
-    if self.isDevice2Connected:
-      expectedLength += self.LENGTH_PER_MAC
-    if len(data) != expectedLength:
-      self.isValid = False
+    values = parser.decode(mfs_data)
+    if values is None:
       return
-    
-    self.device1MacAddress = None
-    self.device2MacAddress = None
-    macPos = 6
-    if self.isDevice1Connected:
-      self.device1MacAddress = _bytesToMacAddress(data[macPos:macPos+6])
-      macPos += 6
-    if self.isDevice2Connected:
-      self.device2MacAddress = _bytesToMacAddress(data[macPos:macPos+6])
-    
-    self.productId = (data[2] << 8) | data[3]
-    self.variantId = data[4]
-    
-    self.supportsMusicShare = self.isBitSet(data[5], 4) # TODO: also apparently it does not support music sharing, when bmap < 1.0.2
-    self.isInMusicShare = self.isBitSet(data[5], 2) or self.isBitSet(data[5], 3)
-    
-    self.productType = None
-    if self.isBitSet(data[5], 5):
-      self.productType = bose.BoseDevice.PairedDevice.ProductType.HEADPHONES
-    else:
-      self.productType = bose.BoseDevice.PairedDevice.ProductType.SPEAKER
-
-class BoseMFSParser104(BoseMFSParser):
-  LENGTH_MINIMUM = 9
-  LENGTH_PER_MAC = 3
-  def __init__(self, data: bytes):
-    self.isValid = True
-    if len(data) < self.LENGTH_MINIMUM:
-      self.isValid = False
-      return
-    
-    if data[0] not in [0x00, 0x01]:
-      self.isValid = False
-      return
-    
-    self.bmapVersion = "1.0.4"
-    
-    self.isDevice1Connected = self.isBitSet(data[2], 4)
-    self.isDevice2Connected = self.isBitSet(data[2], 5)
-    
-    expectedLength = self.LENGTH_MINIMUM
-    if self.isDevice1Connected:
-      expectedLength += self.LENGTH_PER_MAC
-    if self.isDevice2Connected:
-      expectedLength += self.LENGTH_PER_MAC
-    if len(data) != expectedLength:
-      self.isValid = False
-      return
-    
-    self.device1MacAddress = None
-    self.device2MacAddress = None
-    macPos = 9
-    if self.isDevice1Connected:
-      self.device1MacAddress = _bytesToMacAddress(bytes(3*b"\x00"+data[macPos:macPos+3]))
-      macPos += self.LENGTH_PER_MAC
-    if self.isDevice2Connected:
-      self.device2MacAddress = _bytesToMacAddress(bytes(3*b"\x00"+data[macPos:macPos+3]))
-    
-    self.isInPairingMode = self.isBitSet(data[2], 7)
-    
-    self.productType = None
-    if self.isBitSet(data[3], 2):
-      self.productType = bose.BoseDevice.PairedDevice.ProductType.HEADPHONES
-    else:
-      self.productType = bose.BoseDevice.PairedDevice.ProductType.SPEAKER
-    
-    bleProductId = data[1]
-    self.productId = bleProductId # TODO: some magic to convert to actual product id
-    self.variantId = self.shiftBitsMagic(data[2], 0, 4)
-    
-    self.isInMusicShare = self.isBitSet(data[3], 0)
-    self.supportsMusicShare = self.isBitSet(data[3], 1)
-
-class BoseMFSParser120(BoseMFSParser):
-  def __init__(self, data: bytes): # TODO
-    pass
+        
+    return ScannedBoseDevice(name, macAddress, *values)
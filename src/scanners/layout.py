@@ -0,0 +1,115 @@
+class Bits:
+  """width bits of data[byte], starting at bit shift; records with a value outside allowed (if given) are invalid"""
+  def __init__(self, name, byte, shift=0, width=8, allowed=None):
+    self.name = name
+    self.byte = byte
+    self.shift = shift
+    self.width = width
+    self.allowed = allowed
+
+  def source(self):
+    expression = f"data[{self.byte}]"
+    if self.shift:
+      expression = f"({expression} >> {self.shift})"
+    if self.width < 8:
+      expression = f"{expression} & {(1 << self.width) - 1:#x}"
+    lines = [f"{self.name} = {expression}"]
+    if self.allowed is not None:
+      lines.append(f"if {self.name} not in {tuple(self.allowed)!r}: return None")
+    return lines
+
+class Flag:
+  """Single bit of data[byte] as bool"""
+  def __init__(self, name, byte, bit):
+    self.name = name
+    self.byte = byte
+    self.bit = bit
+
+  def source(self):
+    return [f"{self.name} = bool(data[{self.byte}] & {1 << self.bit:#x})"]
+
+class Integer:
+  """Big endian unsigned integer of length bytes starting at data[start]"""
+  def __init__(self, name, start, length):
+    self.name = name
+    self.start = start
+    self.length = length
+
+  def source(self):
+    return [f"{self.name} = int.from_bytes(data[{self.start}:{self.start + self.length}], \"big\")"]
+
+class Derived:
+  """Python expression over the previously declared fields and the layout's constants"""
+  def __init__(self, name, expression):
+    self.name = name
+    self.expression = expression
+
+  def source(self):
+    return [f"{self.name} = {self.expression}"]
+
+class Optional:
+  """
+  Big endian unsigned integer of length bytes that is only present if the (previously declared) field present is
+  true, otherwise None. Optional fields follow the fixed part of the record back to back, in declaration order.
+  If reader (the name of one of the layout's constants) is given, the field is read by reader(data, offset, length).
+  """
+  def __init__(self, name, present, length, reader=None):
+    self.name = name
+    self.present = present
+    self.length = length
+    self.reader = reader
+
+  def expression(self):
+    if self.reader is not None:
+      return f"{self.reader}(data, pos, {self.length})"
+    return f"int.from_bytes(data[pos:pos+{self.length}], \"big\")"
+
+
+class Layout:
+  """
+  Declarative description of a manufacturer data record, compiled into a specialized decode(data) function the
+  first time it is used.
+
+  decode returns the outputs as a tuple, or None if the record is shorter than length, a field has a value that is
+  not allowed or the record is not exactly as long as its fixed part plus the present optional fields.
+  """
+
+  def __init__(self, length, fields, optional=(), outputs=(), constants=None):
+    self.length = length
+    self.fields = fields
+    self.optional = optional
+    self.outputs = outputs
+    self.constants = constants or {}
+
+  def __getattr__(self, name):
+    # decode is compiled on first use, so defining layouts (i.e. importing the parsers) stays cheap
+    if name != "decode":
+      raise AttributeError(name)
+    self.decode = self._compile()
+    return self.decode
+
+  def source(self):
+    lines = [f"if len(data) < {self.length}: return None"]
+    for field in self.fields:
+      lines += field.source()
+
+    expected = [str(self.length)] + [f"({field.length} if {field.present} else 0)" for field in self.optional]
+    lines.append(f"if len(data) != {' + '.join(expected)}: return None")
+    if self.optional:
+      lines.append(f"pos = {self.length}")
+    for field in self.optional:
+      lines += [
+        f"if {field.present}:",
+        f"  {field.name} = {field.expression()}",
+        f"  pos += {field.length}",
+        f"else:",
+        f"  {field.name} = None",
+      ]
+
+    lines.append(f"return ({''.join(name + ', ' for name in self.outputs)})")
+    return "def decode(data):\n" + "".join(f"  {line}\n" for line in lines)
+
+  def _compile(self):
+    namespace = dict(self.constants)
+    exec(compile(self.source(), f"<layout {id(self):#x}>", "exec"), namespace)
+    return namespace["decode"]
@@ -1,10 +1,5 @@
-import asyncio
-try:
-  import bleak
-except ModuleNotFoundError:
-  bleak = None
-  
 from .bose import BoseParser
+from devices import metrics
 
 from enum import Enum
 
@@ -14,25 +9,98 @@ class Parsers(Enum):
 _default_scan_time = 10
 _default_scan_parsers = {p for p in Parsers}
 
-async def scan(time=_default_scan_time, parsers=_default_scan_parsers):
-  stop_event = asyncio.Event()
-  devices = []
+def _import_bleak():
+  # bleak (with its platform backend) is only imported once a scan needs it
+  global bleak
+  try:
+    import bleak
+  except ModuleNotFoundError:
+    bleak = None
+  return bleak
+
+def __getattr__(name):
+  if name == "bleak": # scan.bleak, None if it is not installed
+    return _import_bleak()
+  raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+def default_scanner(callback, **kwargs):
+  """bleak.BleakScanner, imported on first use"""
+  if _import_bleak() is None:
+    raise ModuleNotFoundError("Scanning requires bleak")
+  return bleak.BleakScanner(callback, **kwargs)
+
+def _parserIndex(parsers):
+  """Maps the low byte of a company id to the parsers that accept it, so the scan callback can skip foreign advertisements with a dict lookup"""
+  index = {}
+  for parser in parsers:
+    for formatId in parser.value.FORMAT_IDS:
+      index.setdefault(formatId, []).append(parser.value)
+  return index
+
+async def scan_stream(time=_default_scan_time, parsers=_default_scan_parsers, *, max_results=None, predicate=None, reemit_on_change=False, scanner=None):
+  """
+  Yields the parsed devices as soon as their advertisements arrive.
+
+  Every device (by mac address) is only yielded once, or again whenever its parsed state changes if reemit_on_change
+  is set. Scanning stops after time seconds (None scans until the consumer stops), after max_results distinct devices
+  were yielded (changes yielded again do not count) or when the consumer leaves the loop. Only devices for which
+  predicate(device) is true are yielded.
+
+  scanner(callback) has to return an async context manager that reports advertisements to callback while it is
+  entered, bleak.BleakScanner by default (see default_scanner and capture.py for recording and replaying scanners).
+  """
+  import asyncio # like bleak, only imported once a scan needs it
+  loop = asyncio.get_running_loop()
+  queue = asyncio.Queue()
+  seen = {}
+  index = _parserIndex(parsers)
   def callback(device, advertising_data):
-    for parser in parsers:
-      parsed_device = parser.value.parse(device, advertising_data)
+    candidates = None
+    for company_id in advertising_data.manufacturer_data:
+      candidates = index.get(company_id & 0xff)
+      if candidates:
+        break
+    if not candidates:
+      if metrics.active is not None:
+        metrics.active.advertisement(0, 0)
+      return
+
+    hits = 0
+    for parser in candidates:
+      parsed_device = parser.parse(device, advertising_data)
 
       if not parsed_device:
         continue
-      
-      print(parsed_device.isInMusicShare)
-      stop_event.set()
-
-      devices.append(parsed_device)
-      
-  async with bleak.BleakScanner(callback):
-    #await asyncio.sleep(time)
-    await stop_event.wait()
-  
-
-def wait_for_scan(time=_default_scan_time, parsers=_default_scan_parsers):
-  return asyncio.run(scan(time, parsers))
+      hits += 1
+      if predicate is not None and not predicate(parsed_device):
+        continue
+
+      previous = seen.get(parsed_device.macAddress)
+      if previous is not None and (not reemit_on_change or previous == parsed_device):
+        continue
+      seen[parsed_device.macAddress] = parsed_device
+
+      queue.put_nowait(parsed_device)
+    if metrics.active is not None:
+      metrics.active.advertisement(len(candidates), hits)
+
+  deadline = None if time is None else loop.time() + time
+  emitted = set() # mac addresses of the yielded devices
+  async with (scanner or default_scanner)(callback):
+    while max_results is None or len(emitted) < max_results:
+      try:
+        if deadline is None:
+          parsed_device = await queue.get()
+        else:
+          parsed_device = await asyncio.wait_for(queue.get(), max(0, deadline - loop.time()))
+      except asyncio.TimeoutError:
+        return
+      emitted.add(parsed_device.macAddress)
+      yield parsed_device
+
+async def scan(time=_default_scan_time, parsers=_default_scan_parsers, **kwargs):
+  return [device async for device in scan_stream(time, parsers, **kwargs)]
+
+def wait_for_scan(time=_default_scan_time, parsers=_default_scan_parsers, **kwargs):
+  import asyncio
+  return asyncio.run(scan(time, parsers, **kwargs))
@@ -0,0 +1,27 @@
+import os
+import sys
+
+# the modules live in src and import each other as top level packages (devices, scanners), like main.py does
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
+
+import pytest
+
+from devices.bose import BoseDevice
+from devices.simulator import BoseSimulator, SimulatedBoseDevice
+
+
+@pytest.fixture
+def simulator():
+  with BoseSimulator() as simulator:
+    yield simulator
+
+@pytest.fixture
+def simulated():
+  return SimulatedBoseDevice()
+
+@pytest.fixture
+def device(simulator, simulated):
+  """BoseDevice connected to simulated (a default SimulatedBoseDevice) without a reader thread"""
+  device = BoseDevice("04:52:c7:00:00:01", sock=simulator.connect(simulated), timeout=2)
+  yield device
+  device.close()
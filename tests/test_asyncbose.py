@@ -0,0 +1,30 @@
+import asyncio
+
+from devices.asyncbose import AsyncBoseDevice
+from devices.fleet import BoseFleet
+from devices.simulator import BoseSimulator, SimulatedBoseDevice
+
+
+OTHER = "aa:bb:cc:dd:ee:01"
+KEEP = "aa:bb:cc:dd:ee:02"
+
+
+def test_connect_device_and_keep():
+  async def main(simulator):
+    device = AsyncBoseDevice("04:52:c7:00:00:01", timeout=2)
+    device.attach(simulator.connect())
+    try:
+      result = await device.connectDeviceAndKeep(OTHER, AsyncBoseDevice.PairedDevice.ProductType.HEADPHONES, KEEP)
+      assert result == OTHER.replace(":", " ")
+      assert await device.getCnc() == (11, 10) # the connection is still in sync
+    finally:
+      await device.close()
+  with BoseSimulator() as simulator:
+    asyncio.run(main(simulator))
+
+def test_connect_device_and_keep_in_fleet():
+  simulated = SimulatedBoseDevice()
+  with BoseSimulator() as simulator, BoseFleet() as fleet:
+    fleet.add("04:52:c7:00:00:01", simulator.connect(simulated)).result(2)
+    fleet.submit("04:52:c7:00:00:01", "connectDeviceAndKeep", OTHER, AsyncBoseDevice.PairedDevice.ProductType.HEADPHONES, KEEP).result(2)
+    assert OTHER in simulated.pairedDevices
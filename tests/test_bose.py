@@ -0,0 +1,117 @@
+import socket
+import threading
+
+from devices.bose import BoseDevice
+from devices.discovery import DiscoveryCache
+from devices.simulator import BoseSimulator, SimulatedBoseDevice
+
+
+def _hammer(device, threads=4, calls=50):
+  errors = []
+  def worker(i):
+    try:
+      for _ in range(calls):
+        if i % 2:
+          assert device.getDeviceName() == "Bose QC35 II"
+        else:
+          assert device.getCnc() == (11, 10)
+    except Exception as e:
+      errors.append(e)
+  workers = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+  for worker in workers:
+    worker.start()
+  for worker in workers:
+    worker.join()
+  return errors
+
+
+def test_concurrent_commands_with_reader():
+  with BoseSimulator(latency=0.001) as simulator:
+    device = BoseDevice("04:52:c7:00:00:01", sock=simulator.connect(), timeout=2)
+    device.startReader()
+    try:
+      assert _hammer(device) == []
+    finally:
+      device.close()
+
+def test_concurrent_snapshots_and_commands_with_reader():
+  with BoseSimulator(latency=0.001) as simulator:
+    device = BoseDevice("04:52:c7:00:00:01", sock=simulator.connect(), timeout=2)
+    device.startReader()
+    reads = [(BoseDevice.FunctionBlock.PRODUCT_INFO, BoseDevice.Function.SERIAL_NUMBER), (BoseDevice.FunctionBlock.SETTINGS, BoseDevice.Function.STANDBY_TIMER)]
+    errors = []
+    def snapshots():
+      try:
+        for _ in range(50):
+          snapshot = device.getSnapshot(reads)
+          assert snapshot.errors == {}
+          assert snapshot[BoseDevice.FunctionBlock.SETTINGS, BoseDevice.Function.STANDBY_TIMER] == 20
+      except Exception as e:
+        errors.append(e)
+    thread = threading.Thread(target=snapshots)
+    thread.start()
+    try:
+      errors += _hammer(device)
+      thread.join()
+      assert errors == []
+    finally:
+      device.close()
+
+def test_connect_device_and_keep_with_reader():
+  with BoseSimulator() as simulator:
+    device = BoseDevice("04:52:c7:00:00:01", sock=simulator.connect(), timeout=2)
+    device.startReader()
+    try:
+      result = device.connectDeviceAndKeep("aa:bb:cc:dd:ee:01", BoseDevice.PairedDevice.ProductType.HEADPHONES, "aa:bb:cc:dd:ee:02")
+      assert result == "aa bb cc dd ee 01"
+      assert device.getCnc() == (11, 10)
+    finally:
+      device.close()
+
+def test_failing_subscriber_keeps_connection():
+  with BoseSimulator() as simulator:
+    simulated = SimulatedBoseDevice()
+    lost = []
+    received = threading.Event()
+    device = BoseDevice("04:52:c7:00:00:01", sock=simulator.connect(simulated), timeout=2, onConnectionLost=lost.append)
+    def failing(*frame):
+      raise KeyError("subscriber bug")
+    device.subscribe(failing)
+    device.subscribe(lambda *frame: received.set())
+    device.startReader()
+    try:
+      simulator.notify(simulated, BoseDevice.FunctionBlock.SETTINGS, BoseDevice.Function.CNC)
+      assert received.wait(2)
+      assert device.getCnc() == (11, 10)
+      assert device.isConnected and lost == []
+    finally:
+      device.close()
+
+def test_bmap_version_is_not_answered_from_discovery_cache():
+  with BoseSimulator() as simulator:
+    device = BoseDevice("04:52:c7:00:00:01", sock=simulator.connect(), timeout=2, discovery=DiscoveryCache())
+    try:
+      device.getSupportedFunctionBlocks()
+      sent = []
+      sendCommand = device._sendCommand
+      device._sendCommand = lambda *args: sent.append(args) or sendCommand(*args)
+      device.getSupportedFunctionBlocks() # cached
+      assert sent == []
+      assert device.getBmapVersion() == device.getBmapVersion() == "1.0.4"
+      assert len(sent) == 2 # the keepalive probe has to reach the device
+    finally:
+      device.close()
+
+def test_snapshot_reconnects_after_broken_pipe():
+  with BoseSimulator() as simulator:
+    lost = []
+    device = BoseDevice("04:52:c7:00:00:01", socketFactory=simulator.connect, reconnect=BoseDevice.Backoff(initial=0.01), timeout=2, onConnectionLost=lost.append)
+    try:
+      device.socket.shutdown(socket.SHUT_WR) # the next send fails with a broken pipe
+      snapshot = device.getSnapshot([(BoseDevice.FunctionBlock.SETTINGS, BoseDevice.Function.CNC), (BoseDevice.FunctionBlock.SETTINGS, BoseDevice.Function.STANDBY_TIMER)])
+      assert snapshot.errors == {}
+      assert snapshot[BoseDevice.FunctionBlock.SETTINGS, BoseDevice.Function.CNC] == (11, 10)
+      assert len(lost) == 1 and isinstance(lost[0], ConnectionError)
+      assert len(device._router) == 0
+    finally:
+      device.close()
@@ -0,0 +1,65 @@
+import time
+
+from devices.bose import BoseDevice
+from devices.cache import SettingsCache
+from devices.simulator import BoseSimulator, SimulatedBoseDevice
+
+
+class _Clock:
+  def __init__(self):
+    self.now = 0.0
+
+  def __call__(self):
+    return self.now
+
+def _countingSends(device):
+  sent = []
+  sendCommand = device._sendCommand
+  device._sendCommand = lambda *args: sent.append(args) or sendCommand(*args)
+  return sent
+
+
+def test_entries_expire_after_their_ttl():
+  clock = _Clock()
+  cache = SettingsCache(10, clock=clock)
+  with BoseSimulator() as simulator:
+    device = BoseDevice("04:52:c7:00:00:01", sock=simulator.connect(), timeout=2, cache=cache)
+    try:
+      sent = _countingSends(device)
+      assert device.getCnc() == device.getCnc() == (11, 10)
+      assert len(sent) == 1 and (cache.hits, cache.misses) == (1, 1)
+      clock.now = 10.5
+      assert device.getCnc() == (11, 10)
+      assert len(sent) == 2 and cache.misses == 2
+    finally:
+      device.close()
+
+def test_refresh_bypasses_the_cache():
+  with BoseSimulator() as simulator:
+    simulated = SimulatedBoseDevice()
+    device = BoseDevice("04:52:c7:00:00:01", sock=simulator.connect(simulated), timeout=2, cache=SettingsCache())
+    try:
+      assert device.getCnc() == (11, 10)
+      simulated.set(BoseDevice.FunctionBlock.SETTINGS, BoseDevice.Function.CNC, bytes([11, 3])) # not announced
+      assert device.getCnc() == (11, 10)
+      assert device.getCnc(refresh=True) == (11, 3)
+      assert device.getCnc() == (11, 3)
+    finally:
+      device.close()
+
+def test_unsolicited_status_updates_the_cache_without_a_waiting_command():
+  with BoseSimulator() as simulator:
+    simulated = SimulatedBoseDevice()
+    device = BoseDevice("04:52:c7:00:00:01", sock=simulator.connect(simulated), timeout=2, cache=SettingsCache())
+    try:
+      assert device.getAnr()[0] == BoseDevice.AnrLevel.HIGH
+      simulated.set(BoseDevice.FunctionBlock.SETTINGS, BoseDevice.Function.ANR, bytes([BoseDevice.AnrLevel.OFF.value, 0b1011]))
+      simulator.notify(simulated, BoseDevice.FunctionBlock.SETTINGS, BoseDevice.Function.ANR) # the button press
+      sent = _countingSends(device)
+      deadline = time.monotonic() + 2
+      while device.getAnr()[0] != BoseDevice.AnrLevel.OFF and time.monotonic() < deadline:
+        time.sleep(0.01)
+      assert device.getAnr()[0] == BoseDevice.AnrLevel.OFF
+      assert sent == [] # served from the cache
+    finally:
+      device.close()
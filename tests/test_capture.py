@@ -0,0 +1,46 @@
+import os
+import subprocess
+import sys
+
+from types import SimpleNamespace
+
+from capture import MAGIC, _RECORD_HEADER, CaptureReader, CaptureWriter, RecordType
+
+
+def test_close_with_payloads_still_referenced(tmp_path):
+  path = str(tmp_path / "capture.bin")
+  with CaptureWriter(path) as writer:
+    for i in range(3):
+      writer.write(RecordType.SENT, bytes([i]) * 4)
+  reader = CaptureReader(path)
+  records = reader.records()
+  kept = next(records)
+  reader.close()
+  assert bytes(kept[3]) == b"\x00" * 4
+
+def test_long_names_are_cut_on_a_character_boundary(tmp_path):
+  path = str(tmp_path / "capture.bin")
+  name = "x" + "ä" * 200 # 401 bytes encoded, byte 254 is in the middle of a character
+  with CaptureWriter(path) as writer:
+    writer.writeAdvertisement(SimpleNamespace(address="04:52:C7:00:00:01", name=name), SimpleNamespace(local_name=name, manufacturer_data={}))
+  with CaptureReader(path) as reader:
+    (_, device, advertisement), = reader.advertisements()
+    assert name.startswith(device.name) and len(device.name) == 127
+    assert advertisement.local_name == device.name
+
+def test_records_of_unknown_types_are_skipped(tmp_path):
+  path = str(tmp_path / "capture.bin")
+  with CaptureWriter(path) as writer:
+    writer.write(RecordType.SENT, b"\x01")
+    writer.write(RecordType.SENT, b"\x02")
+    writer.write(RecordType.RECEIVED, b"\x03")
+  with open(path, "r+b") as f: # corrupt the type byte of the second record
+    f.seek(len(MAGIC) + _RECORD_HEADER.size + 1)
+    f.write(b"\x7f")
+  with CaptureReader(path) as reader:
+    assert [(recordType, bytes(payload)) for recordType, _, _, payload in reader.records()] == [(RecordType.SENT, b"\x01"), (RecordType.RECEIVED, b"\x03")]
+
+def test_import_does_not_pull_in_asyncio():
+  src = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src")
+  result = subprocess.run([sys.executable, "-c", "import sys, capture; assert 'asyncio' not in sys.modules"], cwd=src, capture_output=True, text=True)
+  assert result.returncode == 0, result.stderr
@@ -0,0 +1,16 @@
+import cli
+
+
+def _parse(monkeypatch, argv):
+  parsed = []
+  monkeypatch.setattr(cli, "run", lambda args: parsed.append(args) or 0)
+  cli.main(argv)
+  return parsed[0]
+
+def test_daemon_flag_keeps_input(monkeypatch):
+  args = _parse(monkeypatch, ["run", "--daemon", "jobs.jsonl"])
+  assert (args.daemon, args.daemon_socket, args.input) == (True, None, "jobs.jsonl")
+
+def test_daemon_socket(monkeypatch):
+  args = _parse(monkeypatch, ["run", "--daemon-socket", "/run/oboe.sock", "jobs.jsonl"])
+  assert (args.daemon_socket, args.input) == ("/run/oboe.sock", "jobs.jsonl")
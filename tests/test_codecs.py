@@ -0,0 +1,26 @@
+from devices.bose import BoseDevice
+
+FunctionBlock = BoseDevice.FunctionBlock
+Function = BoseDevice.Function
+
+
+def test_aliased_function_values_have_a_codec_per_block():
+  assert Function.CNC is Function.FIRMWARE_VERSION # both are 0x05, the enum cannot tell them apart
+  cnc = BoseDevice._CODECS.get(FunctionBlock.SETTINGS.value, 0x05)
+  firmware = BoseDevice._CODECS.get(FunctionBlock.PRODUCT_INFO.value, 0x05)
+  assert (cnc.name, firmware.name) == ("CNC", "FIRMWARE_VERSION")
+  assert cnc.decode(bytes([11, 10])) == (11, 10)
+  assert firmware.decode(b"4.5.2") == "4.5.2"
+
+def test_aliased_functions_decode_per_block_on_the_device(device):
+  assert device.getCnc() == (11, 10)
+  assert device.getFirmwareVersion() == "4.5.2"
+  snapshot = device.getSnapshot([(FunctionBlock.SETTINGS, Function.CNC), (FunctionBlock.PRODUCT_INFO, Function.FIRMWARE_VERSION)])
+  assert snapshot[FunctionBlock.SETTINGS, Function.CNC] == (11, 10)
+  assert snapshot[FunctionBlock.PRODUCT_INFO, Function.FIRMWARE_VERSION] == "4.5.2"
+  assert device.getAllSettings()[Function.CNC] == (11, 10)
+  assert device.getAllDeviceNumbers()[Function.FIRMWARE_VERSION] == "4.5.2"
+
+def test_functions_without_codec_stay_raw():
+  assert BoseDevice._CODECS.get(FunctionBlock.SETTINGS.value, 0x7f) is None
+  assert BoseDevice._CODECS.decode(FunctionBlock.SETTINGS.value, 0x7f, memoryview(b"\x01\x02")) == b"\x01\x02"
@@ -0,0 +1,84 @@
+import os
+import threading
+import time
+
+from daemon import BoseDaemon, DaemonClient
+from devices.bose import BoseDevice
+from devices.helpers import MacAddress
+from devices.simulator import BoseSimulator
+
+
+MACS = [f"04:52:c7:00:00:{i:02x}" for i in range(1, 9)]
+
+
+def test_shared_client_runs_requests_concurrently(tmp_path):
+  path = str(tmp_path / "oboe.sock")
+  with BoseSimulator(latency=0.2) as simulator:
+    daemon = BoseDaemon(path, MACS, deviceFactory=lambda macAddress: BoseDevice(str(macAddress), sock=simulator.connect(), timeout=5)).start()
+    try:
+      with DaemonClient(path, timeout=5) as client:
+        results = []
+        threads = [threading.Thread(target=lambda macAddress=macAddress: results.append(client.call(macAddress, "getCnc"))) for macAddress in MACS]
+        start = time.monotonic()
+        for thread in threads:
+          thread.start()
+        for thread in threads:
+          thread.join()
+        assert results == [[11, 10]] * len(MACS)
+        assert time.monotonic() - start < 0.2 * len(MACS) / 2
+    finally:
+      daemon.close()
+
+class _WedgedDevice:
+  isConnected = True
+
+  def __init__(self):
+    self.released = threading.Event()
+
+  def getCnc(self):
+    self.released.wait(5)
+    return 0, 0
+
+  def close(self):
+    self.released.set()
+
+
+def test_wedged_device_does_not_hold_up_others(tmp_path):
+  path = str(tmp_path / "oboe.sock")
+  wedged = _WedgedDevice()
+  with BoseSimulator() as simulator:
+    factory = lambda macAddress: wedged if str(macAddress) == MACS[0] else BoseDevice(str(macAddress), sock=simulator.connect(), timeout=5)
+    daemon = BoseDaemon(path, MACS[:2], workers=4, deviceFactory=factory).start()
+    try:
+      with DaemonClient(path, timeout=5) as client:
+        stuck = [threading.Thread(target=client.call, args=(MACS[0], "getCnc")) for _ in range(6)]
+        for thread in stuck:
+          thread.start()
+        time.sleep(0.1)
+        start = time.monotonic()
+        assert client.call(MACS[1], "getCnc") == [11, 10]
+        assert time.monotonic() - start < 0.5
+        wedged.released.set()
+        for thread in stuck:
+          thread.join()
+    finally:
+      daemon.close()
+
+def test_close_after_the_socket_file_was_removed(tmp_path):
+  path = str(tmp_path / "oboe.sock")
+  wedged = _WedgedDevice()
+  daemon = BoseDaemon(path, MACS[:1], deviceFactory=lambda macAddress: wedged).start()
+  daemon._device(MacAddress(MACS[0]))
+  os.unlink(path)
+  daemon.close()
+  assert wedged.released.is_set() # the device was closed all the same
+
+def test_requests_racing_close_get_error_responses(tmp_path):
+  path = str(tmp_path / "oboe.sock")
+  daemon = BoseDaemon(path, MACS[:1], deviceFactory=lambda macAddress: _WedgedDevice()).start()
+  entry = daemon._device(MacAddress(MACS[0])) # looked up just before the daemon closed
+  daemon.close()
+  responses = []
+  daemon._submit({"id": 1, "command": "ping"}, responses.append)
+  daemon._queue(entry, lambda error: responses.append(daemon._response({"id": 2}, error=error)))
+  assert [(response["id"], response["ok"], response["error"]["type"]) for response in responses] == [(1, False, "ConnectionError"), (2, False, "ConnectionError")]
@@ -0,0 +1,77 @@
+import threading
+import time
+
+import pytest
+
+from concurrent.futures import CancelledError
+
+from devices.bose import BoseDevice
+from devices.routing import CommandTimeout
+from devices.simulator import BoseSimulator, SimulatedBoseDevice
+
+SETTINGS = BoseDevice.FunctionBlock.SETTINGS
+CNC = BoseDevice.Function.CNC
+
+
+@pytest.fixture
+def slow():
+  """(simulator, simulated, device) answering after 0.2 seconds, without a command timeout"""
+  with BoseSimulator(latency=0.2) as simulator:
+    simulated = SimulatedBoseDevice()
+    device = BoseDevice("04:52:c7:00:00:01", sock=simulator.connect(simulated))
+    yield simulator, simulated, device
+    device.close()
+
+
+def test_deadline_limits_the_commands_of_its_block(slow):
+  _, _, device = slow
+  start = time.monotonic()
+  with pytest.raises(CommandTimeout):
+    with device.deadline(0.05):
+      device.getCnc()
+  assert time.monotonic() - start < 0.15
+  with device.deadline(5):
+    with device.deadline(None): # cannot extend the outer one
+      assert device.getCnc() == (11, 10)
+
+def test_deadline_only_applies_to_its_thread(slow):
+  _, _, device = slow
+  device.startReader()
+  results = []
+  thread = threading.Thread(target=lambda: results.append(device.getDeviceName()))
+  with device.deadline(0.05):
+    thread.start()
+    with pytest.raises(CommandTimeout):
+      device.getCnc()
+  thread.join()
+  assert results == ["Bose QC35 II"]
+
+def test_cancel_outstanding_commands(slow):
+  _, _, device = slow
+  device.startReader()
+  errors = []
+  def getCnc():
+    try:
+      device.getCnc()
+    except CancelledError as e:
+      errors.append(e)
+  thread = threading.Thread(target=getCnc)
+  thread.start()
+  time.sleep(0.05)
+  assert device.cancel(SETTINGS, BoseDevice.Function.ANR) == 0
+  assert device.cancel(SETTINGS, CNC) == 1
+  thread.join(1)
+  assert len(errors) == 1
+  assert device.getCnc() == (11, 10)
+
+@pytest.mark.parametrize("reader", [False, True])
+def test_late_response_of_an_abandoned_request_is_not_taken_for_the_next(slow, reader):
+  _, simulated, device = slow
+  if reader:
+    device.startReader()
+  with pytest.raises(CommandTimeout):
+    with device.deadline(0.05):
+      device.getCnc()
+  simulated.set(SETTINGS, CNC, bytes([11, 3]))
+  assert device.getCnc() == (11, 3) # the late (11, 10) is swallowed
+  assert len(device._router) == 0
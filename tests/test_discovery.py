@@ -0,0 +1,38 @@
+from devices.bose import BoseDevice
+from devices.discovery import DiscoveryCache
+from devices.simulator import SimulatedBoseDevice
+
+
+def _discover(simulator, simulated, cache):
+  """Returns the discovered capabilities and the functions that were sent to the device for them"""
+  device = BoseDevice("04:52:c7:00:00:01", sock=simulator.connect(simulated), timeout=2, discovery=cache)
+  sent = []
+  sendCommand = device._sendCommand
+  device._sendCommand = lambda functionBlock, function, *args: sent.append(function.value) or sendCommand(functionBlock, function, *args)
+  try:
+    return (device.getSupportedFunctionBlocks(), device.getSupportedFunctionBlockVersions()), sent
+  finally:
+    device.close()
+
+
+def test_cache_is_reloaded_from_disk(tmp_path, simulator, simulated):
+  path = str(tmp_path / "discovery.jsonl")
+  learned, _ = _discover(simulator, simulated, DiscoveryCache(path))
+  with open(path, "a") as f:
+    f.write('{"product": "40') # cut off by a crash
+
+  cache = DiscoveryCache(path)
+  assert len(cache) == 2
+  discovered, sent = _discover(simulator, SimulatedBoseDevice(), cache)
+  assert discovered == learned
+  assert cache.hits == 2 and cache.misses == 0
+  # only the model (PRODUCT_ID_VARIANT and FIRMWARE_VERSION) is read, pipelined without going through _sendCommand
+  assert sent == []
+
+def test_other_firmware_is_discovered_again(tmp_path, simulator, simulated):
+  path = str(tmp_path / "discovery.jsonl")
+  _discover(simulator, simulated, DiscoveryCache(path))
+  cache = DiscoveryCache(path)
+  _, sent = _discover(simulator, SimulatedBoseDevice(firmwareVersion="4.6.0"), cache)
+  assert cache.hits == 0 and sent == [BoseDevice.Function.ALL_FUNCTION_BLOCKS.value] * 2
+  assert len(DiscoveryCache(path)) == 4
@@ -0,0 +1,36 @@
+import time
+
+import pytest
+
+from devices.discovery import DiscoveryCache
+from devices.fleet import BoseFleet
+from devices.routing import CommandTimeout
+from devices.simulator import BoseSimulator
+
+
+def test_unanswered_command_times_out():
+  with BoseSimulator(dropRate=1.0) as simulator, BoseFleet(timeout=0.2) as fleet:
+    fleet.add("04:52:c7:00:00:01", simulator.connect()).result(2)
+    start = time.monotonic()
+    with pytest.raises(CommandTimeout):
+      fleet.submit("04:52:c7:00:00:01", "getCnc").result(2)
+    assert time.monotonic() - start < 1
+
+def test_run_all_waits_for_all_devices_together():
+  with BoseSimulator(dropRate=1.0) as simulator, BoseFleet() as fleet:
+    for i in range(3):
+      fleet.add(f"04:52:c7:00:00:0{i}", simulator.connect()).result(2)
+    start = time.monotonic()
+    results = fleet.runAll("getCnc", timeout=0.3)
+    assert time.monotonic() - start < 0.6
+    assert len(results) == 3 and all(isinstance(result, Exception) for result in results.values())
+
+def test_discovery_and_close_run_on_the_fleet_thread():
+  with BoseSimulator() as simulator, BoseFleet(timeout=2) as fleet:
+    device = fleet.add("04:52:c7:00:00:01", simulator.connect()).result(2)
+    device.discovery = DiscoveryCache()
+    blocks = fleet.submit("04:52:c7:00:00:01", "getSupportedFunctionBlocks").result(2)
+    assert fleet.submit("04:52:c7:00:00:01", "getSupportedFunctionBlocks").result(2) == blocks
+    assert device.discovery.hits == 1
+    fleet.submit("04:52:c7:00:00:01", "close").result(2)
+    assert device.socket is None and fleet.devices == {}
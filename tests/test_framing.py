@@ -0,0 +1,68 @@
+import socket
+
+import pytest
+
+from devices.bose import BoseDevice
+from devices.framing import MAX_FRAME_LENGTH, FrameDecoder, FrameEncoder
+from devices.simulator import BoseSimulator
+
+FRAMES = [(0x01, 0x05, 0x03, b"4.5.2"), (0x02, 0x09, 0x03, bytes([11, 10])), (0x00, 0x01, 0x01, b""), (0x02, 0x02, 0x03, bytes(range(255)))]
+
+
+def _encode(frames):
+  return bytes(FrameEncoder().encodeAll(frames))
+
+def _decoded(decoder):
+  return [(functionBlock, function, operator, bytes(payload)) for functionBlock, function, operator, payload in decoder.frames()]
+
+
+def test_frames_split_at_every_byte():
+  decoder = FrameDecoder()
+  frames = []
+  for byte in _encode(FRAMES):
+    decoder.feed(bytes([byte]))
+    frames += _decoded(decoder)
+  assert frames == FRAMES and decoder.pending == 0
+
+def test_partial_frames_stay_buffered_while_the_buffer_wraps():
+  decoder = FrameDecoder(2 * MAX_FRAME_LENGTH) # small enough that partial frames are moved to the front over and over
+  data = _encode(FRAMES * 4)
+  frames = []
+  for i in range(0, len(data), 100):
+    decoder.feed(data[i:i+100])
+    frames += _decoded(decoder)
+  assert frames == FRAMES * 4
+
+def test_short_reads_from_a_socket():
+  client, server = socket.socketpair()
+  decoder = FrameDecoder()
+  data = _encode(FRAMES)
+  frames = []
+  try:
+    for i in range(0, len(data), 3):
+      server.sendall(data[i:i+3])
+      decoder.readFrom(client)
+      frames += _decoded(decoder)
+  finally:
+    client.close()
+    server.close()
+  assert frames == FRAMES
+
+def test_commands_over_fragmented_responses():
+  with BoseSimulator(fragmentSize=1, fragmentDelay=0) as simulator:
+    device = BoseDevice("04:52:c7:00:00:01", sock=simulator.connect(), timeout=2)
+    try:
+      assert device.getDeviceName() == "Bose QC35 II"
+      assert device.getFirmwareVersion() == "4.5.2"
+      assert device.getCnc() == (11, 10)
+    finally:
+      device.close()
+
+def test_closed_connection_is_an_error():
+  client, server = socket.socketpair()
+  server.close()
+  try:
+    with pytest.raises(ConnectionError):
+      FrameDecoder().readFrom(client)
+  finally:
+    client.close()
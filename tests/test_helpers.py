@@ -0,0 +1,44 @@
+import pickle
+
+import pytest
+
+from devices.bose import BoseDevice
+from devices.helpers import MacAddress, _bytesToMacAddress, _macAddressToBytes
+
+
+def test_addresses_are_interned():
+  mac = MacAddress("04:52:C7:0A:0B:0C")
+  assert MacAddress("04:52:c7:0a:0b:0c") is mac
+  assert MacAddress("04-52-C7-0A-0B-0C") is mac
+  assert MacAddress(0x0452c70a0b0c) is mac
+  assert MacAddress(bytes.fromhex("0452c70a0b0c")) is mac
+  assert MacAddress.fromBuffer(bytearray(b"\xff\x04\x52\xc7\x0a\x0b\x0c"), 1) is mac
+  assert MacAddress(mac) is mac
+
+def test_equality_and_hashing():
+  mac = MacAddress("04:52:c7:0a:0b:0c")
+  partial = MacAddress("0a:0b:0c")
+  assert partial.isPartial and partial.length == 3
+  assert partial != MacAddress(0x0a0b0c) # a full address with the same value
+  assert partial != mac and partial.matches(mac) and mac.matches(partial)
+  assert not partial.matches("04:52:c7:0a:0b:0d")
+  assert mac != "04:52:c7:0a:0b:0c" # compare strings with str(mac)
+  assert len({mac, MacAddress(0x0452c70a0b0c), partial}) == 2
+  with pytest.raises(AttributeError):
+    mac.value = 0
+
+def test_round_trips():
+  mac = MacAddress("04:52:C7:0A:0B:0C")
+  assert str(mac) == "04:52:c7:0a:0b:0c" and f"{mac:>20}" == "   04:52:c7:0a:0b:0c"
+  assert bytes(mac) == bytes.fromhex("0452c70a0b0c") and int(mac) == 0x0452c70a0b0c
+  assert MacAddress(str(mac)) is MacAddress(bytes(mac)) is mac
+  assert pickle.loads(pickle.dumps(mac)) is mac
+  assert str(MacAddress("0a:0b:0c")) == "00:00:00:0a:0b:0c"
+  assert _bytesToMacAddress(_macAddressToBytes("04:52:c7:0a:0b:0c")) == "04:52:c7:0a:0b:0c"
+  with pytest.raises(ValueError):
+    MacAddress(1 << 48)
+
+def test_device_mac_addresses(device):
+  assert device.getMacAddress() is MacAddress("04:52:c7:00:00:01")
+  device.connectDevice("aa:bb:cc:dd:ee:01")
+  assert device.listDevices()[1] == [MacAddress("aa:bb:cc:dd:ee:01")]
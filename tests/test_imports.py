@@ -0,0 +1,14 @@
+import pytest
+
+from bench import IMPORT_CHECKS, importTimes
+
+# the budgets are meant for quiet benchmark machines, shared CI runners get this much headroom
+HEADROOM = 3
+
+
+@pytest.mark.parametrize("module", sorted(IMPORT_CHECKS))
+def test_import_stays_lazy_and_within_budget(module):
+  budget, forbidden = IMPORT_CHECKS[module]
+  times = importTimes(module, runs=3)
+  assert [name for name in forbidden if name in times] == []
+  assert times[module] / 1000 <= budget * HEADROOM
@@ -0,0 +1,47 @@
+import pytest
+
+from devices import metrics
+from devices.bose import BoseDevice
+from devices.routing import CommandTimeout
+from devices.simulator import BoseSimulator, SimulatedBoseDevice
+
+SETTINGS = BoseDevice.FunctionBlock.SETTINGS
+CNC = BoseDevice.Function.CNC
+ANR = BoseDevice.Function.ANR
+
+
+@pytest.fixture
+def collector():
+  yield metrics.enable()
+  metrics.disable()
+
+def _commands(collector):
+  return sorted((command["function"], command["outcome"], command["count"]) for command in collector.snapshot()["commands"])
+
+
+def test_failed_and_timed_out_commands_are_timed(collector):
+  with BoseSimulator() as simulator:
+    simulated = SimulatedBoseDevice()
+    simulated.errors[(SETTINGS.value, ANR.value)] = SimulatedBoseDevice.ErrorCode.FUNCTION_NOT_SUPPORTED.value
+    device = BoseDevice("04:52:c7:00:00:01", sock=simulator.connect(simulated), timeout=2)
+    try:
+      device.getCnc()
+      with pytest.raises(Exception):
+        device.getAnr()
+      snapshot = device.getSnapshot([(SETTINGS, CNC), (SETTINGS, ANR)])
+      assert list(snapshot.errors) == [(SETTINGS.value, ANR.value)]
+    finally:
+      device.close()
+  with BoseSimulator(dropRate=1.0) as simulator:
+    device = BoseDevice("04:52:c7:00:00:01", sock=simulator.connect(), timeout=0.05)
+    try:
+      with pytest.raises(CommandTimeout):
+        device.getCnc()
+    finally:
+      device.close()
+
+  assert _commands(collector) == [("ANR", "error", 2), ("CNC", "ok", 2), ("CNC", "timeout", 1)]
+  exported = collector.prometheus()
+  assert 'oboe_command_latency_seconds_count{function_block="SETTINGS",function="CNC",outcome="timeout"} 1' in exported
+  assert 'oboe_command_latency_seconds_count{function_block="SETTINGS",function="ANR",outcome="error"} 2' in exported
+  assert 'oboe_command_latency_seconds_bucket{function_block="SETTINGS",function="CNC",outcome="ok",le="+Inf"} 2' in exported
@@ -0,0 +1,34 @@
+from devices.bose import BoseDevice
+from devices.profile import FieldResult, SettingsProfile
+
+Status = FieldResult.Status
+
+
+def _statuses(report):
+  return {name: result.status for name, result in report}
+
+
+def test_apply_profile_changes_once(device):
+  profile = SettingsProfile.fromDict({"deviceName": "Desk", "anr": "OFF", "cnc": 3, "standbyTimer": 20, "voicePromptsEnabled": False, "multipoint": False})
+  report = device.applyProfile(profile)
+  assert _statuses(report) == {
+    "deviceName": Status.CHANGED, "anr": Status.CHANGED, "cnc": Status.CHANGED, "standbyTimer": Status.UNCHANGED,
+    "voicePromptsEnabled": Status.CHANGED, "multipoint": Status.CHANGED,
+  }
+  assert report.ok and (report["anr"].before, report["anr"].after) == (BoseDevice.AnrLevel.HIGH, BoseDevice.AnrLevel.OFF)
+  assert device.getDeviceName() == "Desk" and device.getCnc() == (11, 3)
+
+  sent = []
+  sendCommand = device._sendCommand
+  device._sendCommand = lambda *args: sent.append(args) or sendCommand(*args)
+  report = device.applyProfile(profile)
+  assert set(_statuses(report).values()) == {Status.UNCHANGED} and len(report) == 6
+  assert report.changed == [] and report.ok
+  assert [(functionBlock, function) for functionBlock, function, *_ in sent] == [(BoseDevice.FunctionBlock.SETTINGS, BoseDevice.Function.ALL_SETTINGS)]
+
+def test_unsupported_and_failed_fields(device, simulated):
+  simulated.errors[(BoseDevice.FunctionBlock.SETTINGS.value, BoseDevice.Function.STANDBY_TIMER.value)] = simulated.ErrorCode.INVALID_DATA.value
+  report = device.applyProfile(SettingsProfile(cnc=20, anr=BoseDevice.AnrLevel.OFF, standbyTimer=60))
+  assert _statuses(report) == {"cnc": Status.UNSUPPORTED, "anr": Status.CHANGED, "standbyTimer": Status.FAILED}
+  assert report["standbyTimer"].error is not None
+  assert not report.ok and report.changed == ["anr"]
@@ -0,0 +1,9 @@
+import os
+import subprocess
+import sys
+
+
+def test_import_on_its_own():
+  src = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src")
+  result = subprocess.run([sys.executable, "-c", "from devices.routing import CommandTimeout, ResponseRouter"], cwd=src, capture_output=True, text=True)
+  assert result.returncode == 0, result.stderr
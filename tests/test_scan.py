@@ -0,0 +1,49 @@
+import asyncio
+
+from types import SimpleNamespace
+
+from capture import CaptureReader, CaptureWriter
+from scanners.scan import scan
+
+
+def _advertisement(device, pairing=False):
+  address = f"04:52:C7:00:00:{device:02X}"
+  flags = 0x80 if pairing else 0x00
+  return SimpleNamespace(address=address, name=f"Bose {device}"), SimpleNamespace(local_name=None, manufacturer_data={0x4201: bytes([flags, 0x04, 0, 0, 0, 0, 0])})
+
+def _foreign():
+  return SimpleNamespace(address="11:22:33:44:55:66", name="Other"), SimpleNamespace(local_name=None, manufacturer_data={0x004c: bytes(7)})
+
+def _replay(tmp_path, advertisements, **kwargs):
+  """Scans the advertisements, a list of (timestamp, (device, advertisement_data)), replayed from a capture"""
+  path = str(tmp_path / "scan.bin")
+  with CaptureWriter(path) as writer:
+    for timestamp, (device, advertisement) in advertisements:
+      writer.writeAdvertisement(device, advertisement, timestamp=timestamp)
+  with CaptureReader(path) as reader:
+    speed = kwargs.pop("speed", None)
+    devices = asyncio.run(scan(scanner=reader.scanner(speed), **kwargs))
+  return [(device.name, device.isInPairingMode) for device in devices]
+
+
+def test_devices_are_yielded_once(tmp_path):
+  advertisements = [(0, _advertisement(1)), (0, _foreign()), (0, _advertisement(2)), (0, _advertisement(1)), (0, _advertisement(1, pairing=True))]
+  assert _replay(tmp_path, advertisements, time=0.2) == [("Bose 1", False), ("Bose 2", False)]
+
+def test_changes_are_yielded_again_with_reemit_on_change(tmp_path):
+  advertisements = [(0, _advertisement(1)), (0, _advertisement(1)), (0, _advertisement(1, pairing=True)), (0, _advertisement(1))]
+  assert _replay(tmp_path, advertisements, time=0.2, reemit_on_change=True) == [("Bose 1", False), ("Bose 1", True), ("Bose 1", False)]
+
+def test_predicate_filters_devices(tmp_path):
+  advertisements = [(0, _advertisement(1)), (0, _advertisement(2, pairing=True)), (0, _advertisement(3))]
+  assert _replay(tmp_path, advertisements, time=0.2, predicate=lambda device: device.isInPairingMode) == [("Bose 2", True)]
+
+def test_max_results_counts_distinct_devices(tmp_path):
+  flapping = [(0, _advertisement(1, pairing=i % 2 == 1)) for i in range(6)]
+  advertisements = flapping + [(0, _advertisement(2)), (0, _advertisement(3))]
+  devices = _replay(tmp_path, advertisements, time=1, reemit_on_change=True, max_results=2)
+  assert devices == [("Bose 1", False), ("Bose 1", True)] * 3 + [("Bose 2", False)]
+
+def test_scanning_stops_at_the_deadline(tmp_path):
+  advertisements = [(0, _advertisement(1)), (0.05, _advertisement(2)), (5, _advertisement(3))]
+  assert _replay(tmp_path, advertisements, time=0.5, speed=1) == [("Bose 1", False), ("Bose 2", False)]
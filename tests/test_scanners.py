@@ -0,0 +1,71 @@
+import json
+
+from types import SimpleNamespace
+
+import pytest
+
+from devices.bose import BoseDevice
+from scanners.bose import BoseParser, BoseMFSParserLegacy, BoseMFSParser104, BoseMFSParser120
+
+HEADPHONES = BoseDevice.PairedDevice.ProductType.HEADPHONES
+SPEAKER = BoseDevice.PairedDevice.ProductType.SPEAKER
+
+
+def _advertisement(shortened=False, address="04:52:C7:00:00:01"):
+  device = SimpleNamespace(address=address, name="LE-Bose QC35 II")
+  advertisingData = {0x08: b"Bose QC35 II"} if shortened else {0x09: b"Bose QC35 II"}
+  advertisement = SimpleNamespace(local_name="LE-Bose QC35 II", manufacturer_data={0x4001: bytes([0x00, 0x06, 0, 0, 0, 0, 0])}, platform_data=(None, {"AdvertisingData": advertisingData}))
+  return device, advertisement
+
+@pytest.fixture
+def parser(monkeypatch):
+  monkeypatch.setattr(BoseParser, "_isShortenedName", staticmethod(BoseParser._isShortenedNameLinux))
+  BoseParser.cache.clear()
+  yield BoseParser
+  BoseParser.cache.clear()
+
+
+def test_parse_cache_keeps_shortened_and_complete_names_apart(parser):
+  complete = parser.parse(*_advertisement())
+  assert complete.name == "Bose QC35 II"
+  assert (parser.cache.hits, parser.cache.misses) == (0, 1)
+  shortened = parser.parse(*_advertisement(shortened=True))
+  assert shortened.name == "Bose QC35 II…"
+  assert (parser.cache.hits, parser.cache.misses) == (0, 2)
+  assert parser.parse(*_advertisement()) == complete
+  assert parser.parse(*_advertisement(shortened=True)) == shortened
+  assert (parser.cache.hits, parser.cache.misses) == (2, 2)
+
+
+# expected values as decoded by the hand written parsers the layouts replaced, mac addresses as strings
+@pytest.mark.parametrize("format, data, expected", [
+  (BoseMFSParserLegacy, "1004402001b3010203040506aabbccddeeff", ((1, 0, 4), True, True, "01:02:03:04:05:06", True, "aa:bb:cc:dd:ee:ff", HEADPHONES, 0x4020, 1, True, False)),
+  (BoseMFSParserLegacy, "0000400c0200", ((0, 0, 0), False, False, None, False, None, SPEAKER, 0x400c, 2, False, False)),
+  (BoseMFSParserLegacy, "1234400c0200", ((1, 256, 4), False, False, None, False, None, SPEAKER, 0x400c, 2, False, False)), # the shifted minor
+  (BoseMFSParserLegacy, "0000400c0201", None), # connected without its mac address
+  (BoseMFSParserLegacy, "0000400c02", None),
+  (BoseMFSParser104, "0142930700000000000a0b0c", ((1, 0, 4), True, True, "00:00:00:0a:0b:0c", False, None, HEADPHONES, 0x42, 3, True, True)),
+  (BoseMFSParser104, "014231020000000000010203040506", ((1, 0, 4), False, True, "00:00:00:01:02:03", True, "00:00:00:04:05:06", SPEAKER, 0x42, 1, True, False)),
+  (BoseMFSParser104, "01423102000000000001020304050607", None), # one byte too long
+  (BoseMFSParser104, "0242000000000000000000", None),
+])
+def test_layouts_decode_like_the_original_parsers(format, data, expected):
+  values = format.decode(bytes.fromhex(data))
+  if values is not None:
+    values = tuple(str(value) if name.endswith("MacAddress") and value is not None else value for name, value in zip(format.OUTPUTS, values))
+  assert values == expected
+
+def test_unsupported_1_2_0_format_is_dropped(parser):
+  assert not BoseMFSParser120.accepts() and BoseMFSParser120.decode(bytes(16)) is None
+  assert parser.FORMATS[0x9E] is BoseMFSParser120 and not parser.accepts(0x409E)
+  device, advertisement = _advertisement()
+  advertisement.manufacturer_data = {0x409E: bytes(14)}
+  assert parser.parse(device, advertisement) is None
+
+def test_scanned_mac_addresses_are_strings(parser):
+  device, advertisement = _advertisement()
+  advertisement.manufacturer_data = {0x4201: bytes([0x30, 0x04, 0, 0, 0, 0, 0, 1, 2, 3, 4, 5, 6])}
+  scanned = parser.parse(device, advertisement)
+  assert (scanned.macAddress, scanned.device1Mac, scanned.device2Mac) == ("04:52:c7:00:00:01", "00:00:00:01:02:03", "00:00:00:04:05:06")
+  assert scanned.macAddress.upper() == device.address
+  json.dumps({name: getattr(scanned, name) for name in ("macAddress", "device1Mac", "device2Mac")})